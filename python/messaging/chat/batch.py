@@ -0,0 +1,130 @@
+"""Coalescing of frames into multipart messages, per topic
+
+Frames appended within a short interval of each other are sent
+together, as one multipart message per topic, rather than one
+message each. A batch is sent once `size` frames are pending or
+the first of them has waited `interval` seconds, whichever is
+first, bounding the latency added.
+     _______ _______ _______ _______
+    |       |       |       |       |
+    | topic | frame | frame |  ...  |
+    |_______|_______|_______|_______|
+
+Receivers handle each frame following the topic as a message
+of its own; an unbatched message is a batch of one.
+
+Usage:
+    >>> batch = Batch(socket.send_multipart, size=64, interval=0.001)
+    >>> batch.append('peer:markus\\x00', frame)
+    >>> chat.lib.spawn(batch.run)  # Flush as time is up
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import time
+import threading
+import collections
+
+__all__ = [
+    'Batch',
+]
+
+
+class Batch(object):
+    """Frames pending, per topic
+
+    Arguments:
+        send (callable): Sends a list of frames, e.g. the
+            `send_multipart` of a socket.
+        size (int): Frames pending, across topics, before sending
+        interval (float): Maximum seconds a frame is held back
+
+    Frames appended with a topic of None are sent without one.
+    Thread-safe; `send` is only ever called by one thread at a time.
+
+    """
+
+    def __init__(self, send, size=64, interval=0.001):
+        self.send = send
+        self.size = size
+        self.interval = interval
+
+        self.stats = collections.Counter()
+
+        self._pending = collections.OrderedDict()  # Frames, per topic
+        self._count = 0
+        self._deadline = None
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, topic, frame):
+        """Queue `frame` for sending on `topic`"""
+        with self._condition:
+            frames = self._pending.get(topic)
+            if frames is None:
+                frames = self._pending[topic] = list()
+
+            frames.append(frame)
+            self._count += 1
+
+            if self._count >= self.size:
+                self._flush()
+
+            elif self._deadline is None:
+                self._deadline = time.time() + self.interval
+                self._condition.notify()
+
+    def timeout(self):
+        """Return milliseconds until next flush is due, or None"""
+        if self._deadline is None:
+            return None
+
+        return max(0, int((self._deadline - time.time()) * 1000))
+
+    def flush(self, force=True):
+        """Send pending frames
+
+        Arguments:
+            force (bool): Send regardless of whether the
+                batch is full or its time is up.
+
+        """
+
+        with self._condition:
+            if not self._count:
+                return
+
+            if not force and time.time() < self._deadline:
+                return
+
+            self._flush()
+
+    def run(self):
+        """Flush batches as their time is up, in a thread of its own"""
+        with self._condition:
+            while True:
+                if self._deadline is None:
+                    self._condition.wait()
+                    continue
+
+                remaining = self._deadline - time.time()
+
+                if remaining > 0:
+                    self._condition.wait(remaining)
+                else:
+                    self._flush()
+
+    def _flush(self):
+        for topic, frames in self._pending.iteritems():
+            self.send(frames if topic is None else [topic] + frames)
+            self.stats['batches'] += 1
+
+        self.stats['sent'] += self._count
+
+        self._pending = collections.OrderedDict()
+        self._count = 0
+        self._deadline = None
@@ -0,0 +1,166 @@
+"""Orders served per second, by baristas and strategy
+
+Simulates baristas of random capacity making orders handed to them
+by `chat.dispatch.Dispatcher`, in simulated time. Each barista
+makes as many orders at once as it has cores, queueing the rest.
+Round-robin, ignoring load, is included for comparison.
+
+Optionally, one barista leaves halfway, its orders handed to others.
+
+Usage:
+    $ python bench/baristas.py --orders 20000 --baristas 1 2 4 8
+    $ python bench/baristas.py --leave
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import heapq
+import random
+import argparse
+import itertools
+import collections
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+import chat.dispatch
+
+
+class RoundRobin(object):
+    """Hands orders to each barista in turn, ignoring load"""
+
+    def __init__(self):
+        self.workers = list()
+        self.owners = dict()
+        self.turn = itertools.count()
+
+    def join(self, name, stats):
+        self.workers.append(name)
+        return list()
+
+    def leave(self, name):
+        self.workers.remove(name)
+        orders = sorted(order_id for order_id, owner
+                        in self.owners.items() if owner == name)
+        return [(order_id, self.assign(order_id)) for order_id in orders]
+
+    def assign(self, order_id):
+        worker = self.workers[next(self.turn) % len(self.workers)]
+        self.owners[order_id] = worker
+        return worker
+
+    def done(self, order_id):
+        self.owners.pop(order_id, None)
+
+
+def simulate(dispatcher, capacities, orders, rate, duration, leave):
+    """Return seconds taken to serve `orders`, and their latencies"""
+    running = dict((name, set()) for name in capacities)
+    queued = dict((name, collections.deque()) for name in capacities)
+    placed = dict()
+    latencies = list()
+
+    for name, cores in sorted(capacities.items()):
+        dispatcher.join(name, {'available_cores': cores})
+
+    events = [(index / rate, 'place', index) for index in xrange(orders)]
+    if leave and len(capacities) > 1:
+        events.append((orders / rate / 2, 'leave', sorted(capacities)[0]))
+    heapq.heapify(events)
+
+    def start(now, order_id, worker):
+        if len(running[worker]) < capacities[worker]:
+            running[worker].add(order_id)
+            heapq.heappush(events,
+                           (now + duration, 'done', (order_id, worker)))
+        else:
+            queued[worker].append(order_id)
+
+    now = 0
+    while events:
+        now, kind, data = heapq.heappop(events)
+
+        if kind == 'place':
+            placed[data] = now
+            start(now, data, dispatcher.assign(data))
+
+        elif kind == 'done':
+            order_id, worker = data
+
+            # Made by a barista since gone
+            if order_id not in running.get(worker, ()):
+                continue
+
+            running[worker].discard(order_id)
+            dispatcher.done(order_id)
+            latencies.append(now - placed.pop(order_id))
+
+            if queued[worker]:
+                start(now, queued[worker].popleft(), worker)
+
+        elif kind == 'leave':
+            running.pop(data)
+            queued.pop(data)
+            capacities.pop(data)
+
+            for order_id, worker in dispatcher.leave(data):
+                start(now, order_id, worker)
+
+    latencies.sort()
+    return now, latencies
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--baristas", type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=1,
+                        help='Seconds to make an order')
+    parser.add_argument("--rate", type=float, default=200,
+                        help='Orders placed per second')
+    parser.add_argument("--leave", action='store_true',
+                        help='One barista leaves halfway')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    template = "{:>14} {:>9} {:>10} {:>10} {:>10}"
+    print template.format('strategy', 'baristas', 'orders/s',
+                          'p50 (s)', 'p99 (s)')
+
+    for count in args.baristas:
+        rng = random.Random(args.seed)
+        capacities = dict(('barista-%i' % index, rng.randint(1, 12))
+                          for index in range(count))
+
+        for strategy in ('round-robin',) + chat.dispatch.STRATEGIES:
+            if strategy == 'round-robin':
+                dispatcher = RoundRobin()
+            else:
+                dispatcher = chat.dispatch.Dispatcher(
+                    strategy=strategy,
+                    random=random.Random(args.seed))
+
+            elapsed, latencies = simulate(dispatcher,
+                                          dict(capacities),
+                                          args.orders,
+                                          args.rate,
+                                          args.duration,
+                                          args.leave)
+
+            print template.format(
+                strategy,
+                count,
+                '%.1f' % (len(latencies) / elapsed),
+                '%.1f' % latencies[len(latencies) / 2],
+                '%.1f' % latencies[int(len(latencies) * 0.99)])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,155 @@
+"""Latency and throughput of letters per batch setting
+
+A swarm runs in a process of its own, batching what it publishes,
+while a peer sends letters in bursts, batching what it sends, to a
+recipient timing each letter from send to receipt. A setting of
+SIZE:MICROSECONDS applies to both sides; a size of 1 disables
+batching.
+
+Usage:
+    $ python bench/batching.py --settings 1:0 8:100 64:1000
+    $ python bench/batching.py --letters 50000 --burst 100
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import argparse
+import threading
+import multiprocessing
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+STOP = u'stop'
+
+
+def swarm(batch):
+    import chat.swarm
+
+    chat.swarm.Swarm(batch=batch)
+
+    while True:
+        time.sleep(1)
+
+
+def receive(sub, latencies, done):
+    import chat.codec
+
+    while True:
+        for body in sub.recv_multipart()[1:]:
+            envelope = chat.codec.loads(body)
+
+            if envelope.payload == STOP:
+                return done.set()
+
+            latencies.append(time.time() - envelope.payload)
+
+
+def run(size, interval, letters, burst, pause):
+    import zmq
+
+    import chat.lib
+    import chat.batch
+    import chat.codec
+    import chat.protocol
+
+    batch = None
+    if size > 1:
+        batch = {'size': size, 'interval': interval}
+
+    process = multiprocessing.Process(target=swarm, args=[batch])
+    process.daemon = True
+    process.start()
+
+    context = zmq.Context()
+
+    push = context.socket(zmq.PUSH)
+    push.connect("tcp://localhost:5555")
+
+    sub = context.socket(zmq.SUB)
+    sub.setsockopt(zmq.SUBSCRIBE, chat.protocol.topic('sink'))
+    sub.connect("tcp://localhost:5556")
+
+    send = push.send_multipart
+    if batch is not None:
+        sender = chat.batch.Batch(send=push.send_multipart, **batch)
+        send = lambda frames: sender.append(None, frames[0])
+        chat.lib.spawn(sender.run)
+
+    latencies = list()
+    done = threading.Event()
+    chat.lib.spawn(receive, args=[sub, latencies, done])
+
+    time.sleep(0.5)  # Let swarm start and subscriptions propagate
+
+    start = time.time()
+    for index in xrange(letters):
+        letter = chat.protocol.Envelope(payload=time.time(),
+                                        author='source',
+                                        recipients=['sink'],
+                                        type='letter')
+        send([chat.codec.dumps(letter)])
+
+        if index % burst == burst - 1:
+            time.sleep(pause)
+
+    stop = chat.protocol.Envelope(payload=STOP,
+                                  author='source',
+                                  recipients=['sink'],
+                                  type='letter')
+    send([chat.codec.dumps(stop)])
+
+    done.wait(30)
+    duration = time.time() - start
+
+    process.terminate()
+    process.join()
+
+    latencies.sort()
+    percentile = lambda p: latencies[int(len(latencies) * p)] * 1e6
+
+    return {'throughput': len(latencies) / duration,
+            'p50': percentile(0.5),
+            'p99': percentile(0.99)}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--settings", nargs='+',
+                        default=['1:0', '8:100', '64:100', '64:1000'],
+                        metavar='SIZE:MICROSECONDS')
+    parser.add_argument("--letters", type=int, default=20000)
+    parser.add_argument("--burst", type=int, default=50,
+                        help='Letters sent back-to-back')
+    parser.add_argument("--pause", type=float, default=0.001,
+                        help='Seconds between bursts')
+    args = parser.parse_args(args)
+
+    template = "{:>6} {:>10} {:>12} {:>10} {:>10}"
+    print template.format('size', 'interval', 'letters/s',
+                          'p50 (us)', 'p99 (us)')
+
+    for setting in args.settings:
+        size, interval = setting.split(':')
+        result = run(int(size),
+                     float(interval) / 1e6,
+                     args.letters,
+                     args.burst,
+                     args.pause)
+
+        print template.format(size,
+                              interval,
+                              '%.0f' % result['throughput'],
+                              '%.0f' % result['p50'],
+                              '%.0f' % result['p99'])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,94 @@
+"""Compare encoding/decoding cost and size of each codec
+
+Usage:
+    $ python bench/codec.py --number 20000
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import timeit
+import argparse
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+import chat.codec
+import chat.protocol
+
+
+def samples():
+    """Return typical messages, by name"""
+    letter = chat.protocol.Envelope(payload='how are you?',
+                                    author='markus',
+                                    recipients=['nikki', 'lukas'],
+                                    type='letter',
+                                    trace=['Peer.route_command<say>',
+                                           'Swarm.router'])
+
+    heartbeat = chat.protocol.Envelope(author='markus',
+                                       type='heartbeat',
+                                       trace=['Peer.heartbeat'])
+
+    item = chat.protocol.Coffee(name='latte', milk=True)
+    order = chat.protocol.Order(item, location='takeaway', cost=2.10)
+
+    log = chat.protocol.Log(name='Swarm.router',
+                            author='markus',
+                            level='info',
+                            string='letter was received',
+                            trace=letter.trace,
+                            envelope=letter)
+
+    query = chat.protocol.Query('stats', 'markus')
+    results = query.reply('nikki', {'cores': 8,
+                                    'available_cores': 3,
+                                    'memory': 16000,
+                                    'available_memory': 4312})
+
+    return [('letter', letter),
+            ('heartbeat', heartbeat),
+            ('order', order),
+            ('log', log),
+            ('query', query),
+            ('results', results)]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args(args)
+
+    template = "{:<10} {:<8} {:>6} {:>12} {:>12} {:>12}"
+    print template.format('message', 'codec', 'bytes',
+                          'encode (us)', 'decode (us)', 'relay (us)')
+
+    for name, obj in samples():
+        for key in ('json', 'binary'):
+            codec = chat.codec.by_name(key)
+            frame = codec.dumps(obj)
+
+            encode = timeit.timeit(lambda: codec.dumps(obj),
+                                   number=args.number)
+            decode = timeit.timeit(lambda: codec.loads(frame),
+                                   number=args.number)
+
+            # Decode and re-encode without reading the payload,
+            # as done by the swarm for e.g. letters.
+            relay = timeit.timeit(lambda: codec.dumps(codec.loads(frame)),
+                                  number=args.number)
+
+            print template.format(
+                name, key, len(frame),
+                '%.2f' % (encode / args.number * 1e6),
+                '%.2f' % (decode / args.number * 1e6),
+                '%.2f' % (relay / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
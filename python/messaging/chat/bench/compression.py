@@ -0,0 +1,175 @@
+"""Bandwidth saved by compression, against time spent on it
+
+Encodes letters, state replies and logs as the swarm does, then
+compresses each frame by threshold, level and dictionary, reporting
+bytes before and after along with microseconds spent either way.
+Frames below the threshold are left as-is, and cost nothing.
+
+Letters are made up, or read from the journal of a swarm; those
+of the first half train the dictionary, the rest are measured.
+
+Usage:
+    $ python bench/compression.py --thresholds 0 1024
+    $ python bench/compression.py --journal journal/journal.dat \\
+                                  --save letters.dict
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import random
+import argparse
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+import chat.codec
+import chat.journal
+import chat.protocol
+import chat.compression
+
+vocabulary = ['Hi there', 'hello', 'how are you?', "I'm fine thanks",
+              'and you?', 'coffee at 3?', 'see you later', 'sounds good']
+
+
+def made_up(count, seed):
+    """Return `count` letters between a handful of peers"""
+    rng = random.Random(seed)
+    names = [u'peer-%i' % index for index in range(20)]
+
+    letters = list()
+    for sequence in xrange(count):
+        author = rng.choice(names)
+        letters.append(chat.protocol.Envelope(
+            author=author,
+            recipients=rng.sample(names, rng.randint(1, 3)),
+            payload=' '.join(rng.sample(vocabulary, rng.randint(1, 3))),
+            type='letter',
+            timestamp=time.time() + sequence,
+            sequence=sequence))
+
+    return letters
+
+
+def journaled(path):
+    """Return letters of the journal at `path`"""
+    return [chat.codec.loads(data)
+            for kind, data in chat.journal.read(path)
+            if kind == chat.journal.LETTER]
+
+
+def frames(letters, codec, chunk=100):
+    """Return encoded frames of each kind, by kind"""
+    states = list()
+    for index in xrange(0, len(letters), chunk):
+        states.append(chat.protocol.Envelope(
+            author=u'peer-0',
+            recipients=[u'peer-0'],
+            payload={'epoch': 1,
+                     'sequence': index + chunk,
+                     'remaining': 0,
+                     'letters': [letter.to_dict() for letter
+                                 in letters[index:index + chunk]]},
+            type='state'))
+
+    logs = [chat.protocol.Log(name='Swarm.router',
+                              author=letter.author,
+                              level='info',
+                              string='letter was received',
+                              envelope=letter)
+            for letter in letters]
+
+    return [('letter', [codec.dumps(letter) for letter in letters]),
+            ('state', [codec.dumps(state) for state in states]),
+            ('log', [codec.dumps(log) for log in logs])]
+
+
+def measure(compressed, samples):
+    """Return bytes in and out, and seconds spent either way"""
+    started = time.time()
+    outputs = [compressed.compress(frame) for frame in samples]
+    compress = time.time() - started
+
+    started = time.time()
+    for output in outputs:
+        chat.compression.decompress(output)
+    decompress = time.time() - started
+
+    return (sum(len(frame) for frame in samples),
+            sum(len(output) for output in outputs),
+            compress, decompress)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--letters", type=int, default=4000)
+    parser.add_argument("--journal", metavar='PATH',
+                        help='Journal of letters, rather than made up')
+    parser.add_argument("--thresholds", type=int, nargs='+',
+                        default=[0, chat.compression.THRESHOLD],
+                        help='Bytes at or above which frames compress')
+    parser.add_argument("--levels", type=int, nargs='+', default=[1, 6],
+                        help='Levels of zlib')
+    parser.add_argument("--dictionary-size", type=int, default=16 * 1024,
+                        help='Bytes of trained dictionary')
+    parser.add_argument("--save", metavar='PATH',
+                        help='Write trained dictionary to PATH')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    if args.journal:
+        letters = journaled(args.journal)
+    else:
+        letters = made_up(args.letters, args.seed)
+
+    if len(letters) < 2:
+        parser.error("Too few letters: %i" % len(letters))
+
+    codec = chat.codec.by_name('binary')
+    half = len(letters) // 2
+
+    data = chat.compression.train([codec.dumps(letter)
+                                   for letter in letters[:half]],
+                                  size=args.dictionary_size)
+
+    if args.save:
+        chat.compression.Dictionary(data).save(args.save)
+
+    template = "{:<8} {:>9} {:>6} {:>10} {:>8} {:>11} {:>8} {:>15} {:>17}"
+    print template.format('frame', 'threshold', 'level', 'dictionary',
+                          'frames', 'bytes/frame', 'saved',
+                          'compress (us)', 'decompress (us)')
+
+    for kind, samples in frames(letters[half:], codec):
+        for threshold in args.thresholds:
+            for level in args.levels:
+                for primed in (False, True):
+                    dictionary = None
+                    if primed:
+                        dictionary = chat.compression.Dictionary(data, level)
+
+                    compressed = chat.compression.Compressed(
+                        codec, threshold, level, dictionary)
+
+                    before, after, compress, decompress = measure(
+                        compressed, samples)
+
+                    print template.format(
+                        kind, threshold, level,
+                        'yes' if primed else 'no',
+                        len(samples),
+                        '%i > %i' % (before // len(samples),
+                                     after // len(samples)),
+                        '%.1f%%' % (100.0 * (before - after) / before),
+                        '%.2f' % (compress / len(samples) * 1e6),
+                        '%.2f' % (decompress / len(samples) * 1e6))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,49 @@
+"""Cost of resolving a mediator, per message
+
+Compares instantiating the mediator of each message, as done
+prior to shared dispatch, with looking up its shared instance.
+
+Usage:
+    $ python bench/dispatch.py --number 100000
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import timeit
+import argparse
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+import chat.mediator.swarm
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args(args)
+
+    Factory = chat.mediator.swarm.Factory
+
+    def instantiate():
+        Factory().registry['orderPlacement'.lower()]()
+
+    def lookup():
+        Factory.lookup('orderPlacement')
+
+    for name, func in (('instantiate', instantiate),
+                       ('lookup', lookup)):
+        duration = min(timeit.repeat(func, number=args.number, repeat=5))
+        print "%-12s %.3f us" % (name, duration / args.number * 1e6)
+
+    print "Dispatched: %s" % dict(Factory.dispatched)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,179 @@
+"""Letter throughput of a federation per number of swarms
+
+Each swarm runs in a process of its own, along with a process
+sending letters from peers it owns and another receiving them.
+A fraction of letters is addressed to peers owned by other swarms
+and relayed there. Reports letters delivered per second across
+the federation.
+
+Usage:
+    $ python bench/federation.py --swarms 1 2 4 --letters 20000
+    $ python bench/federation.py --swarms 4 --remote 0.5
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import random
+import argparse
+import multiprocessing
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+import chat.federation
+
+PORT = 6000  # Of the first swarm, each taking 10 thereafter
+
+
+def owned(ring, node, prefix):
+    """Return first name starting with `prefix` owned by `node`"""
+    index = 0
+    while True:
+        name = '%s%i' % (prefix, index)
+        if ring.owner(name) == node:
+            return name
+        index += 1
+
+
+def swarm(address, nodes):
+    import chat.swarm
+
+    chat.swarm.Swarm(address=address, nodes=nodes)
+
+    while True:
+        time.sleep(1)
+
+
+def sender(address, author, sinks, remote, letters):
+    import zmq
+
+    import chat.codec
+    import chat.protocol
+
+    context = zmq.Context()
+    push = context.socket(zmq.PUSH)
+    push.connect(chat.federation.endpoints(address)['pull'])
+
+    local, others = sinks[address], [sink for node, sink
+                                     in sinks.items()
+                                     if node != address]
+
+    for index in xrange(letters):
+        recipient = local
+        if others and random.random() < remote:
+            recipient = random.choice(others)
+
+        letter = chat.protocol.Envelope(payload='hello',
+                                        author=author,
+                                        recipients=[recipient],
+                                        type='letter')
+        push.send(chat.codec.dumps(letter))
+
+    push.close()
+    context.term()
+
+
+def receiver(address, sink, expected, results):
+    import zmq
+
+    import chat.protocol
+
+    context = zmq.Context()
+    sub = context.socket(zmq.SUB)
+    sub.setsockopt(zmq.SUBSCRIBE, chat.protocol.topic(sink))
+    sub.setsockopt(zmq.RCVTIMEO, 5000)
+    sub.connect(chat.federation.endpoints(address)['pub'])
+
+    results.put(('ready', sink))
+
+    received, last = 0, time.time()
+    while received < expected:
+        try:
+            sub.recv_multipart()
+        except zmq.Again:
+            break
+        received += 1
+        last = time.time()
+
+    results.put(('done', (received, last)))
+
+
+def run(count, letters, remote):
+    nodes = ['localhost:%i' % (PORT + 10 * i) for i in range(count)]
+    ring = chat.federation.Ring(nodes)
+
+    processes = list()
+
+    def start(target, *args):
+        process = multiprocessing.Process(target=target, args=args)
+        process.daemon = True
+        process.start()
+        processes.append(process)
+
+    for node in nodes:
+        start(swarm, node, [other for other in nodes if other != node])
+
+    time.sleep(1)  # Let swarms find each other
+
+    sinks = dict((node, owned(ring, node, 'sink')) for node in nodes)
+    results = multiprocessing.Queue()
+
+    # Letters relayed away from a swarm are, on average, made up
+    # for by those relayed to it; each sink expects about as many
+    # as were sent to its swarm, and gives up once idle.
+    for node in nodes:
+        start(receiver, node, sinks[node], letters, results)
+
+    for node in nodes:
+        results.get()
+
+    time.sleep(0.5)  # Let subscriptions propagate
+
+    begin = time.time()
+    for node in nodes:
+        author = owned(ring, node, 'author')
+        start(sender, node, author, sinks, remote, letters)
+
+    received, end = 0, begin
+    for node in nodes:
+        status, (delivered, finished) = results.get()
+        received += delivered
+        end = max(end, finished)
+
+    for process in processes:
+        process.terminate()
+
+    return received / (end - begin)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--swarms", type=int, nargs='+',
+                        default=[1, 2, 4])
+    parser.add_argument("--letters", type=int, default=20000,
+                        help='Letters sent per swarm')
+    parser.add_argument("--remote", type=float, default=0.1,
+                        help='Fraction of letters relayed')
+    args = parser.parse_args(args)
+
+    template = "{:>8} {:>12} {:>10}"
+    print template.format('swarms', 'letters/s', 'scaling')
+
+    baseline = None
+    for count in args.swarms:
+        throughput = run(count, args.letters, args.remote)
+        baseline = baseline or throughput / count
+        print template.format(count,
+                              '%.0f' % throughput,
+                              '%.2fx' % (throughput / baseline))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
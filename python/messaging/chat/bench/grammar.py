@@ -0,0 +1,75 @@
+"""Cost of parsing an order, per parser
+
+Compares building an argparse parser per order, as orders were
+once parsed, with reusing one built up front and with a compiled
+grammar, see `chat.grammar`.
+
+Usage:
+    $ python bench/grammar.py --number 20000
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import timeit
+import argparse
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+import chat.lib
+import chat.grammar
+import chat.mediator.swarm
+
+COMMAND = 'latte --quantity 2 --milk --size large --takeaway'
+
+
+def coffee_parser():
+    parser = chat.lib.ArgumentParser(prog='order coffee')
+    parser.add_argument("name")
+    parser.add_argument("--quantity", default=1)
+    parser.add_argument("--milk", dest="milk", action="store_true")
+    parser.add_argument("--size", default='regular')
+    parser.add_argument("--no-milk", dest="milk", action="store_false")
+    parser.add_argument("--takeaway",
+                        dest="location",
+                        action="store_false",
+                        default=True)
+    return parser
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(args)
+
+    tokens = COMMAND.split()
+    prebuilt = coffee_parser()
+    grammar = chat.mediator.swarm.ORDERS['coffee']
+
+    candidates = [
+        ('argparse, built per order',
+         lambda: coffee_parser().parse_args(tokens)),
+        ('argparse, built once',
+         lambda: prebuilt.parse_args(tokens)),
+        ('grammar',
+         lambda: grammar.parse(tokens)),
+        ('grammar, tokenized',
+         lambda: grammar.parse(chat.grammar.tokenize(COMMAND))),
+    ]
+
+    for name, func in candidates:
+        duration = min(timeit.repeat(func,
+                                     number=args.number,
+                                     repeat=args.repeat))
+        print "%-28s %8.2f us" % (name, duration / args.number * 1e6)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,472 @@
+"""Throughput and latency of a swarm, under a mix of messages
+
+Starts a swarm, in this process or one of its own, along with peers
+sending a mix of messages at a fixed rate over inproc, ipc or tcp.
+Peers speak the protocol directly, as `chat.peer.Peer` does, and
+time each message from send to receipt of its reply.
+
+    letter     received by its recipient, another peer
+    state      last chunk of state received by the questioner
+    order      receipt of a coffee received by the orderer
+    heartbeat  sent only, no reply
+
+Swarm CPU is measured from /proc when it runs in a process of its
+own, and is that of the whole process otherwise.
+
+Results are written as JSON, such that runs may be compared.
+
+Usage:
+    $ python bench/harness.py --transport inproc --peers 10 --rate 5000
+    $ python bench/harness.py --transport ipc --processes 4
+    $ python bench/harness.py --mix letter=1 --output letters.json
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import threading
+import collections
+import multiprocessing
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+MIX = 'letter=0.7,state=0.1,order=0.1,heartbeat=0.1'
+KINDS = ('letter', 'state', 'order', 'heartbeat')
+
+# Kind of message sent, by type of its reply
+REPLIES = {
+    'letter': 'letter',
+    'state': 'state',
+    'orderReceipt': 'order',
+    'error': 'order',
+}
+
+
+def parse_mix(mix):
+    """Return kinds of message along with their weights"""
+    weights = list()
+
+    for item in mix.split(','):
+        kind, weight = item.split('=')
+
+        if kind not in KINDS:
+            raise ValueError("Unknown kind: %s" % kind)
+
+        weights.append((kind, float(weight)))
+
+    return weights
+
+
+def address_of(transport, port):
+    if transport == 'inproc':
+        return 'inproc://bench-swarm'
+
+    if transport == 'ipc':
+        return 'ipc:///tmp/bench-swarm-%i' % os.getpid()
+
+    return 'tcp://localhost:%i' % port
+
+
+def cpu_seconds(pid=None):
+    """Return seconds of CPU used by process `pid`, or this one"""
+    if pid is None:
+        user, system = os.times()[:2]
+        return user + system
+
+    try:
+        with open('/proc/%i/stat' % pid) as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except IOError:
+        return None
+
+    # utime and stime, fields 14 and 15 of proc(5)
+    return (int(fields[11]) + int(fields[12])) / float(
+        os.sysconf('SC_CLK_TCK'))
+
+
+def swarm(address, options, ready=None):
+    """Start swarm at `address`, serving forever if in a process"""
+    import chat.swarm
+
+    instance = chat.swarm.Swarm(address=address, **options)
+
+    if ready is None:
+        return instance
+
+    ready.set()
+
+    while True:
+        time.sleep(1)
+
+
+class Driver(object):
+    """Peers sending a mix of messages, timing their replies
+
+    Arguments:
+        address (str): Address of swarm
+        names (list): Names of peers
+        rate (float): Messages sent per second, across peers
+        mix (list): Kinds of message, along with their weights
+        size (int): Bytes of padding per letter
+        seed (int): Seed of random choices
+
+    """
+
+    def __init__(self, address, names, rate, mix, size=0, seed=0):
+        import zmq
+
+        import chat.codec
+        import chat.protocol
+        import chat.federation
+
+        self.zmq = zmq
+        self.codec = chat.codec.by_name('binary')
+        self.loads = chat.codec.loads  # Of any codec, compressed or not
+        self.protocol = chat.protocol
+
+        self.names = names
+        self.rate = rate
+        self.size = size
+        self.random = random.Random(seed)
+
+        self.kinds = [kind for kind, weight in mix]
+        self.cumulative = list()
+        total = 0
+        for kind, weight in mix:
+            total += weight
+            self.cumulative.append(total)
+
+        context = zmq.Context.instance()
+        endpoints = chat.federation.endpoints(address)
+
+        self.pushes = dict()
+        self.subs = dict()
+
+        for name in names:
+            push = context.socket(zmq.PUSH)
+            push.connect(endpoints['pull'])
+
+            sub = context.socket(zmq.SUB)
+            sub.setsockopt(zmq.SUBSCRIBE, chat.protocol.topic(name))
+            sub.connect(endpoints['pub'])
+
+            self.pushes[name] = push
+            self.subs[sub] = name
+
+        self.pulse = context.socket(zmq.PUSH)
+        self.pulse.connect(endpoints['pulse'])
+
+        # Times of messages awaiting their reply, by peer and kind
+        self.pending = collections.defaultdict(collections.deque)
+        self.catchup = dict()  # Last (epoch, sequence), by peer
+
+        self.sent = collections.Counter()
+        self.latencies = collections.defaultdict(list)
+        self.running = True
+
+    def choose(self):
+        point = self.random.random() * self.cumulative[-1]
+        for kind, bound in zip(self.kinds, self.cumulative):
+            if point < bound:
+                return kind
+        return self.kinds[-1]
+
+    def send(self, name, kind, now):
+        protocol = self.protocol
+
+        if kind == 'heartbeat':
+            return self.pulse.send(protocol.heartbeat(name))
+
+        if kind == 'letter':
+            recipient = self.random.choice(self.names)
+            envelope = protocol.Envelope(author=name,
+                                         payload=[now, 'x' * self.size],
+                                         recipients=[recipient],
+                                         type='letter')
+
+        elif kind == 'state':
+            epoch, sequence = self.catchup.get(name, (None, None))
+            envelope = protocol.Envelope(author=name,
+                                         payload={'authors': None,
+                                                  'epoch': epoch,
+                                                  'sequence': sequence},
+                                         type='stateQuery')
+            self.pending[(name, kind)].append(now)
+
+        else:
+            envelope = protocol.Envelope(author=name,
+                                         payload=['coffee', 'latte'],
+                                         type='orderPlacement')
+            self.pending[(name, kind)].append(now)
+
+        self.pushes[name].send(self.codec.dumps(envelope))
+
+    def receive(self):
+        """Time replies, until no longer running"""
+        zmq = self.zmq
+        poller = zmq.Poller()
+        for sub in self.subs:
+            poller.register(sub, zmq.POLLIN)
+
+        while self.running:
+            for sub, event in poller.poll(100):
+                name = self.subs[sub]
+
+                for body in sub.recv_multipart()[1:]:
+                    now = time.time()
+                    envelope = self.loads(body)
+                    kind = REPLIES.get(envelope.type)
+
+                    if kind == 'letter':
+                        sent = envelope.payload[0]
+
+                    elif kind == 'state':
+                        state = envelope.payload
+                        self.catchup[name] = (state['epoch'],
+                                              state['sequence'])
+
+                        if state['remaining']:
+                            continue
+
+                        sent = self._pop(name, kind)
+
+                    elif kind == 'order':
+                        sent = self._pop(name, kind)
+
+                    else:
+                        continue
+
+                    if sent is not None:
+                        self.latencies[kind].append(now - sent)
+
+    def run(self, duration, warmup=1.0, drain=1.0):
+        """Send for `duration` seconds, return samples"""
+
+        # Subscriptions propagate asynchronously
+        time.sleep(warmup)
+
+        receiver = threading.Thread(target=self.receive, name='receive')
+        receiver.daemon = True
+        receiver.start()
+
+        interval = 1.0 / self.rate
+        start = time.time()
+        due = start
+
+        while True:
+            now = time.time()
+
+            if now - start >= duration:
+                break
+
+            if due > now:
+                time.sleep(due - now)
+                now = due
+
+            name = self.random.choice(self.names)
+            kind = self.choose()
+            self.send(name, kind, now)
+            self.sent[kind] += 1
+            due += interval
+
+        elapsed = time.time() - start
+
+        time.sleep(drain)
+        self.running = False
+        receiver.join()
+
+        return {'sent': dict(self.sent),
+                'elapsed': elapsed,
+                'latencies': dict(self.latencies)}
+
+    def _pop(self, name, kind):
+        try:
+            return self.pending[(name, kind)].popleft()
+        except IndexError:
+            return None
+
+
+def drive(address, names, rate, mix, size, seed, duration, results=None):
+    """Run a driver, putting its samples into `results` if given"""
+    driver = Driver(address, names, rate, mix, size=size, seed=seed)
+    samples = driver.run(duration)
+
+    if results is None:
+        return samples
+
+    results.put(samples)
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(len(ordered) * fraction))
+    return ordered[index]
+
+
+def summarize(samples, cpu):
+    """Merge samples of every driver into a report"""
+    sent = collections.Counter()
+    latencies = collections.defaultdict(list)
+    elapsed = 0
+
+    for sample in samples:
+        sent.update(sample['sent'])
+        elapsed = max(elapsed, sample['elapsed'])
+
+        for kind, values in sample['latencies'].items():
+            latencies[kind].extend(values)
+
+    total = sum(sent.values())
+    received = sum(len(values) for values in latencies.values())
+
+    report = {
+        'sent': dict(sent),
+        'received': dict((kind, len(values))
+                         for kind, values in latencies.items()),
+        'sent_per_second': total / elapsed,
+        'received_per_second': received / elapsed,
+        'latency_ms': dict(),
+        'cpu_us_per_message': None,
+    }
+
+    for kind, values in latencies.items():
+        values.sort()
+        report['latency_ms'][kind] = dict(
+            (name, round(percentile(values, fraction) * 1e3, 3))
+            for name, fraction in (('p50', 0.5),
+                                   ('p99', 0.99),
+                                   ('p999', 0.999)))
+
+    if cpu is not None and total:
+        report['cpu_us_per_message'] = round(cpu / total * 1e6, 2)
+
+    return report
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transport", default='inproc',
+                        choices=['inproc', 'ipc', 'tcp'])
+    parser.add_argument("--port", type=int, default=5555,
+                        help='First of four ports, for tcp')
+    parser.add_argument("--peers", type=int, default=10)
+    parser.add_argument("--processes", type=int, default=1,
+                        help='Processes across which to spread peers, '
+                             'in addition to that of the swarm')
+    parser.add_argument("--rate", type=float, default=2000,
+                        help='Messages sent per second, across peers')
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--mix", default=MIX,
+                        help='Weight of each kind, e.g. %s' % MIX)
+    parser.add_argument("--size", type=int, default=0,
+                        help='Bytes of padding per letter')
+    parser.add_argument("--engine", default='threads',
+                        choices=['threads', 'reactor'])
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--batch", type=int,
+                        help='Envelopes published per message, at most')
+    parser.add_argument("--compress", type=int, metavar='BYTES',
+                        help='Frames compressed by the swarm, at least')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help='Path of JSON results, '
+                                         'defaults to standard out')
+    args = parser.parse_args(args)
+
+    # The swarm speaks its mind on standard out, keep it off results
+    stdout, sys.stdout = sys.stdout, sys.stderr
+
+    if args.transport == 'inproc' and args.processes > 1:
+        parser.error("inproc does not reach across processes")
+
+    mix = parse_mix(args.mix)
+    address = address_of(args.transport, args.port)
+    names = [u'bench-%i' % index for index in range(args.peers)]
+
+    options = {'engine': args.engine,
+               'workers': args.workers,
+               'logging': {'level': 'error'}}
+    if args.batch:
+        options['batch'] = {'size': args.batch, 'interval': 0.001}
+    if args.compress is not None:
+        options['compress'] = {'threshold': args.compress}
+
+    process = None
+
+    if args.transport == 'inproc':
+        swarm(address, options)
+    else:
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(target=swarm,
+                                          args=[address, options, ready])
+        process.daemon = True
+        process.start()
+        ready.wait()
+
+    cpu_before = cpu_seconds(process and process.pid)
+
+    if args.processes == 1:
+        samples = [drive(address, names, args.rate, mix,
+                         args.size, args.seed, args.duration)]
+    else:
+        results = multiprocessing.Queue()
+        drivers = list()
+
+        for index in range(args.processes):
+            driver = multiprocessing.Process(
+                target=drive,
+                args=[address,
+                      names[index::args.processes],
+                      args.rate / args.processes,
+                      mix,
+                      args.size,
+                      args.seed + index,
+                      args.duration,
+                      results])
+            driver.daemon = True
+            driver.start()
+            drivers.append(driver)
+
+        samples = [results.get() for _ in drivers]
+
+    cpu_after = cpu_seconds(process and process.pid)
+
+    cpu = None
+    if cpu_before is not None and cpu_after is not None:
+        cpu = cpu_after - cpu_before
+
+    report = {
+        'config': vars(args),
+        'host': socket.gethostname(),
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'cpu_scope': 'whole process' if process is None else 'swarm',
+        'results': summarize(samples, cpu),
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        stdout.write(output + '\n')
+
+    if process is not None:
+        process.terminate()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,93 @@
+"""Time taken to restore swarm state from journal
+
+Letters are written to a snapshot and journal tail, after
+which the time taken to replay both into a letter store is
+measured; i.e. the time until a restarted swarm is ready to serve.
+
+Usage:
+    $ python bench/journal.py --letters 1000000
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+import chat.codec
+import chat.store
+import chat.journal
+import chat.protocol
+
+vocabulary = ['Hi there', 'hello', 'how are you?', "I'm fine thanks",
+              'and you?']
+authors = ['markus', 'nikki', 'lukas', 'rocky', 'frank']
+
+
+def letters(count, start=0):
+    for index in xrange(start, start + count):
+        yield chat.protocol.Envelope(
+            payload=vocabulary[index % len(vocabulary)],
+            author=authors[index % len(authors)],
+            recipients=authors,
+            timestamp=1e9 + index,
+            type='letter')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--letters", type=int, default=100000)
+    parser.add_argument("--tail", type=float, default=0.1,
+                        help="Fraction of letters in journal tail")
+    args = parser.parse_args(args)
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        journal = chat.journal.Journal(directory, sync=False)
+
+        tail = int(args.letters * args.tail)
+        snapshot = args.letters - tail
+
+        start = time.time()
+        journal.snapshot((chat.journal.LETTER, chat.codec.dumps(letter))
+                         for letter in letters(snapshot))
+
+        for letter in letters(tail, start=snapshot):
+            journal.append(chat.journal.LETTER, chat.codec.dumps(letter))
+        journal.flush()
+        written = time.time() - start
+
+        size = (os.path.getsize(journal.snapshot_path) +
+                os.path.getsize(journal.journal_path))
+
+        start = time.time()
+        store = chat.store.LetterStore()
+        chat.journal.restore(journal.replay(),
+                             letters=store,
+                             peers=set(),
+                             orders=dict())
+        restored = time.time() - start
+
+        print "Letters:  %i (%i in tail)" % (len(store), tail)
+        print "Size:     %.1f MB" % (size / 1e6)
+        print "Written:  %.2f s" % written
+        print "Restored: %.2f s (%.0f letters/s)" % (
+            restored, len(store) / restored)
+
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,138 @@
+"""Orders in flight, by engine versus a thread per order
+
+Places coffee orders as fast as possible and waits for each to be
+served, with the recipe scaled down in time. The engine advances
+every order from one thread; the legacy approach allocates ids by
+scanning and makes each coffee in a thread of its own.
+
+Usage:
+    $ python bench/orders.py --orders 100000
+    $ python bench/orders.py --orders 100000 --legacy 2000
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import argparse
+import resource
+import threading
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+import chat.orders
+import chat.protocol
+
+
+def new_order():
+    return chat.protocol.Order(chat.protocol.Coffee(name='latte'),
+                               location='takeaway',
+                               cost=2.10)
+
+
+def scaled(recipe, scale):
+    return tuple((status, delay if delay is None else delay * scale)
+                 for status, delay in recipe)
+
+
+def engine(count, scale):
+    orders = chat.orders.OrderEngine(archive=count)
+    recipe = scaled(chat.orders.COFFEE, scale)
+
+    start = time.time()
+    for index in xrange(count):
+        orders.place(new_order(), recipe=recipe)
+    placed = time.time() - start
+
+    in_flight = sum(orders.counts().values())
+    threads = threading.active_count()
+
+    while orders.counts():
+        time.sleep(0.01)
+
+    return {'placed': placed,
+            'in_flight': in_flight,
+            'threads': threads,
+            'done': time.time() - start}
+
+
+def legacy(count, scale):
+    orders = dict()
+    lock = threading.Lock()
+
+    def make_coffee(order):
+        order.status = 'being prepared'
+        time.sleep(10 * scale)
+        order.status = 'in progress'
+        time.sleep(30 * scale)
+        order.status = 'served'
+
+    start = time.time()
+    workers = list()
+    for index in xrange(count):
+        order = new_order()
+
+        with lock:
+            order_id = 0
+            while order_id in orders:
+                order_id += 1
+            orders[order_id] = order
+
+        order.id = order_id
+        thread = threading.Thread(target=make_coffee, args=[order])
+        thread.daemon = True
+        thread.start()
+        workers.append(thread)
+    placed = time.time() - start
+
+    in_flight = sum(1 for order in orders.values()
+                    if order.status != 'served')
+    threads = threading.active_count()
+
+    for thread in workers:
+        thread.join()
+
+    return {'placed': placed,
+            'in_flight': in_flight,
+            'threads': threads,
+            'done': time.time() - start}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--legacy", type=int, default=0,
+                        help='Orders placed the legacy way, if any')
+    parser.add_argument("--scale", type=float, default=0.2,
+                        help='Factor of recipe durations, 10s and 30s')
+    args = parser.parse_args(args)
+
+    template = "{:>8} {:>8} {:>12} {:>10} {:>8} {:>10} {:>10}"
+    print template.format('engine', 'orders', 'placed/s', 'in flight',
+                          'threads', 'done (s)', 'rss (MB)')
+
+    runs = [('engine', engine, args.orders)]
+    if args.legacy:
+        runs.insert(0, ('legacy', legacy, args.legacy))
+
+    for name, func, count in runs:
+        result = func(count, args.scale)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+        print template.format(name,
+                              count,
+                              '%.0f' % (count / result['placed']),
+                              result['in_flight'],
+                              result['threads'],
+                              '%.2f' % result['done'],
+                              '%.0f' % rss)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,214 @@
+"""Letters recovered by reliable mode, under injected faults
+
+Simulates a peer sending letters to a swarm over a channel dropping
+frames at random, in either direction, in simulated time. Letters
+are numbered by `chat.reliable.Window`, encoded and decoded as on
+the wire, and delivered by `chat.reliable.Inbox`; acknowledgements
+are dropped just the same. Fire-and-forget is included for
+comparison, as window 0.
+
+Optionally, the swarm restarts halfway, losing every frame on its
+way in along with what it knew of the peer.
+
+Usage:
+    $ python bench/reliability.py --loss 0 0.01 0.1 --windows 8 64
+    $ python bench/reliability.py --restart
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import heapq
+import random
+import argparse
+import itertools
+import collections
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+import chat.codec
+import chat.protocol
+import chat.reliable
+
+
+def simulate(size, loss, letters, rate, latency, timeout, tick,
+             restart, seed):
+    """Return delivery of `letters` through a lossy channel"""
+    rng = random.Random(seed)
+    codec = chat.codec.by_name('binary')
+    window = chat.reliable.Window(size=size or 1, timeout=timeout)
+
+    # Replaced on restart, along with frames on their way in
+    swarm = {'inbox': chat.reliable.Inbox(size=size or 1),
+             'generation': 0}
+
+    placed = dict()  # Time of placement, by letter
+    delivered = collections.Counter()  # Deliveries, by letter
+    latencies = list()
+    frames = collections.Counter()
+
+    order = itertools.count()
+    events = [(index / rate, next(order), 'place', index)
+              for index in xrange(letters)]
+
+    if size:
+        events.append((tick, next(order), 'tick', None))
+        events.append((window.rto / 2, next(order), 'due', None))
+
+    if restart:
+        events.append((letters / rate / 2, next(order), 'restart', None))
+
+    heapq.heapify(events)
+
+    def transmit(now, envelope, to):
+        frames['sent'] += 1
+
+        if rng.random() < loss:
+            frames['dropped'] += 1
+            return
+
+        heapq.heappush(events, (now + latency, next(order), to,
+                                (swarm['generation'],
+                                 codec.dumps(envelope))))
+
+    def deliver(now, envelope):
+        index = envelope.payload
+        delivered[index] += 1
+
+        if delivered[index] == 1:
+            latencies.append(now - placed[index])
+
+    def acknowledge(now, number, gap=False):
+        transmit(now, chat.protocol.Envelope(
+            author='swarm',
+            payload={'number': number, 'gap': gap},
+            type='__ack__'), 'peer')
+
+    # Beyond which letters not yet delivered are given up on
+    horizon = letters / rate + 100 * timeout
+
+    now = 0
+    while events and len(delivered) < letters and now < horizon:
+        now, _, kind, data = heapq.heappop(events)
+
+        if kind == 'place':
+            placed[data] = now
+            envelope = chat.protocol.Envelope(author='markus',
+                                              payload=data,
+                                              type='letter')
+            if not size:
+                transmit(now, envelope, 'swarm')
+                continue
+
+            for envelope in window.send(envelope, now):
+                transmit(now, envelope, 'swarm')
+
+        elif kind == 'swarm':
+            generation, frame = data
+
+            # Sent to the swarm before it restarted
+            if generation != swarm['generation']:
+                continue
+
+            envelope = codec.loads(frame)
+
+            if not size:
+                deliver(now, envelope)
+                continue
+
+            letters_, ack = swarm['inbox'].receive(envelope)
+
+            for letter in letters_:
+                deliver(now, letter)
+
+            if ack is not None:
+                acknowledge(now, *ack)
+
+        elif kind == 'peer':
+            ack = codec.loads(data[1]).payload
+
+            for envelope in window.ack(ack['number'], ack['gap'], now):
+                transmit(now, envelope, 'swarm')
+
+        elif kind == 'tick':
+            for author, number in swarm['inbox'].flush():
+                acknowledge(now, number)
+
+            heapq.heappush(events, (now + tick, next(order), 'tick', None))
+
+        elif kind == 'due':
+            for envelope in window.due(now):
+                transmit(now, envelope, 'swarm')
+
+            heapq.heappush(events, (now + window.rto / 2, next(order),
+                                    'due', None))
+
+        elif kind == 'restart':
+            swarm['inbox'] = chat.reliable.Inbox(size=size or 1)
+            swarm['generation'] += 1
+
+    latencies.sort()
+
+    return {'delivered': len(delivered),
+            'duplicates': sum(delivered.values()) - len(delivered),
+            'retransmitted': window.stats['retransmitted'],
+            'frames': frames['sent'],
+            'elapsed': now,
+            'latencies': latencies}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--letters", type=int, default=20000)
+    parser.add_argument("--loss", type=float, nargs='+',
+                        default=[0, 0.001, 0.01, 0.1],
+                        help='Fraction of frames dropped, either way')
+    parser.add_argument("--windows", type=int, nargs='+',
+                        default=[0, 1, 8, 64],
+                        help='Letters in flight, 0 for fire-and-forget')
+    parser.add_argument("--rate", type=float, default=2000.0,
+                        help='Letters sent per second')
+    parser.add_argument("--latency", type=float, default=0.0005,
+                        help='Seconds a frame takes, one way')
+    parser.add_argument("--timeout", type=float, default=1.0,
+                        help='Seconds until a letter is sent again')
+    parser.add_argument("--tick", type=float, default=0.25,
+                        help='Seconds between acknowledgements due')
+    parser.add_argument("--restart", action='store_true',
+                        help='Swarm restarts halfway')
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(args)
+
+    template = "{:>7} {:>7} {:>11} {:>11} {:>14} {:>16} {:>10} {:>10}"
+    print template.format('window', 'loss', 'delivered', 'duplicates',
+                          'retransmitted', 'frames/letter', 'letters/s',
+                          'p99 (ms)')
+
+    for loss in args.loss:
+        for size in args.windows:
+            result = simulate(size, loss, args.letters, args.rate,
+                              args.latency, args.timeout, args.tick,
+                              args.restart, args.seed)
+
+            latencies = result['latencies']
+            p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+
+            print template.format(
+                size or '-',
+                loss,
+                '%.2f%%' % (100.0 * result['delivered'] / args.letters),
+                result['duplicates'],
+                result['retransmitted'],
+                '%.2f' % (float(result['frames']) / args.letters),
+                '%.0f' % (result['delivered'] / result['elapsed']),
+                '%.1f' % (p99 * 1e3))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
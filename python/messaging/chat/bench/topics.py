@@ -0,0 +1,129 @@
+"""Throughput of broadcast-and-filter versus per-recipient topics
+
+A PUB socket distributes letters between pairs of N subscribers,
+each SUB representing one peer. With broadcasting, every peer
+receives and decodes every letter only to discard most of them;
+with topics, each peer receives only its own.
+
+Usage:
+    $ python bench/topics.py --peers 2 8 32 --letters 20000
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import argparse
+import threading
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+import zmq
+
+import chat.codec
+import chat.protocol
+
+STOP = 'stop'
+
+
+def subscriber(context, name, endpoint, topics, counts, ready):
+    sub = context.socket(zmq.SUB)
+    sub.connect(endpoint)
+    for topic in topics:
+        sub.setsockopt(zmq.SUBSCRIBE, topic)
+    ready.set()
+
+    received = 0
+    while True:
+        topic, body = sub.recv_multipart()
+        if body == STOP:
+            break
+
+        envelope = chat.codec.loads(body)
+        if name in envelope.recipients:
+            received += 1
+
+    counts[name] = received
+    sub.close()
+
+
+def run(peers, letters, broadcast):
+    context = zmq.Context()
+    endpoint = 'inproc://bench'
+
+    pub = context.socket(zmq.PUB)
+    pub.setsockopt(zmq.SNDHWM, 0)
+    pub.bind(endpoint)
+
+    names = ['peer%i' % i for i in range(peers)]
+    counts = dict()
+    threads = list()
+
+    for name in names:
+        topics = (['default']
+                  if broadcast
+                  else [chat.protocol.topic(name), 'default'])
+        ready = threading.Event()
+        thread = threading.Thread(target=subscriber,
+                                  args=[context, name, endpoint,
+                                        topics, counts, ready])
+        thread.daemon = True
+        thread.start()
+        ready.wait()
+        threads.append(thread)
+
+    time.sleep(0.2)  # Let subscriptions propagate
+
+    start = time.time()
+    for index in xrange(letters):
+        author = names[index % peers]
+        recipient = names[(index + 1) % peers]
+        envelope = chat.protocol.Envelope(payload='hello',
+                                          author=author,
+                                          recipients=[recipient],
+                                          type='letter')
+        marshal = chat.codec.dumps(envelope)
+
+        if broadcast:
+            pub.send_multipart(['default', marshal])
+        else:
+            pub.send_multipart([chat.protocol.topic(recipient), marshal])
+
+    pub.send_multipart(['default', STOP])
+
+    for thread in threads:
+        thread.join()
+
+    duration = time.time() - start
+    pub.close()
+    context.term()
+
+    return letters / duration, sum(counts.values())
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peers", type=int, nargs='+',
+                        default=[2, 8, 32, 128])
+    parser.add_argument("--letters", type=int, default=20000)
+    args = parser.parse_args(args)
+
+    template = "{:>6} {:>16} {:>16}"
+    print template.format('peers', 'broadcast (l/s)', 'topics (l/s)')
+
+    for peers in args.peers:
+        broadcast, _ = run(peers, args.letters, broadcast=True)
+        topics, _ = run(peers, args.letters, broadcast=False)
+        print template.format(peers,
+                              '%.0f' % broadcast,
+                              '%.0f' % topics)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
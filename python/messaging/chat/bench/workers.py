@@ -0,0 +1,97 @@
+"""Letter throughput of the swarm per number of router workers
+
+Letters from many authors are interleaved with coffee orders,
+which take a while to place. Each configuration runs a swarm in
+a process of its own and reports letters delivered per second.
+
+Usage:
+    $ python bench/workers.py --workers 0 1 2 4 8 --letters 5000
+
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
+
+def run(workers, letters, orders, authors, results):
+    import zmq
+
+    import chat.codec
+    import chat.swarm
+    import chat.protocol
+
+    chat.swarm.Swarm(workers=workers)
+
+    context = zmq.Context()
+
+    push = context.socket(zmq.PUSH)
+    push.connect("tcp://localhost:5555")
+
+    sink = context.socket(zmq.SUB)
+    sink.setsockopt(zmq.SUBSCRIBE, chat.protocol.topic('sink'))
+    sink.connect("tcp://localhost:5556")
+
+    time.sleep(0.5)  # Let subscriptions propagate
+
+    every = max(1, letters / orders) if orders else None
+
+    start = time.time()
+    for index in xrange(letters):
+        if every and index % every == 0:
+            order = chat.protocol.Envelope(
+                payload=['coffee', 'latte'],
+                author='customer%i' % (index % authors),
+                type='orderPlacement')
+            push.send(chat.codec.dumps(order))
+
+        letter = chat.protocol.Envelope(
+            payload='hello',
+            author='author%i' % (index % authors),
+            recipients=['sink'],
+            type='letter')
+        push.send(chat.codec.dumps(letter))
+
+    for index in xrange(letters):
+        sink.recv_multipart()
+
+    results.put(letters / (time.time() - start))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs='+',
+                        default=[0, 1, 2, 4, 8])
+    parser.add_argument("--letters", type=int, default=5000)
+    parser.add_argument("--orders", type=int, default=10)
+    parser.add_argument("--authors", type=int, default=32)
+    args = parser.parse_args(args)
+
+    print "{:>8} {:>12}".format('workers', 'letters/s')
+
+    for workers in args.workers:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=run,
+            args=[workers, args.letters, args.orders,
+                  args.authors, results])
+        process.start()
+        rate = results.get()
+        process.terminate()
+        process.join()
+
+        print "{:>8} {:>12.0f}".format(workers, rate)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
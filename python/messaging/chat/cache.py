@@ -0,0 +1,164 @@
+"""Results of queries, cached per query and peer
+
+Answers to queries such as 'stats' change slowly, yet each query
+is a round trip to every peer asked. Results are kept per query
+name and peer for as long as the time-to-live of the query, during
+which queries are answered from memory.
+
+Past its time-to-live, a result is stale; for a while longer it is
+still answered with, while the peer is asked again in the background
+(stale-while-revalidate). Once too old, the peer is asked as though
+never answered.
+          fresh             stale              expired
+    |----------------|-----------------|---------------------->
+    answered         ttl               ttl + stale          time
+    (from memory)    (from memory,      (asked, waited on)
+                      asked again)
+
+Peers may also push results of their own, e.g. stats on a
+schedule, such that results rarely go stale at all.
+
+Usage:
+    >>> cache = ResultCache(ttls={'stats': 5})
+    >>> cache.put(results_of_markus)
+    >>> hits, ask = cache.split('stats', ['markus', 'nikki'])
+    >>> [results.peer for results in hits]
+    ['markus']
+    >>> ask
+    ['nikki']
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import time
+import threading
+import collections
+
+__all__ = [
+    'ResultCache',
+    'TTLS',
+]
+
+# Seconds results are fresh, per query; others are never cached
+TTLS = {
+    'stats': 5,
+    'services': 60,
+}
+
+
+class ResultCache(object):
+    """Most recent results, per query name and peer
+
+    Arguments:
+        ttls (dict): Seconds results are fresh, per query name
+        stale (float): Seconds past their time-to-live that results
+            are answered with while revalidated; defaults to the
+            time-to-live of each query.
+
+    Thread-safe.
+
+    """
+
+    def __init__(self, ttls=None, stale=None):
+        self.ttls = dict(TTLS if ttls is None else ttls)
+        self.stale = stale
+
+        self._results = dict()  # (results, time), by (name, peer)
+        self._refreshing = dict()  # Time asked, by (name, peer)
+        self._lock = threading.Lock()
+
+        self.stats = collections.Counter()
+
+    def __len__(self):
+        return len(self._results)
+
+    def cacheable(self, name):
+        return name in self.ttls
+
+    def put(self, results, now=None):
+        """Keep `results`, return whether they were cacheable"""
+        if results.name not in self.ttls:
+            return False
+
+        key = (results.name, results.peer)
+
+        with self._lock:
+            self._results[key] = (results, now or time.time())
+            self._refreshing.pop(key, None)
+
+        return True
+
+    def get(self, name, peer, now=None):
+        """Return results of `peer` to `name` along with their age
+
+        Returns (None, None) when not cached.
+
+        """
+
+        with self._lock:
+            results, stored = self._results.get((name, peer), (None, None))
+
+        if results is None:
+            return None, None
+
+        return results, (now or time.time()) - stored
+
+    def split(self, name, peers, now=None):
+        """Return results answered from memory, and peers to ask
+
+        Stale results are answered with and their peers asked,
+        unless already being asked. Expired results are dropped.
+
+        Arguments:
+            name (str): Name of query
+            peers (list): Peers queried
+
+        """
+
+        if name not in self.ttls:
+            return list(), list(peers)
+
+        now = now or time.time()
+        ttl = self.ttls[name]
+        stale = ttl if self.stale is None else self.stale
+
+        hits, ask = list(), list()
+
+        with self._lock:
+            for peer in peers:
+                key = (name, peer)
+                results, stored = self._results.get(key, (None, None))
+                age = None if results is None else now - stored
+
+                if age is not None and age < ttl:
+                    hits.append(results)
+                    self.stats['hit'] += 1
+                    continue
+
+                if age is not None and age < ttl + stale:
+                    hits.append(results)
+                    self.stats['stale'] += 1
+
+                    # Revalidate once per time-to-live
+                    asked = self._refreshing.get(key)
+                    if asked is None or now - asked >= ttl:
+                        self._refreshing[key] = now
+                        ask.append(peer)
+                    continue
+
+                if results is not None:
+                    self._results.pop(key)
+
+                self.stats['miss'] += 1
+                ask.append(peer)
+
+        return hits, ask
+
+    def discard(self, peer):
+        """Forget results of `peer`, e.g. once disconnected"""
+        with self._lock:
+            for key in [key for key in self._results if key[1] == peer]:
+                self._results.pop(key)
+                self._refreshing.pop(key, None)
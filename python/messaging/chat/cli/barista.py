@@ -1,63 +1,129 @@
-"""Baristas (a worker) serve coffee"""
+"""Baristas (a worker) serve coffee
+
+Baristas announce themselves to the swarm along with their stats,
+and make the orders handed to them, reporting each change in status.
+Run one or more alongside a swarm dispatching orders, see
+`chat.dispatch`.
+
+Usage:
+    $ python cli/swarm.py --dispatch least-loaded
+    $ python cli/barista.py barista-1
+    $ python cli/barista.py barista-2
+
+"""
 
 from __future__ import absolute_import
 
 # standard library
-# import time
+import os
+import sys
+import Queue
+import argparse
+
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
 
 # local library
-import lib
-import peer
-# import service
+import chat.lib
+import chat.peer
+import chat.orders
+import chat.protocol
 
 
-def divide(x, y):
-    return x / y
+class Barista(chat.peer.Peer):
+    """A Barista makes orders handed to it by the swarm
 
+    Arguments:
+        announce_interval (float): Seconds between announcements
+        scale (float): Factor of recipe durations
 
-def take_order(order):
-    print "Taking order"
-    # order = service.order_coffee(order)
+    """
 
-    # # Store order
-    # order.id = 0
-    # while order.id in self.orders:
-    #     order.id += 1
+    services = dict(chat.peer.Peer.services)  # Maintain super-services
 
-    # self.orders[order.id] = order
+    def __init__(self, name='barista', announce_interval=2, scale=1.0,
+                 **kwargs):
+        self.announce_interval = announce_interval
+        self.scale = scale
 
-    # lib.spawn(service.make_coffee,
-    #           args=[order],
-    #           name='order: %s' % order.id)
+        # Orders being made, each with its id in the swarm
+        self.orders = chat.orders.OrderEngine()
+        self.orders.changed.connect(self.on_changed)
+        self.dispatched = dict()
 
-    # return order
+        # Updates of orders, sent from a thread of their own rather
+        # than that of the order engine, see `report`
+        self.updates = Queue.Queue()
 
+        super(Barista, self).__init__(name=name, **kwargs)
 
-def serve_coffee(order):
-    pass
+    def start(self):
+        chat.lib.spawn(self.report, name='updates')
+        super(Barista, self).start()
 
+    def coroutines(self):
+        coroutines = super(Barista, self).coroutines()
+        coroutines.append(self.announce())
+        return coroutines
 
-services = peer.Peer.services  # Maintain super-services
-services['order'] = take_order
+    def announce(self):
+        """Coroutine announcing stats to swarm, see `chat.dispatch`"""
+        while True:
+            self.send(chat.protocol.Envelope(
+                payload=chat.lib.local_stats(),
+                type='__workerReady__'))
 
+            yield self.announce_interval
 
-class Barista(peer.Peer):
-    """A Barista orchestrates multiple services"""
+    def brew(self, order, recipe):
+        """Make `order` by the steps of `recipe`, by name"""
+        recipe = tuple((status, delay if delay is None else delay * self.scale)
+                       for status, delay in chat.orders.RECIPES[recipe])
 
-    # Baristas handle orders between each other
-    orders = dict()
-    services = services
+        self.dispatched[order] = order.id
+        self.orders.place(order, recipe=recipe)
 
-    def __init__(self, *args, **kwargs):
-        super(Barista, self).__init__(*args, **kwargs)
-        self.name = 'barista'
+    def on_changed(self, order):
+        """Queue status of `order` for the swarm, see `report`"""
+        order_id = self.dispatched.get(order)
 
+        if order_id is None:
+            return
 
-if __name__ == '__main__':
-    lib.clear_console()
-    barista = Barista()
+        if order.status == 'served':
+            self.dispatched.pop(order)
+
+        self.updates.put(chat.protocol.Envelope(
+            payload={'id': order_id, 'status': order.status},
+            type='__orderUpdate__'))
 
-    print "Barista online.."
+    def report(self):
+        """Send updates of orders, in order of change"""
+        while True:
+            self.send(self.updates.get())
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("name", nargs='?', default='barista')
+    parser.add_argument('-s', "--swarm", action='append', dest='swarms',
+                        metavar='ADDRESS',
+                        help='Address of swarm, once per federated swarm')
+    parser.add_argument("--announce-interval", type=float, default=2,
+                        help='Seconds between stats sent to the swarm')
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help='Factor of recipe durations, 10s and 30s')
+    args = parser.parse_args(args)
+
+    barista = Barista(name=args.name,
+                      swarms=args.swarms,
+                      announce_interval=args.announce_interval,
+                      scale=args.scale)
+
+    print "%s online.." % args.name.title()
 
     while True:
         try:
@@ -76,3 +142,8 @@ if __name__ == '__main__':
         except Exception as e:
             print e
             break
+
+
+if __name__ == '__main__':
+    chat.lib.clear_console()
+    main(sys.argv[1:])
@@ -3,21 +3,42 @@
 This WORKER listens for logging messages and
 displays them in the termial.
 
+Traces of envelopes, see `chat.tracing`, are collected into
+histograms of the time spent per hop, reported periodically.
+
+Usage:
+    $ python cli/swarm.py --trace-sample 0.01
+    $ python cli/logger.py --interval 10
+
 """
 
 from __future__ import absolute_import
 
 # standard library
+import os
+import sys
 import time
-import json
 import logging
+import argparse
 
 # dependencies
 import zmq
 
+path = __file__
+for i in range(3):
+    path = os.path.dirname(path)
+
+sys.path.insert(0, path)
+
 # local library
-import lib
-import protocol
+import chat.lib
+import chat.codec
+import chat.compression
+import chat.flow
+import chat.tracing
+import chat.protocol
+import chat.federation
+import chat.mediator.swarm
 
 
 def get_formatter():
@@ -48,25 +69,67 @@ logger = setup_log()
 logger.setLevel(logging.DEBUG)
 
 
-def main():
+def report(collector, interval):
+    """Print time spent per hop, every `interval` seconds"""
+    while True:
+        time.sleep(interval)
+
+        if collector.traces:
+            print "\n%i traces\n%s\n" % (collector.traces,
+                                          collector.report())
+
+
+def main(address, collector):
     context = zmq.Context()
     socket = context.socket(zmq.SUB)
-    socket.connect('tcp://localhost:5556')
+    socket.connect(chat.federation.endpoints(address)['pub'])
     socket.setsockopt(zmq.SUBSCRIBE, 'log')
 
+    # Span ids of mediators, such that hops are reported by name
+    for key in chat.mediator.swarm.Factory.registry:
+        chat.tracing.span('mediate.' + key)
+
     print "Running logger.."
 
+    tracker = chat.flow.Tracker()
+
     while True:
-        header, body = socket.recv_multipart()
-        message = json.loads(body)
-        log = protocol.Log.from_dict(message)
+        # Logs arrive in batches
+        frames = socket.recv_multipart()
+
+        missed = tracker.observe(frames[0])
+        if missed:
+            logger.warning("%i batches of logs missed" % missed)
+
+        for body in frames[1:]:
+            log = chat.codec.loads(body, legacy=chat.protocol.Log)
+
+            if log.name == 'trace':
+                collector.add(log.trace)
+                continue
 
-        write = getattr(logger, log.level)
-        write("{}: {}".format(log.trace, log.string))
+            write = getattr(logger, log.level)
+            write("{}: {}".format(log.name, log.string))
 
 
 if __name__ == '__main__':
-    lib.spawn(main)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--address", default='localhost:5555',
+                        help='Address of swarm')
+    parser.add_argument("--interval", type=float, default=10,
+                        help='Seconds between reports of traces')
+    parser.add_argument("--compress-dictionary", metavar='PATH',
+                        help='Dictionary of swarms compressing with one')
+    args = parser.parse_args()
+
+    if args.compress_dictionary:
+        chat.compression.register(
+            chat.compression.Dictionary.load(args.compress_dictionary))
+
+    collector = chat.tracing.Collector()
+
+    chat.lib.spawn(main, args=[args.address, collector])
+    chat.lib.spawn(report, args=[collector, args.interval])
 
     while True:
         try:
@@ -0,0 +1,90 @@
+"""Options shared by command-line interfaces of swarm and peer
+
+Each option is added to a parser by `add_<option>`, and its
+arguments parsed into those of `chat.swarm.Swarm` or
+`chat.peer.Peer` by `<option>`.
+
+Usage:
+    >>> parser = argparse.ArgumentParser()
+    >>> add_batch(parser, 'Envelopes sent per message, at most')
+    >>> batch(parser.parse_args(['--batch', '10']))
+    {'size': 10, 'interval': 0.001}
+
+"""
+
+from __future__ import absolute_import
+
+# local library
+import chat.compression
+
+__all__ = [
+    'add_batch',
+    'add_hwm',
+    'add_compress',
+    'batch',
+    'hwms',
+    'compress',
+]
+
+
+def add_batch(parser, help):
+    parser.add_argument("--batch", type=int, help=help)
+    parser.add_argument("--batch-interval", type=float, default=1000,
+                        help='Microseconds an envelope is held back')
+
+
+def add_hwm(parser, sockets):
+    parser.add_argument("--hwm", action='append', default=[],
+                        metavar='SOCKET=MESSAGES',
+                        help='High-water mark of %s' % sockets)
+
+
+def add_compress(parser):
+    parser.add_argument("--compress", type=int, metavar='BYTES',
+                        help='Compress frames of at least BYTES')
+    parser.add_argument("--compress-level", type=int, default=1,
+                        help='Level of zlib, 1 being fastest')
+    parser.add_argument("--compress-dictionary", metavar='PATH',
+                        help='Dictionary priming compression, '
+                             'see bench/compression.py')
+
+
+def batch(args):
+    """Return arguments to chat.batch.Batch, None if not batching"""
+    if not args.batch:
+        return None
+
+    return {'size': args.batch,
+            'interval': args.batch_interval / 1e6}
+
+
+def hwms(args):
+    """Return high-water marks, by socket"""
+    hwms = dict()
+    for hwm in args.hwm:
+        socket, messages = hwm.split('=')
+        hwms[socket] = int(messages)
+
+    return hwms
+
+
+def compress(args):
+    """Return arguments to chat.compression.Compressed, if any
+
+    A dictionary is registered for decoding whether or not frames
+    are compressed with it.
+
+    """
+
+    dictionary = None
+    if args.compress_dictionary:
+        dictionary = chat.compression.Dictionary.load(
+            args.compress_dictionary, args.compress_level)
+        chat.compression.register(dictionary)
+
+    if args.compress is None:
+        return None
+
+    return {'threshold': args.compress,
+            'level': args.compress_level,
+            'dictionary': dictionary}
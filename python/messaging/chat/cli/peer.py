@@ -15,6 +15,7 @@ sys.path.insert(0, path)
 
 import chat.lib
 import chat.peer
+import chat.cli.options
 
 vocabulary = ['Hi there', 'hello', 'how are you?', "I'm fine thanks",
               'and you?']
@@ -26,10 +27,52 @@ def main(args=None):
     parser.add_argument('-p', "--peer", action='append', dest='peers',
                         default=[], help='Add peer to talk to')
     parser.add_argument('-c', "--chatter", action='store_true', default=False)
+    parser.add_argument("--engine", default='threads',
+                        choices=['threads', 'reactor'])
+    parser.add_argument('-s', "--swarm", action='append', dest='swarms',
+                        metavar='ADDRESS',
+                        help='Address of swarm, once per federated swarm')
+    chat.cli.options.add_batch(parser, 'Envelopes sent per message, at most')
+    parser.add_argument("--push-stats", type=float, metavar='SECONDS',
+                        help='Push stats to the swarm every SECONDS')
+    parser.add_argument("--trace-sample", type=float, default=0.0,
+                        help='Fraction of envelopes whose hops are traced')
+    chat.cli.options.add_hwm(parser, 'push or sub')
+    parser.add_argument("--flow-interval", type=float,
+                        help='Seconds between reports of messages missed, '
+                             'none by default')
+    parser.add_argument("--metrics-port", type=int,
+                        help='Serve metrics as text over HTTP')
+    parser.add_argument("--reliable", action='store_true',
+                        help='Send letters again until acknowledged')
+    parser.add_argument("--window", type=int, default=64,
+                        help='Letters in flight at once, when reliable')
+    parser.add_argument("--retransmit-timeout", type=float, default=1,
+                        help='Seconds until a letter is sent again')
+    chat.cli.options.add_compress(parser)
     args = parser.parse_args(args)
 
+    reliable = None
+    if args.reliable:
+        reliable = {'size': args.window,
+                    'timeout': args.retransmit_timeout}
+
+    metrics = None
+    if args.metrics_port:
+        metrics = {'port': args.metrics_port}
+
     peer = chat.peer.Peer(name=args.name,
-                          peers=args.peers)
+                          peers=args.peers,
+                          engine=args.engine,
+                          swarms=args.swarms,
+                          batch=chat.cli.options.batch(args),
+                          stats_interval=args.push_stats,
+                          trace_sample=args.trace_sample,
+                          metrics=metrics,
+                          hwms=chat.cli.options.hwms(args),
+                          flow_interval=args.flow_interval,
+                          reliable=reliable,
+                          compress=chat.cli.options.compress(args))
 
     while True:
         try:
@@ -1,7 +1,7 @@
-
 import os
 import sys
 import time
+import argparse
 
 path = __file__
 for i in range(3):
@@ -10,11 +10,111 @@ for i in range(3):
 sys.path.insert(0, path)
 
 import chat.lib
+import chat.cache
+import chat.cli.options
+import chat.dispatch
+import chat.flow
 import chat.swarm
 
 
-def main():
-    chat.swarm.Swarm()
+def main(args=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-letters", type=int, dest='max_count',
+                        help='Letters kept per peer')
+    parser.add_argument("--max-age", type=float,
+                        help='Seconds letters are kept')
+    parser.add_argument("--max-bytes", type=int,
+                        help='Bytes of letters kept in total')
+    parser.add_argument("--journal",
+                        help='Directory in which to persist state')
+    parser.add_argument("--workers", type=int, default=0,
+                        help='Threads routing messages in parallel')
+    parser.add_argument("--engine", default='threads',
+                        choices=['threads', 'reactor'],
+                        help='Serve sockets from a thread each, '
+                             'or a single reactor')
+    parser.add_argument("--address", default='localhost:5555',
+                        help='Host and first of four ports to listen on')
+    parser.add_argument("--node", action='append', dest='nodes',
+                        metavar='ADDRESS',
+                        help='Address of another swarm to federate with')
+    chat.cli.options.add_batch(parser,
+                               'Envelopes published per message, at most')
+    parser.add_argument("--ttl", action='append', default=[],
+                        metavar='QUERY=SECONDS',
+                        help='Seconds results of QUERY are cached, '
+                             '0 to never cache')
+    parser.add_argument("--dispatch", choices=chat.dispatch.STRATEGIES,
+                        help='Hand coffee orders to baristas by load, '
+                             'rather than making them here')
+    parser.add_argument("--trace-sample", type=float, default=0.0,
+                        help='Fraction of envelopes whose hops are traced')
+    parser.add_argument("--metrics", action='store_true',
+                        help='Keep metrics, published on the metrics topic')
+    parser.add_argument("--metrics-interval", type=float, default=5,
+                        help='Seconds between metrics published')
+    parser.add_argument("--metrics-port", type=int,
+                        help='Also serve metrics as text over HTTP')
+    chat.cli.options.add_hwm(parser, 'pub, pull or push')
+    parser.add_argument("--flow-policy", default='catchup',
+                        choices=chat.flow.POLICIES,
+                        help='What to do about peers too slow to keep up')
+    parser.add_argument("--flow-lag", type=int,
+                        default=chat.flow.HWMS['pub'],
+                        help='Messages a peer may be behind')
+    parser.add_argument("--flow-pause", type=float, default=5,
+                        help='Seconds a throttled peer is not sent to')
+    chat.cli.options.add_compress(parser)
+    parser.add_argument("--log-level", default='info',
+                        help='Minimum level of published logs')
+    parser.add_argument("--log-sample", action='append', default=[],
+                        metavar='TYPE=RATE',
+                        help='Fraction of logs published about TYPE')
+    args = parser.parse_args(args)
+
+    retention = {'max_count': args.max_count,
+                 'max_age': args.max_age,
+                 'max_bytes': args.max_bytes}
+
+    sampling = dict()
+    for sample in args.log_sample:
+        typ, rate = sample.split('=')
+        sampling[typ] = float(rate)
+
+    logging = {'level': args.log_level,
+               'sampling': sampling}
+
+    ttls = dict(chat.cache.TTLS)
+    for ttl in args.ttl:
+        query, seconds = ttl.split('=')
+        ttls[query] = float(seconds)
+        if not ttls[query]:
+            ttls.pop(query)
+
+    flow = {'policy': args.flow_policy,
+            'lag': args.flow_lag,
+            'pause': args.flow_pause}
+
+    metrics = None
+    if args.metrics or args.metrics_port:
+        metrics = {'interval': args.metrics_interval,
+                   'port': args.metrics_port}
+
+    chat.swarm.Swarm(retention=retention,
+                     journal=args.journal and os.path.abspath(args.journal),
+                     logging=logging,
+                     workers=args.workers,
+                     engine=args.engine,
+                     address=args.address,
+                     nodes=args.nodes,
+                     batch=chat.cli.options.batch(args),
+                     ttls=ttls,
+                     dispatch=args.dispatch,
+                     trace_sample=args.trace_sample,
+                     metrics=metrics,
+                     hwms=chat.cli.options.hwms(args),
+                     flow=flow,
+                     compress=chat.cli.options.compress(args))
 
     while True:
         try:
@@ -25,4 +125,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    main(sys.argv[1:])
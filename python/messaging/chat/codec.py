@@ -0,0 +1,448 @@
+"""Over-the-wire encoding of protocol objects
+
+Every frame starts with a version byte, identifying the codec
+used to encode it, followed by a kind byte identifying the
+protocol object within.
+     _________ ______ _______________
+    |         |      |               |
+    | version | kind |     body      |
+    |_________|______|_______________|
+
+Decoding is driven by the version byte alone, such that peers
+encoding with different codecs may still talk to each other.
+Frames compressed by `chat.compression` are flagged in its place,
+and decompressed first.
+Frames without a version byte (i.e. plain JSON as sent by
+`send_json`) are decoded as legacy JSON.
+
+Versions are not negotiated. Frames of older versions are
+decoded, but always written in the latest, which peers and
+swarms predating it fail to decode; a swarm, its federation
+and its peers are therefore upgraded together.
+
+Usage:
+    >>> frame = dumps(Envelope(payload='hello', type='letter'))
+    >>> loads(frame).payload
+    'hello'
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import json
+import struct
+
+# local library
+import chat.lib
+import chat.protocol
+import chat.compression
+
+__all__ = [
+    'Json',
+    'Binary',
+    'dumps',
+    'loads',
+    'by_name',
+    'by_version'
+]
+
+# Protocol objects eligible for encoding, by kind-byte
+kinds = {
+    'E': chat.protocol.Envelope,
+    'L': chat.protocol.Log,
+    'Q': chat.protocol.Query,
+    'R': chat.protocol.QueryResults,
+    'O': chat.protocol.Order,
+}
+
+kinds_by_class = dict((cls, kind) for kind, cls in kinds.iteritems())
+
+versions = dict()  # Codecs, by version-byte
+
+
+class Codec(object):
+    """Encode and decode protocol objects
+
+    Subclasses are registered by `key` and `version`; the
+    version byte is prepended to each frame. They provide
+    `encode` and `decode` of a dictionary, or override
+    `dumps` and `loads` altogether.
+
+    """
+
+    __metaclass__ = chat.lib.DynamicRegistry
+    abstract = True
+
+    key = None
+    version = None
+
+    def dumps(self, obj):
+        kind = kinds_by_class[type(obj)]
+        return self.version + kind + self.encode(obj.to_dict())
+
+    def loads(self, data):
+        kind = data[1:2]
+
+        if not kind:
+            raise ValueError("Truncated frame")
+
+        try:
+            cls = kinds[kind]
+        except KeyError:
+            raise ValueError("Unknown kind: %r" % kind)
+
+        return cls.from_dict(self.decode(data[2:]))
+
+
+class Json(Codec):
+    """Plain JSON, human-readable and universally supported"""
+
+    key = 'json'
+    version = '\x01'
+
+    def encode(self, dic):
+        return json.dumps(dic, separators=(',', ':'))
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+# Type tags of Binary
+_NONE = 'N'
+_TRUE = 'T'
+_FALSE = 'F'
+_BYTE = 'b'
+_INT = 'i'
+_LONG = 'I'
+_FLOAT = 'd'
+_STR = 's'
+_UNICODE = 'u'
+_LIST = 'l'
+_DICT = 'm'
+
+_byte = struct.Struct('!b')
+_int = struct.Struct('!i')
+_long = struct.Struct('!q')
+_float = struct.Struct('!d')
+_length = struct.Struct('!I')
+
+
+def _pack(value, parts):
+    """Append tagged binary representation of `value` to `parts`"""
+    typ = type(value)
+
+    if typ is str:
+        parts.append(_STR + _length.pack(len(value)) + value)
+
+    elif value is None:
+        parts.append(_NONE)
+
+    elif typ is list or typ is tuple or typ is set:
+        parts.append(_LIST + _length.pack(len(value)))
+        for item in value:
+            _pack(item, parts)
+
+    elif typ is unicode:
+        value = value.encode('utf-8')
+        parts.append(_UNICODE + _length.pack(len(value)) + value)
+
+    elif typ is float:
+        parts.append(_FLOAT + _float.pack(value))
+
+    elif typ is bool:
+        parts.append(_TRUE if value else _FALSE)
+
+    elif typ is int or typ is long:
+        if -128 <= value < 128:
+            parts.append(_BYTE + _byte.pack(value))
+        elif -2147483648 <= value < 2147483648:
+            parts.append(_INT + _int.pack(value))
+        else:
+            parts.append(_LONG + _long.pack(value))
+
+    elif typ is dict:
+        parts.append(_DICT + _length.pack(len(value)))
+        for key, item in value.iteritems():
+            _pack(key, parts)
+            _pack(item, parts)
+
+    elif hasattr(value, 'to_dict'):
+        _pack(value.to_dict(), parts)
+
+    else:
+        raise TypeError("%r is not serialisable" % value)
+
+
+def _unpack_str(data, offset):
+    length, = _length.unpack_from(data, offset)
+    offset += 4
+    return data[offset:offset + length], offset + length
+
+
+def _unpack_unicode(data, offset):
+    value, offset = _unpack_str(data, offset)
+    return value.decode('utf-8'), offset
+
+
+def _unpack_list(data, offset):
+    length, = _length.unpack_from(data, offset)
+    offset += 4
+    value = list()
+    append = value.append
+    for i in xrange(length):
+        item, offset = _unpacker[data[offset]](data, offset + 1)
+        append(item)
+    return value, offset
+
+
+def _unpack_dict(data, offset):
+    length, = _length.unpack_from(data, offset)
+    offset += 4
+    value = dict()
+    for i in xrange(length):
+        key, offset = _unpacker[data[offset]](data, offset + 1)
+        value[key], offset = _unpacker[data[offset]](data, offset + 1)
+    return value, offset
+
+
+def _unpack_fixed(struct_):
+    size = struct_.size
+    unpack_from = struct_.unpack_from
+
+    def unpack(data, offset):
+        return unpack_from(data, offset)[0], offset + size
+
+    return unpack
+
+
+def _unpack_const(const):
+    return lambda data, offset: (const, offset)
+
+
+# Decoders, by tag
+_unpacker = {
+    _STR: _unpack_str,
+    _UNICODE: _unpack_unicode,
+    _NONE: _unpack_const(None),
+    _TRUE: _unpack_const(True),
+    _FALSE: _unpack_const(False),
+    _FLOAT: _unpack_fixed(_float),
+    _BYTE: _unpack_fixed(_byte),
+    _INT: _unpack_fixed(_int),
+    _LONG: _unpack_fixed(_long),
+    _LIST: _unpack_list,
+    _DICT: _unpack_dict,
+}
+
+
+def _unpack(data, offset):
+    """Return value at `offset` in `data` and offset of the next"""
+    try:
+        unpack = _unpacker[data[offset]]
+    except KeyError:
+        raise ValueError("Unknown tag %r at offset %i"
+                         % (data[offset], offset))
+
+    return unpack(data, offset + 1)
+
+
+def _extend(schemas, **fields):
+    """Return `schemas` with `fields` appended, per kind"""
+    extended = dict(schemas)
+    for kind, added in fields.iteritems():
+        extended[kind] = schemas[kind] + added
+    return extended
+
+
+# Field order per kind, by version of Binary. Fields are only ever
+# appended, under a version of their own, such that frames of older
+# peers and journals decode as they were written.
+_layouts = dict()
+
+_layouts['\x02'] = {
+    'E': ('type', 'author', 'recipients', 'timestamp', 'trace'),
+    'L': ('name', 'author', 'timestamp', 'level',
+          'string', 'trace'),
+    'Q': ('name', 'questioner', 'payload'),
+    'R': ('name', 'peer', 'questioner', 'payload'),
+    'O': ('item', 'location', 'cost', 'status',
+          'payment', 'id'),
+}
+
+# Letters numbered in order of storage, see `chat.store`
+_layouts['\x05'] = _extend(_layouts['\x02'], E=('sequence',))
+
+# Answers correlated with their query, see `chat.gather`
+_layouts['\x06'] = _extend(_layouts['\x05'],
+                           Q=('id',),
+                           R=('id', 'missing'))
+
+# Letters sent reliably, see `chat.reliable`
+_layouts['\x07'] = _extend(_layouts['\x06'], E=('window',))
+
+
+class Binary(Codec):
+    """Compact tagged binary
+
+    Fields of each kind are written in a fixed order, such that
+    only their values go across the wire; keys are implied.
+
+    Envelopes are split into a routing header and an opaque
+    payload blob, trailing the header.
+         _________ ___ _____________________ ______________
+        |         |   |                     |              |
+        | version | E |  header (fields)     | payload blob |
+        |_________|___|_____________________|______________|
+
+    Only the header is decoded by `loads`; the payload is decoded
+    upon first access and, if never accessed, passed through
+    as-is by `dumps`. The same goes for envelopes embedded in logs.
+
+    Frames are written in the latest layout, and read in that of
+    their version byte, see `layouts`. Older readers only know
+    older layouts; see the note on upgrading, above.
+
+    """
+
+    key = 'binary'
+    version = '\x07'
+
+    layouts = _layouts
+    schemas = layouts[version]
+
+    def dumps(self, obj):
+        kind = kinds_by_class[type(obj)]
+        parts = [self.version + kind]
+
+        if kind == 'E':
+            for field in self.schemas[kind]:
+                _pack(getattr(obj, field), parts)
+
+            blob = obj.raw_payload(self)
+            if blob is None:
+                _pack(obj.payload, parts)
+            else:
+                parts.append(blob)
+
+            return ''.join(parts)
+
+        if kind == 'L':
+            for field in self.schemas[kind]:
+                _pack(getattr(obj, field), parts)
+
+            # Embedded envelope, as a frame of its own
+            envelope = obj.envelope
+            if isinstance(envelope, dict):
+                envelope = chat.protocol.Envelope.from_dict(envelope)
+            _pack(envelope and self.dumps(envelope), parts)
+
+            return ''.join(parts)
+
+        dic = obj.to_dict()
+        for field in self.schemas[kind]:
+            _pack(dic[field], parts)
+
+        return ''.join(parts)
+
+    def loads(self, data):
+        kind = data[1:2]
+
+        if not kind:
+            raise ValueError("Truncated frame")
+
+        try:
+            schemas = self.layouts[data[0]]
+        except KeyError:
+            raise ValueError("Unknown codec version: %r" % data[0])
+
+        try:
+            schema = schemas[kind]
+        except KeyError:
+            raise ValueError("Unknown kind: %r" % kind)
+
+        offset = 2
+        dic = dict()
+
+        # Frames cut short run out of bytes, or into garbage tags
+        try:
+            for field in schema:
+                dic[field], offset = _unpack(data, offset)
+
+            if kind == 'L':
+                envelope, offset = _unpack(data, offset)
+
+        except (IndexError, KeyError, struct.error):
+            raise ValueError("Truncated frame")
+
+        if kind == 'E':
+            return chat.protocol.Envelope.lazy(blob=data[offset:],
+                                               codec=self,
+                                               **dic)
+
+        if kind == 'L':
+            dic['envelope'] = envelope and self.loads(envelope)
+
+        return kinds[kind].from_dict(dic)
+
+    def encode(self, dic):
+        parts = list()
+        _pack(dic, parts)
+        return ''.join(parts)
+
+    def decode(self, data):
+        try:
+            return _unpack(data, 0)[0]
+        except (IndexError, KeyError, struct.error):
+            raise ValueError("Truncated frame")
+
+
+def by_name(name):
+    try:
+        return Codec.dispatch[name.lower()]
+    except KeyError:
+        raise ValueError("%r not available" % name)
+
+
+def by_version(version):
+    try:
+        return versions[version]
+    except KeyError:
+        raise ValueError("Unknown codec version: %r" % version)
+
+
+# Including versions of older layouts, still decoded
+for _codec in Codec.dispatch.itervalues():
+    for _version in getattr(_codec, 'layouts', None) or [_codec.version]:
+        versions[_version] = _codec
+
+default = versions[Binary.version]
+
+
+def dumps(obj, codec=None):
+    """Encode `obj` using `codec`, defaults to `default`"""
+    return (codec or default).dumps(obj)
+
+
+def loads(data, legacy=chat.protocol.Envelope):
+    """Decode `data`, regardless of the codec used to encode it
+
+    Arguments:
+        data (str): Encoded frame
+        legacy (class): Protocol object to decode frames
+            without a version byte into.
+
+    """
+
+    if data[:1] in ('{', '['):
+        return legacy.from_dict(json.loads(data))
+
+    if data[:1] in (chat.compression.ZLIB, chat.compression.PRIMED):
+        data = chat.compression.decompress(data)
+
+    try:
+        codec = versions[data[0]]
+    except (KeyError, IndexError):
+        raise ValueError("Unknown codec version: %r" % data[:1])
+
+    return codec.loads(data)
@@ -0,0 +1,237 @@
+"""Compression of large frames, flagged by their first byte
+
+Frames at or above a threshold are compressed with zlib at its
+fastest level, and marked by a first byte of their own in place of
+the version byte of their codec. Smaller frames, and those that do
+not shrink, are sent as encoded, such that they pay nothing.
+     ______ __________________________________
+    |      |                                  |
+    | \\x03 |  zlib(frame)                     |
+    |______|__________________________________|
+     ______ ____________ _____________________
+    |      |            |                     |
+    | \\x04 | dictionary |  zlib(frame), primed |
+    |______|____________|_____________________|
+                uint32
+
+Small frames, such as letters, compress poorly on their own, having
+nothing to refer back to. A dictionary of typical frames, shared by
+sender and receiver, gives them something to refer to, see `train`.
+Frames compressed with one carry its id, and are only decoded where
+the same dictionary was registered.
+
+Usage:
+    >>> codec = Compressed(chat.codec.by_name('binary'), threshold=512)
+    >>> frame = codec.dumps(state)
+    >>> chat.codec.loads(frame).payload['letters']
+    [...]
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import zlib
+import struct
+import collections
+
+__all__ = [
+    'Compressed',
+    'Dictionary',
+    'train',
+    'register',
+    'decompress',
+    'ZLIB',
+    'PRIMED',
+    'THRESHOLD',
+    'LIMIT',
+]
+
+ZLIB = '\x03'  # Compressed frame
+PRIMED = '\x04'  # Compressed frame, primed with a dictionary
+
+THRESHOLD = 1024  # Bytes, below which frames are left as-is
+WINDOW = 32 * 1024  # Bytes of dictionary zlib may refer back to
+LIMIT = 16 * 1024 * 1024  # Bytes a frame may decompress to, at most
+
+_id = struct.Struct('>I')
+_dictionaries = dict()  # Dictionary, by id
+
+
+class Dictionary(object):
+    """Bytes typical of frames, priming compression of each
+
+    The zlib of Python 2 takes no preset dictionary; instead, a
+    stream is primed by compressing the dictionary, and each frame
+    compressed by a copy of the primed stream, as is each decoded.
+
+    Arguments:
+        data (str): Typical frames, most common last, see `train`
+        level (int): Level of zlib, 1 being fastest
+
+    """
+
+    def __init__(self, data, level=1):
+        self.data = data[-WINDOW:]
+        self.id = _id.pack(zlib.crc32(self.data) & 0xffffffff)
+        self.level = level
+
+        compressor = zlib.compressobj(level)
+        primer = (compressor.compress(self.data) +
+                  compressor.flush(zlib.Z_SYNC_FLUSH))
+
+        decompressor = zlib.decompressobj()
+        decompressor.decompress(primer)
+
+        self._compressor = compressor
+        self._decompressor = decompressor
+
+    @classmethod
+    def load(cls, path, level=1):
+        with open(path, 'rb') as f:
+            return cls(f.read(), level)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.data)
+
+    def compress(self, frame):
+        compressor = self._compressor.copy()
+        return compressor.compress(frame) + compressor.flush()
+
+    def decompress(self, data, limit=LIMIT):
+        return _inflate(self._decompressor.copy(), data, limit)
+
+
+def _inflate(decompressor, data, limit):
+    """Return `data` decompressed, unless beyond `limit` bytes
+
+    Frames come from the network, and a small one may otherwise
+    expand to any size.
+
+    """
+
+    # One byte over, such that nothing is left pending within
+    try:
+        frame = decompressor.decompress(data, limit + 1)
+    except zlib.error as e:
+        raise ValueError("Corrupt frame: %s" % e)
+
+    if len(frame) > limit or decompressor.unconsumed_tail:
+        raise ValueError("Frame exceeds %i bytes" % limit)
+
+    return frame
+
+
+def train(samples, size=16 * 1024):
+    """Return dictionary of `samples`, e.g. frames of letters
+
+    Distinct samples are kept, latest last, up to `size` bytes;
+    recent frames being most like those to come.
+
+    """
+
+    seen = set()
+    kept = list()
+    total = 0
+
+    for sample in reversed(samples):
+        if sample in seen:
+            continue
+
+        seen.add(sample)
+        kept.append(sample)
+        total += len(sample)
+
+        if total >= size:
+            break
+
+    return ''.join(reversed(kept))[-size:]
+
+
+def register(dictionary):
+    """Decode frames primed with `dictionary`, see `decompress`"""
+    _dictionaries[dictionary.id] = dictionary
+
+
+def decompress(data, limit=LIMIT):
+    """Return frame of `data`, as encoded prior to compression
+
+    Raises:
+        ValueError if corrupt, or decompressing beyond `limit` bytes
+
+    """
+
+    flag = data[:1]
+
+    if flag == ZLIB:
+        return _inflate(zlib.decompressobj(), data[1:], limit)
+
+    if flag == PRIMED:
+        try:
+            dictionary = _dictionaries[data[1:5]]
+        except KeyError:
+            raise ValueError("Unknown dictionary: %r" % data[1:5])
+
+        return dictionary.decompress(data[5:], limit)
+
+    return data
+
+
+class Compressed(object):
+    """Codec compressing frames of another, above `threshold`
+
+    Arguments:
+        codec (chat.codec.Codec): Codec encoding each frame
+        threshold (int): Bytes at or above which frames are
+            compressed
+        level (int): Level of zlib, 1 being fastest
+        dictionary (Dictionary): Dictionary priming compression,
+            registered for decoding too; None compresses each
+            frame on its own
+
+    """
+
+    def __init__(self, codec, threshold=THRESHOLD, level=1,
+                 dictionary=None):
+        self.codec = codec
+        self.threshold = threshold
+        self.level = level
+        self.dictionary = dictionary
+
+        if dictionary is not None:
+            register(dictionary)
+
+        self.key = codec.key
+        self.version = codec.version
+
+        self.stats = collections.Counter()
+
+    def dumps(self, obj):
+        return self.compress(self.codec.dumps(obj))
+
+    def loads(self, data):
+        return self.codec.loads(decompress(data))
+
+    def compress(self, frame):
+        """Return `frame`, compressed if large enough to pay off"""
+        if len(frame) < self.threshold:
+            return frame
+
+        if self.dictionary is not None:
+            compressed = (PRIMED + self.dictionary.id +
+                          self.dictionary.compress(frame))
+        else:
+            compressed = ZLIB + zlib.compress(frame, self.level)
+
+        self.stats['bytes_in'] += len(frame)
+
+        if len(compressed) >= len(frame):
+            self.stats['incompressible'] += 1
+            self.stats['bytes_out'] += len(frame)
+            return frame
+
+        self.stats['compressed'] += 1
+        self.stats['bytes_out'] += len(compressed)
+
+        return compressed
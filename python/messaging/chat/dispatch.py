@@ -0,0 +1,227 @@
+"""Orders dispatched to workers, by their load
+
+Rather than the swarm making every order itself, orders are handed
+to workers, e.g. baristas, having announced themselves along with
+their stats, see `chat.lib.local_stats`. Each worker is given a
+capacity from the cores it has available, and orders are assigned
+to the worker least loaded relative to its capacity.
+                            ________
+                       .-->| worker |  2/4
+     ________         /    |________|
+    |        |  order/      ________
+    | swarm  |----------->| worker |  1/8  <-- least loaded
+    |________|       \    |________|
+                      \     ________
+                       '-->| worker |  3/4
+                           |________|
+
+Two strategies are supported.
+
+- 'least-loaded' considers every worker, which is exact, but
+  costs time linear in workers and sends bursts of orders to
+  the same worker in between announcements.
+- 'power-of-two' considers two workers at random, picking the
+  lesser loaded, which is nearly as balanced at a constant cost.
+
+Orders arriving while there are no workers are held in a backlog,
+assigned once a worker joins. Orders of workers leaving, e.g. no
+longer heard from, are assigned anew, ahead of the backlog.
+
+Usage:
+    >>> dispatcher = Dispatcher(strategy='least-loaded')
+    >>> dispatcher.join('barista-1', {'available_cores': 4})
+    []
+    >>> dispatcher.assign(0)
+    'barista-1'
+    >>> dispatcher.done(0)
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import random
+import threading
+import collections
+
+__all__ = [
+    'Dispatcher',
+    'Worker',
+    'STRATEGIES',
+]
+
+STRATEGIES = ('least-loaded', 'power-of-two')
+
+
+class Worker(object):
+    """Worker known to the dispatcher
+
+    Arguments:
+        name (str): Name of peer
+        capacity (int): Orders handled at once, without queueing
+        memory (float): Megabytes available, breaking ties
+
+    """
+
+    def __init__(self, name, capacity=1, memory=0):
+        self.name = name
+        self.capacity = capacity
+        self.memory = memory
+        self.assigned = set()  # Ids of orders in progress
+        self.completed = 0
+
+    @property
+    def load(self):
+        return len(self.assigned) / float(self.capacity)
+
+    def key(self):
+        """Sort key, least loaded first"""
+        return self.load, -self.memory
+
+    def to_dict(self):
+        return {'assigned': len(self.assigned),
+                'capacity': self.capacity,
+                'utilization': round(self.load, 2),
+                'completed': self.completed}
+
+
+class Dispatcher(object):
+    """Assignments of orders to workers
+
+    Arguments:
+        strategy (str): Name of strategy, one of `STRATEGIES`
+        random (random.Random): Source of choices, for power-of-two
+
+    Returns of `join` and `leave` are lists of (order id,
+    worker) assigned from the backlog as a result, left to the
+    caller to send. Thread-safe.
+
+    """
+
+    def __init__(self, strategy='least-loaded', random=random):
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown strategy: %s" % strategy)
+
+        self.strategy = strategy
+        self.random = random
+
+        self._workers = collections.OrderedDict()  # Worker, by name
+        self._owners = dict()  # Name of worker, by order id
+        self._backlog = collections.deque()  # Order ids, oldest first
+        self._lock = threading.Lock()
+
+        self.stats = collections.Counter()
+
+    def __contains__(self, name):
+        return name in self._workers
+
+    @property
+    def backlog(self):
+        return len(self._backlog)
+
+    def owner(self, order_id):
+        """Return name of worker assigned `order_id`, if any"""
+        return self._owners.get(order_id)
+
+    def join(self, name, stats):
+        """Add or update worker `name` with its `stats`
+
+        Arguments:
+            name (str): Name of worker
+            stats (dict): As returned by `chat.lib.local_stats`
+
+        """
+
+        capacity = max(1, int(stats.get('available_cores') or 0))
+        memory = stats.get('available_memory') or 0
+
+        with self._lock:
+            worker = self._workers.get(name)
+
+            if worker is None:
+                worker = self._workers[name] = Worker(name)
+                self.stats['joined'] += 1
+
+            worker.capacity = capacity
+            worker.memory = memory
+
+            return self._drain()
+
+    def leave(self, name):
+        """Remove worker `name`, assigning its orders anew"""
+        with self._lock:
+            worker = self._workers.pop(name, None)
+
+            if worker is None:
+                return list()
+
+            # Oldest orders first, ahead of the backlog
+            for order_id in sorted(worker.assigned, reverse=True):
+                self._owners.pop(order_id, None)
+                self._backlog.appendleft(order_id)
+                self.stats['requeued'] += 1
+
+            self.stats['left'] += 1
+            return self._drain()
+
+    def assign(self, order_id):
+        """Return worker assigned `order_id`, or None if backlogged"""
+        with self._lock:
+            worker = self._choose()
+
+            if worker is None:
+                self._backlog.append(order_id)
+                self.stats['backlogged'] += 1
+                return None
+
+            self._assign(order_id, worker)
+            return worker.name
+
+    def done(self, order_id):
+        """Release `order_id` from its worker, e.g. once served"""
+        with self._lock:
+            name = self._owners.pop(order_id, None)
+            worker = self._workers.get(name)
+
+            if worker is not None:
+                worker.assigned.discard(order_id)
+                worker.completed += 1
+                self.stats['completed'] += 1
+
+    def utilization(self):
+        """Return load of each worker, by name"""
+        with self._lock:
+            return dict((name, worker.to_dict())
+                        for name, worker in self._workers.iteritems())
+
+    def _choose(self):
+        if not self._workers:
+            return None
+
+        workers = self._workers.values()
+
+        if self.strategy == 'power-of-two' and len(workers) > 2:
+            workers = self.random.sample(workers, 2)
+
+        return min(workers, key=Worker.key)
+
+    def _assign(self, order_id, worker):
+        worker.assigned.add(order_id)
+        self._owners[order_id] = worker.name
+        self.stats['assigned'] += 1
+
+    def _drain(self):
+        """Assign backlogged orders, if there are workers to go to"""
+        assigned = list()
+
+        while self._backlog:
+            worker = self._choose()
+
+            if worker is None:
+                break
+
+            order_id = self._backlog.popleft()
+            self._assign(order_id, worker)
+            assigned.append((order_id, worker.name))
+
+        return assigned
@@ -0,0 +1,129 @@
+"""Expiry of keys not refreshed within a timeout
+
+Deadlines are kept in a hashed timer wheel; each slot holds the
+keys due within one `resolution` of time. Refreshing moves a key
+between two slots and reaping only visits slots whose time has
+passed, such that neither depends on the total number of keys.
+             _______
+         .--|   0   |--> {markus}
+        /   |_______|
+       |    |   1   |--> {}
+  cursor    |_______|
+       |    |   2   |--> {nikki, lukas}
+        \\   |_______|
+         '->|   3   |--> {}   <-- due
+            |_______|
+
+Usage:
+    >>> heartbeats = Expiry(timeout=4)
+    >>> heartbeats.refresh('markus')
+    >>> heartbeats.expire()  # Returns keys whose time is up
+    []
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import math
+import time
+import threading
+
+__all__ = [
+    'Expiry',
+]
+
+
+class Expiry(object):
+    """Keys expiring `timeout` seconds after their latest refresh
+
+    Arguments:
+        timeout (float): Seconds until a key expires
+        resolution (float): Seconds per slot; keys expire
+            at most this much later than their deadline.
+
+    """
+
+    def __init__(self, timeout, resolution=0.25):
+        self.timeout = timeout
+        self.resolution = resolution
+
+        # One full turn of the wheel covers the timeout,
+        # such that no slot ever holds keys from a later turn.
+        count = int(math.ceil(timeout / resolution)) + 2
+        self._slots = [set() for i in range(count)]
+
+        self._deadlines = dict()  # Deadline, per key
+        self._scheduled = dict()  # Slot, per key
+        self._cursor = self._tick(time.time())
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def get(self, key, default=None):
+        """Return time at which `key` was last refreshed"""
+        deadline = self._deadlines.get(key)
+        if deadline is None:
+            return default
+        return deadline - self.timeout
+
+    def refresh(self, key, now=None):
+        """Push deadline of `key` forwards by `timeout`"""
+        deadline = (now or time.time()) + self.timeout
+        slot = self._tick(deadline) % len(self._slots)
+
+        with self._lock:
+            self._deadlines[key] = deadline
+
+            previous = self._scheduled.get(key)
+            if previous == slot:
+                return
+
+            if previous is not None:
+                self._slots[previous].discard(key)
+
+            self._slots[slot].add(key)
+            self._scheduled[key] = slot
+
+    def discard(self, key):
+        """Forget about `key` without it expiring"""
+        with self._lock:
+            self._deadlines.pop(key, None)
+            slot = self._scheduled.pop(key, None)
+            if slot is not None:
+                self._slots[slot].discard(key)
+
+    def expire(self, now=None):
+        """Remove and return keys whose deadline has passed"""
+        now = now or time.time()
+
+        # Slots are due once their whole span has passed
+        due = self._tick(now) - 1
+        expired = list()
+
+        with self._lock:
+
+            # Nothing to catch up on past a full turn
+            if due - self._cursor >= len(self._slots):
+                self._cursor = due - len(self._slots) + 1
+
+            while self._cursor <= due:
+                slot = self._cursor % len(self._slots)
+
+                for key in list(self._slots[slot]):
+                    if self._deadlines[key] <= now:
+                        self._slots[slot].discard(key)
+                        self._deadlines.pop(key)
+                        self._scheduled.pop(key)
+                        expired.append(key)
+
+                self._cursor += 1
+
+        return expired
+
+    def _tick(self, timestamp):
+        return int(timestamp / self.resolution)
@@ -0,0 +1,245 @@
+"""Sharing of peers across many swarms, by consistent hashing
+
+Each peer is owned by one swarm, or node, found by hashing its name
+onto a ring of nodes. Peers connect to their owner, and a node only
+forwards, or relays, what is addressed to peers owned elsewhere.
+            .---- node A ----.
+          /                    \\
+      markus                  nikki --> node B
+         |                      |
+      node A                    |
+          \\                    /
+            '---- node B ----'
+
+Each node is known by the address peers connect to, e.g.
+"localhost:5555", and listens on four consecutive ports.
+
+    port + 0: incoming messages (PULL)
+    port + 1: outgoing messages (XPUB)
+    port + 2: incoming heartbeats (PULL)
+    port + 3: incoming relays from other nodes (PULL)
+
+Relays are multipart messages of a kind and its data, using the
+kinds of `chat.journal` along with NODE and HANDOFF.
+
+Usage:
+    >>> ring = Ring(['localhost:5555', 'localhost:5565'])
+    >>> ring.owner('markus')
+    'localhost:5555'
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import bisect
+import hashlib
+import threading
+
+# dependencies
+import zmq
+
+__all__ = [
+    'Ring',
+    'Federation',
+    'endpoints',
+    'NODE',
+    'HANDOFF',
+    'ROUTE',
+]
+
+# Kinds of relays, in addition to those of chat.journal
+NODE = 'N'  # Address of node joining, utf-8
+HANDOFF = 'H'  # Encoded letter, stored but not published
+ROUTE = 'R'  # Encoded envelope, routed as though received
+
+
+def endpoints(address, bind=False):
+    """Return endpoints of node at `address`, per socket
+
+    Addresses of the inproc and ipc transports, e.g. "inproc://swarm"
+    or "ipc:///tmp/swarm", are suffixed per socket instead; inproc
+    only reaches sockets of the same process, and context.
+
+    Arguments:
+        address (str): Host and first port of node, e.g. "localhost:5555"
+        bind (bool): Return endpoints to bind, on all interfaces
+
+    """
+
+    if address.startswith(('inproc://', 'ipc://')):
+        return dict((name, "%s-%s" % (address, name))
+                    for name in ('pull', 'pub', 'pulse', 'relay'))
+
+    if address.startswith('tcp://'):
+        address = address[len('tcp://'):]
+
+    host, port = address.rsplit(':', 1)
+    host = '*' if bind else host
+    port = int(port)
+
+    return {
+        'pull': "tcp://%s:%i" % (host, port),
+        'pub': "tcp://%s:%i" % (host, port + 1),
+        'pulse': "tcp://%s:%i" % (host, port + 2),
+        'relay': "tcp://%s:%i" % (host, port + 3),
+    }
+
+
+def _hash(key):
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+class Ring(object):
+    """Consistent hash of keys onto nodes
+
+    Each node is placed on the ring `replicas` times, such that
+    keys are spread evenly and adding or removing a node only
+    moves the keys of that one node.
+
+    Arguments:
+        nodes (list): Initial nodes
+        replicas (int): Points on the ring, per node
+
+    """
+
+    def __init__(self, nodes=None, replicas=160):
+        self.replicas = replicas
+        self.nodes = set()
+
+        self._hashes = list()  # Sorted points on the ring
+        self._owners = dict()  # Node, per point
+
+        for node in nodes or []:
+            self.add(node)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+
+        self.nodes.add(node)
+
+        for replica in range(self.replicas):
+            point = _hash("%s#%i" % (node, replica))
+            bisect.insort(self._hashes, point)
+            self._owners[point] = node
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+
+        self.nodes.discard(node)
+
+        for replica in range(self.replicas):
+            point = _hash("%s#%i" % (node, replica))
+            self._hashes.remove(point)
+            self._owners.pop(point)
+
+    def owner(self, key):
+        """Return node owning `key`, the first clockwise of its hash"""
+        if not self._hashes:
+            raise ValueError("Ring is empty")
+
+        index = bisect.bisect(self._hashes, _hash(key))
+        return self._owners[self._hashes[index % len(self._hashes)]]
+
+
+class Federation(object):
+    """Membership of a node, along with its connections to the others
+
+    Arguments:
+        context (zmq.Context): Context of relaying sockets
+        address (str): Address of this node
+        nodes (list): Addresses of other nodes known up front
+
+    Sockets to other nodes are created on first use and guarded by
+    a lock each, such that any thread may relay. The ring is never
+    changed once built; nodes joining build another, swapped in
+    whole, such that threads reading it need no lock.
+
+    """
+
+    def __init__(self, context, address, nodes=None):
+        self.context = context
+        self.address = address
+        self.ring = Ring([address] + list(nodes or []))
+
+        self._sockets = dict()  # PUSH socket, per node
+        self._locks = dict()  # Lock, per socket
+        self._lock = threading.Lock()  # Guards the above
+
+    @property
+    def nodes(self):
+        return sorted(self.ring.nodes)
+
+    def owns(self, peer):
+        """Return whether `peer` is owned by this node"""
+        return self.ring.owner(peer) == self.address
+
+    def owner(self, peer):
+        return self.ring.owner(peer)
+
+    def partition(self, peers):
+        """Return `peers` owned here, along with the rest, per node"""
+        local, remote = list(), dict()
+        ring = self.ring
+
+        for peer in peers:
+            node = ring.owner(peer)
+
+            if node == self.address:
+                local.append(peer)
+            else:
+                remote.setdefault(node, list()).append(peer)
+
+        return local, remote
+
+    def join(self, node):
+        """Add `node` to the ring, return whether it was new"""
+        with self._lock:
+            if node in self.ring:
+                return False
+
+            self.ring = Ring(self.ring.nodes | set([node]),
+                             self.ring.replicas)
+
+        return True
+
+    def relay(self, node, kind, data):
+        """Send record of `kind` to `node`"""
+        socket, lock = self._socket(node)
+
+        with lock:
+            socket.send_multipart([kind, data])
+
+    def broadcast(self, kind, data):
+        """Send record of `kind` to every other node"""
+        for node in self.ring.nodes:
+            if node != self.address:
+                self.relay(node, kind, data)
+
+    def announce(self):
+        """Let every other node know of this one"""
+        self.broadcast(NODE, self.address.encode('utf-8'))
+
+    def _socket(self, node):
+        with self._lock:
+            socket = self._sockets.get(node)
+
+            if socket is None:
+                socket = self.context.socket(zmq.PUSH)
+                socket.setsockopt(zmq.LINGER, 0)
+                socket.connect(endpoints(node)['relay'])
+                self._sockets[node] = socket
+                self._locks[socket] = threading.Lock()
+
+            return socket, self._locks[socket]
+
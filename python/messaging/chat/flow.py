@@ -0,0 +1,283 @@
+"""Slow subscribers, detected and dealt with
+
+ZeroMQ drops messages published to a subscriber whose queue is full,
+i.e. past its high-water mark, without telling anyone. To notice,
+the swarm stamps each message published to a peer with a serial,
+counted per topic and appended to its topic frame.
+     ______________________ __________ _______
+    |                      |          |       |
+    |  peer:markus\\x00     |  serial  | frame |  ...
+    |______________________|__________|_______|
+                               uint32
+
+Logs are stamped likewise, their topic terminated first. Topics
+being terminated, subscriptions match as before, and receivers
+ignoring the topic frame are none the wiser. Peers
+noticing a gap in serials have missed as many messages, which they
+report along with the last serial seen, see `Tracker`. The swarm
+then knows how many were dropped and how far behind each peer is,
+and acts on it according to its policy.
+
+- 'ignore' only counts what was dropped
+- 'catchup' sends letters missed from the store, as though the
+  peer had asked for state
+- 'throttle' stops publishing to the peer for `pause` seconds,
+  letting its queue drain, then catches it up
+- 'disconnect' stops publishing to the peer until it asks for
+  state itself, letting it know why
+
+Usage:
+    >>> sequencer = Sequencer()
+    >>> frames = sequencer.stamp(['peer:markus\\x00', frame])
+    >>> tracker = Tracker()
+    >>> tracker.observe(frames[0])
+    0
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import time
+import struct
+import threading
+import collections
+
+# local library
+import chat.protocol
+
+__all__ = [
+    'Sequencer',
+    'Tracker',
+    'FlowControl',
+    'stamp',
+    'unstamp',
+    'HWMS',
+    'POLICIES',
+]
+
+# High-water marks, in messages, by socket; those of ZeroMQ
+HWMS = {
+    'pub': 1000,
+    'pull': 1000,
+    'push': 1000,
+    'sub': 1000,
+}
+
+POLICIES = ('ignore', 'catchup', 'throttle', 'disconnect')
+
+STAMPED = ('peer:', 'log')  # Topics stamped, of peers and logs
+
+_serial = struct.Struct('>I')
+_wrap = 1 << 32
+
+
+def stamp(topic, serial):
+    """Return `topic`, terminated, followed by `serial`"""
+    if not topic.endswith('\x00'):
+        topic += '\x00'
+
+    return topic + _serial.pack(serial % _wrap)
+
+
+def unstamp(topic):
+    """Return `topic` without its serial, and the serial if any"""
+    end = topic.find('\x00') + 1
+
+    if not end or len(topic) - end != _serial.size:
+        return topic, None
+
+    return topic[:end], _serial.unpack(topic[end:])[0]
+
+
+def distance(later, earlier):
+    """Return messages from serial `earlier` to `later`
+
+    Serials wrap around, and start over with each swarm; a serial
+    far ahead is taken to be one started over, at no distance.
+
+    """
+
+    delta = (later - earlier) % _wrap
+    return delta if delta < _wrap // 2 else 0
+
+
+class Sequencer(object):
+    """Serial of each message published, per topic of peer or logs
+
+    Only used by the thread publishing, and so not locked.
+
+    """
+
+    def __init__(self):
+        self._serials = dict()  # Last serial, by topic
+
+    def serial(self, topic):
+        """Return last serial published to `topic`"""
+        return self._serials.get(topic, 0)
+
+    def stamp(self, frames):
+        """Return `frames` with their topic stamped, if tracked"""
+        topic = frames[0]
+
+        if not topic.startswith(STAMPED):
+            return frames
+
+        serial = self._serials.get(topic, 0) + 1
+        self._serials[topic] = serial
+
+        return [stamp(topic, serial)] + frames[1:]
+
+
+class Tracker(object):
+    """Gaps in serials received, by a peer
+
+    Arguments:
+        serial (int): Last serial received
+        missed (int): Messages missed, in total
+        received (int): Messages received, in total
+
+    """
+
+    def __init__(self):
+        self.serial = None
+        self.missed = 0
+        self.received = 0
+
+    def observe(self, topic):
+        """Return messages missed prior to that of `topic`"""
+        serial = unstamp(topic)[1]
+
+        if serial is None:
+            return 0
+
+        missed = 0
+        if self.serial is not None:
+            missed = max(0, distance(serial, self.serial) - 1)
+
+        self.serial = serial
+        self.missed += missed
+        self.received += 1
+
+        return missed
+
+    def report(self):
+        return {'serial': self.serial,
+                'missed': self.missed}
+
+
+class FlowControl(object):
+    """Lag of each peer, and what is done about it
+
+    Arguments:
+        policy (str): What to do about lagging peers, one of
+            `POLICIES`
+        lag (int): Messages a peer may be behind before lagging,
+            on top of any it missed
+        pause (float): Seconds publishing to a throttled peer is
+            suspended
+
+    Reports are handled from any thread, whereas `suspended` is
+    only asked by the thread publishing. Thread-safe.
+
+    """
+
+    def __init__(self, policy='catchup', lag=HWMS['pub'], pause=5):
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy: %s" % policy)
+
+        self.policy = policy
+        self.lag = lag
+        self.pause = pause
+
+        self._missed = dict()  # Messages missed, as last reported
+        self._lags = dict()  # Messages behind, by peer
+        self._reports = dict()  # Last report, by peer
+        self._suspended = dict()  # (peer, until), by topic
+        self._lock = threading.Lock()
+
+        self.stats = collections.Counter()
+
+    def lags(self):
+        """Return messages each peer is behind, by peer"""
+        with self._lock:
+            return dict(self._lags)
+
+    def report(self, peer, published, report):
+        """Handle `report` of `peer`, return action due, if any
+
+        Arguments:
+            peer (str): Name of peer
+            published (int): Last serial published to `peer`
+            report (dict): Last `serial` received and messages
+                `missed` in total, as of `Tracker.report`, along
+                with the `epoch` and `sequence` from which to catch
+                the peer up
+
+        """
+
+        with self._lock:
+            missed = report.get('missed') or 0
+            dropped = max(0, missed - self._missed.get(peer, 0))
+            lag = distance(published, report.get('serial') or published)
+
+            self._missed[peer] = missed
+            self._lags[peer] = lag
+            self._reports[peer] = report
+            self.stats['dropped'] += dropped
+
+            if not dropped and lag <= self.lag:
+                return None
+
+            self.stats['lagging'] += 1
+
+            if self.policy == 'ignore':
+                return None
+
+            self.stats[self.policy] += 1
+            return self.policy
+
+    def suspend(self, peer, seconds=None):
+        """Stop publishing to `peer`, for `seconds` or until resumed"""
+        until = None if seconds is None else time.time() + seconds
+
+        with self._lock:
+            self._suspended[chat.protocol.topic(peer)] = (peer, until)
+
+    def resume(self, peer):
+        """Publish to `peer` again, return whether it was suspended"""
+        with self._lock:
+            return self._suspended.pop(chat.protocol.topic(peer),
+                                       None) is not None
+
+    def suspended(self, topic):
+        """Return whether to hold back a message to `topic`"""
+        if not self._suspended:
+            return False
+
+        if self._suspended.get(topic) is None:
+            return False
+
+        self.stats['held'] += 1
+        return True
+
+    def expire(self, now=None):
+        """Resume peers paused long enough, return their last reports"""
+        now = now or time.time()
+        resumed = list()
+
+        with self._lock:
+            for topic, (peer, until) in self._suspended.items():
+                if until is not None and until <= now:
+                    self._suspended.pop(topic)
+                    resumed.append((peer, self._reports.get(peer, {})))
+
+        return resumed
+
+    def forget(self, peer):
+        """Stop tracking `peer`, e.g. once gone"""
+        with self._lock:
+            self._missed.pop(peer, None)
+            self._lags.pop(peer, None)
+            self._reports.pop(peer, None)
+            self._suspended.pop(chat.protocol.topic(peer), None)
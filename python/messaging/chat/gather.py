@@ -0,0 +1,188 @@
+"""Scatter-gather of queries across peers
+
+A query sent to many peers is given an id, carried by each answer,
+and kept pending until every peer has answered or its deadline
+passes. Either way, the questioner receives one answer with the
+results gathered so far, marking the peers that did not answer.
+                     _____
+          .-------->|  B  |------.
+     ____/   query  |_____|       \\  results    ____________
+    |  A |                         >---------->|  pending   |--> A
+    |____|\\   query   _____       /            |  #1 [B, C] |
+           '-------->|  C  |-----'             |____________|
+                     |_____|
+
+Pending queries are bounded; once full, the oldest is answered
+early with what it has, such that memory does not grow with
+peers that never answer.
+
+Usage:
+    >>> queries = Gatherer(capacity=2)
+    >>> pending, evicted = queries.open(query, peers=['markus', 'nikki'])
+    >>> queries.answer(results_of_markus)  # None, nikki is missing
+    >>> queries.answer(results_of_nikki)  # Returns `pending`, complete
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import time
+import heapq
+import threading
+import collections
+
+# local library
+import chat.protocol
+
+__all__ = [
+    'Gatherer',
+    'Pending',
+]
+
+
+class Pending(object):
+    """Query awaiting answers
+
+    Arguments:
+        query (chat.protocol.Query): Query, with its id
+        peers (list): Peers asked
+        deadline (float): Time after which to stop waiting
+
+    """
+
+    def __init__(self, query, peers, deadline):
+        self.query = query
+        self.peers = list(peers)
+        self.deadline = deadline
+        self.missing = set(peers)
+        self.results = list()
+
+    @property
+    def complete(self):
+        return not self.missing
+
+    def results_for(self, swarm):
+        """Return gathered results, answered on behalf of `swarm`"""
+        return chat.protocol.QueryResults(
+            name=self.query.name,
+            peer=swarm,
+            questioner=self.query.questioner,
+            payload=[results.to_dict() for results in self.results],
+            id=self.query.id,
+            missing=sorted(self.missing))
+
+
+class Gatherer(object):
+    """Queries pending, by id
+
+    Arguments:
+        capacity (int): Queries pending at most
+        timeout (float): Default seconds to wait for answers
+
+    Thread-safe.
+
+    """
+
+    def __init__(self, capacity=1024, timeout=5):
+        self.capacity = capacity
+        self.timeout = timeout
+
+        self._pending = collections.OrderedDict()  # Pending, by id
+        self._deadlines = list()  # (deadline, id), soonest first
+        self._next = 0
+        self._lock = threading.Lock()
+
+        self.stats = collections.Counter()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def open(self, query, peers, timeout=None, results=None):
+        """Start waiting on answers of `peers` to `query`
+
+        Assigns the query its id. Returns the new pending query
+        along with another, if any, completed early to make room.
+        Queries answered in full by `results`, e.g. from a cache,
+        are returned complete and never held pending.
+
+        """
+
+        now = time.time()
+        deadline = now + (timeout or self.timeout)
+        evicted = None
+
+        pending = Pending(query, peers, deadline)
+
+        for answer in results or []:
+            if answer.peer in pending.missing:
+                pending.missing.discard(answer.peer)
+                pending.results.append(answer)
+
+        with self._lock:
+            query.id = self._next
+            self._next += 1
+
+            if pending.complete:
+                self.stats['complete'] += 1
+                return pending, None
+
+            if len(self._pending) >= self.capacity:
+                query_id, evicted = self._pending.popitem(last=False)
+                self.stats['evicted'] += 1
+
+            self._pending[query.id] = pending
+            heapq.heappush(self._deadlines, (deadline, query.id))
+
+            # Deadlines of queries completed early linger until due
+            if len(self._deadlines) > 2 * self.capacity:
+                self._deadlines = [(other.deadline, other_id)
+                                   for other_id, other
+                                   in self._pending.iteritems()]
+                heapq.heapify(self._deadlines)
+
+            self.stats['opened'] += 1
+
+        return pending, evicted
+
+    def answer(self, results):
+        """Add `results` to its query, returning it once complete
+
+        Answers to queries no longer pending, e.g. having
+        passed their deadline, are ignored.
+
+        """
+
+        with self._lock:
+            pending = self._pending.get(results.id)
+
+            if pending is None or results.peer not in pending.missing:
+                self.stats['late'] += 1
+                return None
+
+            pending.missing.discard(results.peer)
+            pending.results.append(results)
+
+            if not pending.complete:
+                return None
+
+            self._pending.pop(results.id)
+            self.stats['complete'] += 1
+            return pending
+
+    def expire(self, now=None):
+        """Remove and return queries whose deadline has passed"""
+        now = now or time.time()
+        expired = list()
+
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                deadline, query_id = heapq.heappop(self._deadlines)
+                pending = self._pending.pop(query_id, None)
+
+                # Already complete, or evicted
+                if pending is not None:
+                    expired.append(pending)
+                    self.stats['partial'] += 1
+
+        return expired
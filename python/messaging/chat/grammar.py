@@ -0,0 +1,238 @@
+"""Declarative command grammars, compiled once and parsed per command
+
+A grammar is declared as a list of arguments, much like those
+added to an `argparse.ArgumentParser`, and compiled once into
+lookup tables of options along with the defaults and usage. Each
+command is then parsed with a single pass over its tokens.
+
+Usage:
+    >>> coffee = compile('order coffee', [
+    ...     Argument('name'),
+    ...     Argument('--quantity', type=int, default=1),
+    ...     Argument('--milk', const=True, default=False),
+    ... ])
+    >>> coffee.parse(tokenize('latte --milk'))
+    {'quantity': 1, 'milk': True, 'name': 'latte'}
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import re
+
+__all__ = [
+    'Argument',
+    'Grammar',
+    'compile',
+    'tokenize',
+]
+
+_token = re.compile(r'"([^"]*)"|(\S+)')
+_missing = object()
+
+_grammars = dict()  # Compiled grammars, by prog and arguments
+
+
+def tokenize(command):
+    """Split `command` on whitespace, keeping "quoted words" together"""
+    if '"' not in command:
+        return command.split()
+
+    return [quoted or word for quoted, word in _token.findall(command)]
+
+
+class Argument(object):
+    """Declaration of a single argument
+
+    Arguments:
+        name (str): Name of positional, or option starting with --
+        dest (str): Key of parsed value, defaults to `name`
+        type (callable): Converts the value given
+        default (object): Value when not given
+        const (object): Value stored when given; options with
+            a `const` take no value, i.e. they are flags.
+        nargs (str): '*' collects remaining positionals into a list
+        help (str): Description, for the usage
+
+    """
+
+    def __init__(self,
+                 name,
+                 dest=None,
+                 type=None,
+                 default=None,
+                 const=_missing,
+                 nargs=None,
+                 help=None):
+        self.name = name
+        self.dest = dest or name.lstrip('-').replace('-', '_')
+        self.type = type
+        self.default = default
+        self.const = const
+        self.nargs = nargs
+        self.help = help
+
+    @property
+    def spec(self):
+        """Hashable summary of this declaration, see `compile`"""
+        return repr((self.name, self.dest, self.type, self.default,
+                     self.const, self.nargs, self.help))
+
+    @property
+    def optional(self):
+        return self.name.startswith('--')
+
+    @property
+    def flag(self):
+        return self.const is not _missing
+
+
+class Grammar(object):
+    """Compiled grammar of a command, see `compile`"""
+
+    def __init__(self, prog, arguments):
+        self.prog = prog
+        self.arguments = list(arguments)
+
+        self.options = dict()  # Argument, per option
+        self.positionals = list()
+        self.rest = None  # Argument collecting remaining positionals
+        self.defaults = dict()
+
+        for argument in self.arguments:
+            if argument.optional:
+                self.options[argument.name] = argument
+            elif argument.nargs == '*':
+                self.rest = argument
+            else:
+                self.positionals.append(argument)
+
+            # First declared default wins, as with argparse
+            if argument.dest not in self.defaults:
+                default = argument.default
+                if argument.nargs == '*' and default is None:
+                    default = list()
+                self.defaults[argument.dest] = default
+
+        self.usage = self._usage()
+
+    def parse(self, tokens):
+        """Return values of `tokens`, by destination
+
+        Raises:
+            ValueError on tokens not matching the grammar
+            SystemExit with the help, on --help
+
+        """
+
+        values = self.defaults.copy()
+        if self.rest is not None:
+            values[self.rest.dest] = list()
+
+        positionals = iter(self.positionals)
+        tokens = iter(tokens)
+
+        for token in tokens:
+            if token.startswith('--'):
+                if token == '--help':
+                    raise SystemExit(self.format_help())
+
+                name, equals, value = token.partition('=')
+
+                try:
+                    argument = self.options[name]
+                except KeyError:
+                    raise ValueError("unrecognized argument: %s" % token)
+
+                if argument.flag:
+                    if equals:
+                        raise ValueError("%s takes no value" % name)
+                    values[argument.dest] = argument.const
+                    continue
+
+                if not equals:
+                    value = next(tokens, None)
+                    if value is None:
+                        raise ValueError("%s expects a value" % name)
+
+                values[argument.dest] = self._convert(argument, value)
+                continue
+
+            argument = next(positionals, None)
+
+            if argument is not None:
+                values[argument.dest] = self._convert(argument, token)
+            elif self.rest is not None:
+                values[self.rest.dest].append(
+                    self._convert(self.rest, token))
+            else:
+                raise ValueError("unrecognized argument: %s" % token)
+
+        missing = next(positionals, None)
+        if missing is not None:
+            raise ValueError("too few arguments, expected %s"
+                             % missing.name)
+
+        return values
+
+    def format_usage(self):
+        return self.usage
+
+    def format_help(self):
+        lines = [self.usage.rstrip()]
+
+        described = [argument for argument in self.arguments
+                     if argument.help]
+
+        if described:
+            lines.append('')
+            for argument in described:
+                lines.append("  %-16s %s" % (argument.name, argument.help))
+
+        return '\n'.join(lines) + '\n'
+
+    def _convert(self, argument, value):
+        if argument.type is None:
+            return value
+
+        try:
+            return argument.type(value)
+        except (TypeError, ValueError):
+            raise ValueError("invalid value for %s: %r"
+                             % (argument.name, value))
+
+    def _usage(self):
+        parts = ["usage: %s" % self.prog]
+
+        for argument in self.arguments:
+            if argument.optional:
+                if argument.flag:
+                    parts.append("[%s]" % argument.name)
+                else:
+                    parts.append("[%s %s]" % (argument.name,
+                                              argument.dest.upper()))
+            elif argument.nargs == '*':
+                parts.append("[%s ...]" % argument.name)
+            else:
+                parts.append(argument.name)
+
+        return ' '.join(parts) + '\n'
+
+
+def compile(prog, arguments):
+    """Return grammar of `arguments`, compiled once per declaration
+
+    Arguments:
+        prog (str): Name of command, e.g. "order coffee"
+        arguments (list): Argument declarations
+
+    """
+
+    key = (prog, tuple(argument.spec for argument in arguments))
+
+    try:
+        return _grammars[key]
+    except KeyError:
+        grammar = _grammars[key] = Grammar(prog, arguments)
+        return grammar
@@ -0,0 +1,229 @@
+"""Append-only journal of swarm state
+
+State is persisted as length-prefixed records, appended to a
+journal and periodically compacted into a snapshot.
+     ________ ______ ____________    ________ ______ _______
+    |        |      |            |  |        |      |
+    | length | kind |    data    |  | length | kind |  ...
+    |________|______|____________|  |________|______|_______
+
+Appends are queued and written by a single writer in groups, one
+flush (and fsync) per group rather than per record. On startup,
+the snapshot followed by the journal is replayed through a
+memory-mapped reader.
+
+Usage:
+    >>> journal = Journal('/tmp/swarm')
+    >>> journal.append('L', frame)
+    >>> for kind, data in journal.replay():
+    ...     print kind, len(data)
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import os
+import mmap
+import struct
+import threading
+
+# local library
+import chat.lib
+import chat.codec
+
+__all__ = [
+    'Journal',
+    'restore',
+    'LETTER',
+    'PEER',
+    'ORDER',
+]
+
+# Kinds of records
+LETTER = 'L'  # Encoded envelope
+PEER = 'P'  # Name of peer, utf-8
+ORDER = 'O'  # Encoded order
+
+_header = struct.Struct('!Ic')  # Length of data, kind
+
+
+def read(path):
+    """Yield (kind, data) of each record in file at `path`
+
+    A trailing record cut short, such as by a crash mid-write,
+    is ignored along with everything following it.
+
+    """
+
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return
+
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            offset = 0
+            end = len(buf)
+            size = _header.size
+
+            while offset + size <= end:
+                length, kind = _header.unpack_from(buf, offset)
+                offset += size
+
+                if offset + length > end:
+                    break
+
+                yield kind, buf[offset:offset + length]
+                offset += length
+
+        finally:
+            buf.close()
+
+
+def restore(records, letters, peers, orders):
+    """Apply `records` to the state of a swarm
+
+    Records are idempotent; a letter journaled while a snapshot
+    was being taken may appear twice but is only restored once.
+
+    Arguments:
+        records (iterable): (kind, data) pairs, see `Journal.replay`
+        letters (chat.store.LetterStore): Letters, by author
+        peers (set): Names of peers
+        orders (dict): Orders, by id
+
+    """
+
+    seen = set()
+
+    for kind, data in records:
+        if kind == LETTER:
+            letter = chat.codec.loads(data)
+            key = (letter.author, letter.timestamp)
+
+            if key not in seen:
+                seen.add(key)
+                letter.size = len(data)
+                letters.add(letter, size=len(data))
+
+        elif kind == PEER:
+            peers.add(data.decode('utf-8'))
+
+        elif kind == ORDER:
+            order = chat.codec.loads(data)
+            orders[order.id] = order
+
+
+def _record(kind, data):
+    return _header.pack(len(data), kind) + data
+
+
+class Journal(object):
+    """Journal and snapshot of records within `directory`
+
+    Arguments:
+        directory (str): Absolute path to where files are kept
+        sync (bool): Whether to fsync each group of appends
+
+    """
+
+    JOURNAL = 'journal.dat'
+    SNAPSHOT = 'snapshot.dat'
+
+    def __init__(self, directory, sync=True):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.sync = sync
+        self.journal_path = os.path.join(directory, self.JOURNAL)
+        self.snapshot_path = os.path.join(directory, self.SNAPSHOT)
+
+        self._file = open(self.journal_path, 'ab')
+        self._pending = list()
+        self._writing = False
+        self._condition = threading.Condition()  # Guards pending
+        self._lock = threading.Lock()  # Guards file
+
+        chat.lib.spawn(self.writer, name='journal')
+
+    def append(self, kind, data):
+        """Queue record of `kind` for writing
+
+        Arguments:
+            kind (str): Single character identifying `data`
+            data (str): Contents of record
+
+        """
+
+        with self._condition:
+            self._pending.append(_record(kind, data))
+            self._condition.notify_all()
+
+    def flush(self):
+        """Block until every queued record has been written"""
+        with self._condition:
+            while self._pending or self._writing:
+                self._condition.wait(0.1)
+
+    def writer(self):
+        """Write queued records, in groups"""
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+
+                group, self._pending = self._pending, list()
+                self._writing = True
+
+            with self._lock:
+                self._file.write(''.join(group))
+                self._file.flush()
+
+                if self.sync:
+                    os.fsync(self._file.fileno())
+
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def size(self):
+        """Return bytes currently in the journal"""
+        with self._lock:
+            return os.fstat(self._file.fileno()).st_size
+
+    def snapshot(self, records):
+        """Replace snapshot with `records` and empty the journal
+
+        Arguments:
+            records (iterable): (kind, data) pairs representing
+                the complete current state.
+
+        """
+
+        self.flush()
+
+        temp = self.snapshot_path + '.tmp'
+
+        with self._lock:
+            with open(temp, 'wb') as f:
+                for kind, data in records:
+                    f.write(_record(kind, data))
+                f.flush()
+                os.fsync(f.fileno())
+
+            if os.name == 'nt' and os.path.exists(self.snapshot_path):
+                os.remove(self.snapshot_path)
+
+            os.rename(temp, self.snapshot_path)
+
+            self._file.close()
+            self._file = open(self.journal_path, 'wb')
+
+    def replay(self):
+        """Yield (kind, data) of snapshot, followed by journal"""
+        for record in read(self.snapshot_path):
+            yield record
+
+        for record in read(self.journal_path):
+            yield record
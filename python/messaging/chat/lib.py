@@ -1,18 +1,67 @@
 import os
+import time
 import random
 import argparse
 import threading
 import subprocess
+import collections
 
 
 class DynamicRegistry(type):
-    """Meta-class for dynamically registering subclasses"""
+    """Meta-class for dynamically registering subclasses
+
+    Each class is registered by its lower-case `key` in `registry`
+    and instantiated once, at import, into `dispatch`. Instances
+    in `dispatch` are shared and must therefore be stateless.
+
+    `dispatched` counts lookups per registered key, see `lookup`.
+
+    Classes declaring `abstract = True`, such as bases of those
+    registered, are not registered themselves.
+
+    """
+
     def __init__(cls, name, bases, nmspc):
         super(DynamicRegistry, cls).__init__(name, bases, nmspc)
         if not hasattr(cls, 'registry'):
             cls.registry = dict()
-        key = getattr(cls, 'key', cls.__name__.lower())
+            cls.dispatch = dict()
+            cls.dispatched = collections.Counter()
+        if nmspc.get('abstract', False):
+            return
+        key = nmspc.get('key', name).lower()
         cls.registry[key] = cls
+        cls.dispatch[key] = cls()
+
+    def lookup(cls, key):
+        """Return shared instance registered as `key`, case-insensitive
+
+        Raises:
+            KeyError if no class is registered as `key`
+
+        """
+
+        key = key.lower()
+        instance = cls.dispatch[key]
+
+        cls.dispatched[key] += 1
+        return instance
+
+
+class Signal(object):
+    """Call connected functions upon emit"""
+    def __init__(self):
+        self.callbacks = list()
+
+    def connect(self, func):
+        self.callbacks.append(func)
+
+    def disconnect(self, func):
+        self.callbacks.remove(func)
+
+    def emit(self, *args, **kwargs):
+        for func in list(self.callbacks):
+            func(*args, **kwargs)
 
 
 def spawn(func, **kwargs):
@@ -21,6 +70,31 @@ def spawn(func, **kwargs):
     thread.start()
 
 
+def run(coroutine):
+    """Run generator `coroutine` to completion, blocking
+
+    A coroutine yields the seconds to wait before resuming it,
+    leaving it to the caller how waiting is done; here, by
+    sleeping, and under `chat.reactor.Reactor` by timers.
+
+    Example:
+        >>> def brew():
+        ...     yield 10
+        ...     print "Done"
+        >>> run(brew())
+        Done
+
+    """
+
+    for delay in coroutine:
+        time.sleep(delay or 0)
+
+
+def schedule(coroutine):
+    """Run generator `coroutine` in a thread of its own"""
+    spawn(run, args=[coroutine], name='coroutine')
+
+
 clear_console = lambda: subprocess.call(
     'cls'
     if os.name == 'nt'
@@ -4,7 +4,6 @@ from __future__ import absolute_import
 import os
 import sys
 import time
-import json
 from functools import partial
 
 # dependencies
@@ -16,6 +15,9 @@ from PyQt5 import QtWidgets
 
 # local library
 import chat.lib
+import chat.codec
+import chat.flow
+import chat.tracing
 import chat.protocol
 
 
@@ -109,10 +111,10 @@ class Entry(QtWidgets.QWidget):
         layout = self.body.layout()
         self.body.show()
 
-        count = len(self.log.trace)
+        hops = chat.tracing.hops(self.log.trace)
+        count = len(hops)
         for i in xrange(count):
-            mediator = self.log.trace[i]
-            label = QtWidgets.QLabel(mediator)
+            label = QtWidgets.QLabel("%s +%ius" % hops[i])
 
             box = QtWidgets.QWidget()
             box.setObjectName('Box')
@@ -166,11 +168,23 @@ class Application(QtWidgets.QWidget):
 
         print "Running logger.."
 
+        tracker = chat.flow.Tracker()
+
         while True:
-            header, body = socket.recv_multipart()
-            message = json.loads(body)
-            log = chat.protocol.Log.from_dict(message)
-            QtCore.QTimer.singleShot(0, partial(self.log, log))
+            # Logs arrive in batches
+            frames = socket.recv_multipart()
+
+            missed = tracker.observe(frames[0])
+            if missed:
+                log = chat.protocol.Log(
+                    name='logger',
+                    level='warning',
+                    string='%i batches of logs missed' % missed)
+                QtCore.QTimer.singleShot(0, partial(self.log, log))
+
+            for body in frames[1:]:
+                log = chat.codec.loads(body, legacy=chat.protocol.Log)
+                QtCore.QTimer.singleShot(0, partial(self.log, log))
 
     def resizeEvent(self, event):
         super(Application, self).resizeEvent(event)
@@ -0,0 +1,181 @@
+"""Publishing of logs, gated by level, sampling and subscribers
+
+Logs are only built when wanted; that is, when someone is
+subscribed to the 'log' topic, the level is at or above the
+threshold and the type of envelope logged is sampled.
+Wanted logs are encoded and published in batches, many per
+multipart message.
+     _____ ________ ________ ________
+    |     |        |        |        |
+    | log |  log   |  log   |  ...   |
+    |_____|________|________|________|
+
+Usage:
+    >>> logs = LogPipeline(socket.send_multipart, codec)
+    >>> if logs.wants('info', envelope.type):
+    ...     logs.submit(Log(...))
+    >>> logs.flush()
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import time
+import random
+import collections
+
+__all__ = [
+    'LogPipeline',
+    'LEVELS',
+]
+
+LEVELS = {
+    'debug': 10,
+    'info': 20,
+    'warning': 30,
+    'error': 40,
+    'critical': 50
+}
+
+
+class LogPipeline(object):
+    """Gate, batch and publish logs
+
+    Arguments:
+        send (callable): Sends a list of frames, e.g. the
+            `send_multipart` of a publishing socket.
+        codec (chat.codec.Codec): Encodes each log
+        level (str): Logs below this level are discarded
+        sampling (dict): Fraction of logs published, per
+            type of envelope, e.g. {'letter': 0.1}
+        batch (int): Logs per published message
+        interval (float): Maximum seconds a log is held back
+
+    Not thread-safe; use from the thread owning the socket.
+
+    """
+
+    TOPIC = 'log'
+
+    def __init__(self,
+                 send,
+                 codec,
+                 level='info',
+                 sampling=None,
+                 batch=64,
+                 interval=0.05):
+
+        self.send = send
+        self.codec = codec
+        self.level = level
+        self.sampling = dict((typ.lower(), rate)
+                             for typ, rate in (sampling or {}).iteritems())
+        self.batch = batch
+        self.interval = interval
+
+        # Nothing is published until someone subscribes,
+        # see `subscription`
+        self.subscribed = False
+        self.subscriptions = set()
+
+        self.stats = collections.Counter()
+
+        self._pending = list()
+        self._deadline = None
+
+    @property
+    def level(self):
+        return self._level
+
+    @level.setter
+    def level(self, level):
+        if level not in LEVELS:
+            raise ValueError("Unknown level: %s" % level)
+
+        self._level = level
+        self._threshold = LEVELS[level]
+
+    def subscription(self, message):
+        """Update subscribers from XPUB subscription `message`
+
+        The first byte is 1 for subscribe and 0 for unsubscribe,
+        followed by the topic.
+
+        """
+
+        topic = message[1:]
+
+        if message[:1] == '\x01':
+            self.subscriptions.add(topic)
+        else:
+            self.subscriptions.discard(topic)
+
+        self.subscribed = any(self.TOPIC.startswith(topic)
+                              for topic in self.subscriptions)
+
+        if not self.subscribed:
+            self.stats['discarded'] += len(self._pending)
+            self._pending = list()
+            self._deadline = None
+
+    def wants(self, level, typ=None):
+        """Return whether a log of `level` about `typ` is published"""
+        if not self.subscribed:
+            return False
+
+        if LEVELS[level] < self._threshold:
+            return False
+
+        if typ is not None and self.sampling:
+            rate = self.sampling.get(typ.lower(), 1.0)
+            if rate < 1.0 and random.random() >= rate:
+                self.stats['sampled'] += 1
+                return False
+
+        return True
+
+    def submit(self, log):
+        """Queue `log` for publishing"""
+        self.append(self.codec.dumps(log))
+
+    def append(self, frame):
+        """Queue already encoded log `frame` for publishing"""
+        self._pending.append(frame)
+
+        if len(self._pending) >= self.batch:
+            self.flush()
+
+        elif self._deadline is None:
+            self._deadline = time.time() + self.interval
+
+    def timeout(self):
+        """Return milliseconds until next flush is due, or None"""
+        if self._deadline is None:
+            return None
+
+        return max(0, int((self._deadline - time.time()) * 1000))
+
+    def flush(self, force=True):
+        """Publish pending logs
+
+        Arguments:
+            force (bool): Publish regardless of whether
+                the batch is full or its time is up.
+
+        """
+
+        if not self._pending:
+            return
+
+        if not force and (len(self._pending) < self.batch and
+                          time.time() < self._deadline):
+            return
+
+        self.send([self.TOPIC] + self._pending)
+
+        self.stats['published'] += len(self._pending)
+        self.stats['batches'] += 1
+
+        self._pending = list()
+        self._deadline = None
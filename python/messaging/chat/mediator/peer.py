@@ -1,8 +1,5 @@
 from __future__ import absolute_import
 
-# standard library
-import time
-
 # local library
 import chat.lib
 import chat.protocol
@@ -16,20 +13,26 @@ __all__ = [
     'Peers',
     'Error',
     'SwarmQuery',
-    'QueryResults'
+    'QueryResults',
+    'Nodes',
+    'Ack',
+    'Brew',
 ]
 
 
 class Factory(object):
     __metaclass__ = chat.lib.DynamicRegistry
+    abstract = True
 
-    def mediate(self, typ, receiver, envelope):
+    @classmethod
+    def mediate(cls, typ, receiver, envelope):
         try:
-            mediator = self.registry[typ.lower()]()
-            mediator.execute(receiver, envelope)
+            mediator = cls.lookup(typ)
         except KeyError:
             raise ValueError("Unhandled mediator: %s" % typ.lower())
 
+        mediator.execute(receiver, envelope)
+
     def execute(self, receiver, envelope):
         pass
 
@@ -62,6 +65,7 @@ class Letter(Factory):
         # Include this (potentially new) peer in list
         # of recipients for future letters send by `self`.
         receiver.peers.add(envelope.author)
+        receiver.seen(envelope.sequence)
 
         if envelope.author != receiver.name:
             message = receiver.formatter(envelope)
@@ -159,16 +163,20 @@ class State(Factory):
         """
 
         state = envelope.payload
-        messages = state
 
-        for timestamp in sorted(messages):
-            message = messages[timestamp]
+        for message in state['letters']:
             envelope = chat.protocol.Envelope.from_dict(message)
 
             if receiver.name in envelope.recipients:
                 message = receiver.formatter(envelope)
                 receiver.display_remote_message(message)
-                time.sleep(0.01)
+
+        # Only once displayed, such that an interrupted
+        # catch-up picks up from the last complete chunk.
+        receiver.seen(state['sequence'], epoch=state['epoch'])
+
+        if not state['remaining']:
+            receiver.behind = False
 
 
 class Peers(Factory):
@@ -238,7 +246,6 @@ class SwarmQuery(Factory):
         query = chat.protocol.Query.from_dict(envelope.payload)
 
         trace = envelope.trace
-        trace.append('Peer.mediator<{}>'.format(query.name))
 
         receiver.display_remote_message("- %s is asking about you"
                                         % query.questioner)
@@ -281,7 +288,7 @@ class SwarmQuery(Factory):
 
         elif query.name == 'status':
             # liveliness = receiver.heartbeats.get(self.name)
-            results = query.reply(peer=self.name,
+            results = query.reply(peer=receiver.name,
                                   payload='dead')
             envelope = chat.protocol.Envelope(payload=results,
                                               type='__peerResults__',
@@ -320,6 +327,20 @@ class QueryResults(Factory):
         results = envelope.payload
         results = chat.protocol.QueryResults.from_dict(results)
 
+        if not results.gathered:
+            return self.display(receiver, results)
+
+        # Gathered from each peer asked, see `chat.gather`
+        for answer in results.payload:
+            answer = chat.protocol.QueryResults.from_dict(answer)
+            self.display(receiver, answer)
+
+        for peer in results.missing:
+            receiver.display_remote_message(
+                "No answer from %s (partial results)" % peer)
+
+    def display(self, receiver, results):
+        """Display results of a single peer"""
         if results.name == 'stats':
             """
             Display statistics returned from query
@@ -375,3 +396,67 @@ class QueryResults(Factory):
                 "Got results for {query} from {peer}, but don't know "
                 "what for.".format(query=results.name,
                                    peer=results.peer))
+
+
+class Nodes(Factory):
+    def execute(self, receiver, envelope):
+        """Swarms sharing peers have changed, see `chat.federation`
+
+        PEER A
+         _             SWARM A         SWARM B
+        | |             _    joined     _
+        | |            |/|<------------|/|
+        | |   nodes    |/|             |/|
+        | |<===========|_|             |_|
+        |_|
+
+        """
+
+        receiver.rebalance(envelope.payload)
+
+
+class Ack(Factory):
+    key = '__ack__'
+
+    def execute(self, receiver, envelope):
+        """Swarm acknowledges letters sent reliably, see `chat.reliable`
+
+        PEER A
+         _             SWARM
+        | |   letter    _
+        | |----------->|/|
+        | |   letter   |/|
+        | |----------->|/|
+        | |            |/|
+        | |   ack      |/|
+        | |<-----------|/|
+        |_|            |_|
+
+        """
+
+        if receiver.window is None:
+            return
+
+        receiver.acknowledged(envelope.payload['number'],
+                              envelope.payload['gap'])
+
+
+class Brew(Factory):
+    key = '__brew__'
+
+    def execute(self, receiver, envelope):
+        """Make an order handed to this worker, see `chat.dispatch`
+
+        BARISTA
+         _             SWARM
+        | |   brew      _
+        | |<===========|/|
+        | |            |/|
+        | |   status   |/|
+        | |----------->|/|
+        |_|            |_|
+
+        """
+
+        order = chat.protocol.Order.from_dict(envelope.payload['order'])
+        receiver.brew(order, envelope.payload['recipe'])
@@ -9,43 +9,75 @@ from __future__ import absolute_import
 
 # standard library
 import sys
-import time
 import traceback
 
 # local library
 import chat.protocol
 import chat.service
+import chat.grammar
 import chat.lib
+import chat.tracing
 
 __all__ = [
 ]
 
 
+# Grammars of orders, compiled once, see `OrderPlacement`
+ORDERS = {
+    'coffee': chat.grammar.compile('order coffee', [
+        chat.grammar.Argument('name'),
+        chat.grammar.Argument('--quantity', default=1),
+        chat.grammar.Argument('--milk', const=True, default=False),
+        chat.grammar.Argument('--size', default='regular'),
+        chat.grammar.Argument('--no-milk', dest='milk', const=False),
+        chat.grammar.Argument('--takeaway', dest='location',
+                              const=False, default=True),
+    ]),
+    'chocolate': chat.grammar.compile('order chocolate', [
+        chat.grammar.Argument('name'),
+        chat.grammar.Argument('--quantity', default=1),
+        chat.grammar.Argument('--dark', dest='shade',
+                              const='dark', default='dark'),
+        chat.grammar.Argument('--white', dest='shade', const='white'),
+        chat.grammar.Argument('--takeaway', dest='location',
+                              const=False, default=True),
+    ]),
+}
+
+
 class Factory(object):
     __metaclass__ = chat.lib.DynamicRegistry
+    abstract = True
 
-    def mediate(self, typ, receiver, envelope):
+    @classmethod
+    def mediate(cls, typ, receiver, envelope):
         try:
-            mediator = self.registry[typ.lower()]()
-            mediator.execute(receiver, envelope)
+            mediator = cls.lookup(typ)
         except KeyError:
             raise ValueError("Unhandled mediate: %s" % typ.lower())
 
+        if envelope.trace:
+            chat.tracing.mark(envelope, 'mediate.' + typ.lower())
+
+        mediator.execute(receiver, envelope)
+
     def publish(self, receiver, envelope):
         receiver.publish(envelope)
 
+        if not receiver.logs.wants('info', envelope.type):
+            return
+
         name = "%s.%s" % (__name__, type(self).__name__)
         log = chat.protocol.Log(
             name=name,
             author=envelope.author,
             level='info',
-            string='{} was published'.format(envelope.type),
-            trace=envelope.trace)
+            string='{} was published'.format(envelope.type))
 
         receiver.log(log)
 
     def execute(self, receiver, envelope):
-        envelope.trace += ['mediate.letter']
+        pass
 
 
 class Letter(Factory):
@@ -61,36 +93,99 @@ class Letter(Factory):
     def execute(self, receiver, envelope):
         super(Letter, self).execute(receiver, envelope)
 
-        if not envelope.author in receiver.letters:
-            receiver.letters[envelope.author] = {}
-
         # Maintain all original authors
-        receiver.peers.add(envelope.author)
+        receiver.register(envelope.author)
 
-        author = envelope.author
-        timestamp = envelope.timestamp
-        receiver.letters[author][timestamp] = envelope.to_dict()
+        # Once and in order, when sent reliably
+        for letter in receiver.accept(envelope):
 
-        self.publish(receiver, envelope)
+            # Stored as-is; the payload is passed through undecoded
+            receiver.letters.add(letter, size=letter.size or 0)
+            receiver.persist(letter)
+
+            self.publish(receiver, letter)
 
 
 class StateQuery(Factory):
+    CHUNK_BYTES = 64 * 1024  # Approximate size of each reply
+
     def execute(self, receiver, envelope):
+        """Stream letters addressed to the author, in chunks
+
+        The query is either a list of authors, or a dict of
+        `authors` along with an optional `since` and `until`
+        timestamp. Without authors, letters of all authors are
+        included.
+
+        Peers pass the `epoch` and `sequence` of the last letter
+        seen to only receive those stored since, see
+        `chat.store.LetterStore`. Each reply carries the same, such
+        that a peer may pick up where it left off. Replies to queries
+        filtered by author or time carry the sequence passed in, as
+        letters left out must not count as seen.
+
+        """
+
         super(StateQuery, self).execute(receiver, envelope)
 
         query = envelope.payload
+        questioner = envelope.author
 
-        threads = {}
-        for author in query:
-            state = receiver.letters.get(author, {})
-            threads.update(state)
+        # Asking for state resumes peers too slow to keep up
+        receiver.flow.resume(questioner)
 
-        envelope = chat.protocol.Envelope(author=envelope.author,
-                                          payload=threads,
-                                          recipients=[envelope.author],
-                                          type='state')
+        if not isinstance(query, dict):
+            query = {'authors': query}
 
-        self.publish(receiver, envelope)
+        after = None
+        if query.get('epoch') == receiver.letters.epoch:
+            after = query.get('sequence')
+
+        letters = [letter for letter
+                   in receiver.letters.range(query.get('authors') or None,
+                                             since=query.get('since'),
+                                             until=query.get('until'),
+                                             after=after)
+                   if questioner in (letter.recipients or [])]
+
+        # In order of storage, such that the sequence of each chunk
+        # covers every letter of those before it.
+        letters.sort(key=lambda letter: letter.sequence)
+
+        chunks = list()
+        chunk, size = list(), 0
+
+        for letter in letters:
+            if chunk and size + (letter.size or 0) > self.CHUNK_BYTES:
+                chunks.append(chunk)
+                chunk, size = list(), 0
+
+            chunk.append(letter)
+            size += letter.size or 0
+
+        chunks.append(chunk)
+
+        filtered = any(query.get(key)
+                       for key in ('authors', 'since', 'until'))
+
+        # Sent even when empty, letting peers know of the epoch
+        for index, chunk in enumerate(chunks):
+            sequence = after
+            if not filtered:
+                sequence = max([after] +
+                               [letter.sequence for letter in chunk])
+
+            state = {'epoch': receiver.letters.epoch,
+                     'sequence': sequence,
+                     'remaining': len(chunks) - index - 1,
+                     'letters': [letter.to_dict() for letter in chunk]}
+
+            envelope = chat.protocol.Envelope(author=questioner,
+                                              payload=state,
+                                              recipients=[questioner],
+                                              type='state')
+
+            self.publish(receiver, envelope)
 
 
 class PeersQuery(Factory):
@@ -107,8 +202,6 @@ class PeersQuery(Factory):
 
 class Invitation(Factory):
     def execute(self, receiver, envelope):
-        envelope.trace += ['mediate.invitation']
-
         invitation = envelope.payload
         envelope = chat.protocol.Envelope(author=envelope.author,
                                           payload=invitation,
@@ -117,8 +210,8 @@ class Invitation(Factory):
                                           trace=envelope.trace)
         print "%s inviting %s" % (envelope.author, invitation)
 
-        receiver.peers.update(invitation)
-        receiver.peers.add(envelope.author)
+        for peer in set(invitation) | set([envelope.author]):
+            receiver.register(peer)
 
         self.publish(receiver, envelope)
 
@@ -130,6 +223,8 @@ class OrderPlacement(Factory):
         Your options are:
             coffee
             chocolate
+            status
+            workers
 
         """
 
@@ -139,23 +234,23 @@ class OrderPlacement(Factory):
         prices = {'coffee': 2.10,
                   'chocolate': 0.30}
 
-        trace = envelope.trace
-        trace += ["%s.%s<%s>" % (__name__,
-                                 type(self).__name__,
-                                 item)]
-
         out_envelope = chat.protocol.Envelope(
             author=envelope.author,
             payload=None,
             recipients=[envelope.author],
             type='error',
-            trace=trace)
+            trace=envelope.trace)
 
         if item == 'status':
             orders = args or chat.service.orders.keys()
             statuses = {}
 
             for order in orders:
+                # Orders of a status, e.g. "order status served"
+                if not str(order).isdigit():
+                    statuses[order] = chat.service.orders.by_status(order)
+                    continue
+
                 try:
                     order_ = chat.service.orders[int(order)]
                     statuses[order] = order_.status
@@ -165,33 +260,32 @@ class OrderPlacement(Factory):
             out_envelope.payload = statuses
             out_envelope.type = 'orderStatus'
 
-        elif item == 'coffee':
-            parser = chat.lib.ArgumentParser(prog='order coffee')
-            parser.add_argument("name")
-            parser.add_argument("--quantity", default=1)
-            parser.add_argument("--milk", dest="milk", action="store_true")
-            parser.add_argument("--size", default='regular')
-            parser.add_argument("--no-milk",
-                                dest="milk",
-                                action="store_false")
-            parser.add_argument("--takeaway",
-                                dest="location",
-                                action="store_false",
-                                default=True)
+        elif item == 'workers':
+            # Load of each worker, see `chat.dispatch`
+            utilization = dict()
 
+            if receiver.dispatcher is not None:
+                utilization = receiver.dispatcher.utilization()
+                utilization['(backlog)'] = receiver.dispatcher.backlog
+
+            out_envelope.payload = utilization
+            out_envelope.type = 'orderStatus'
+
+        elif item in ('coffee', 'chocolate'):
+            grammar = ORDERS[item]
             parsed = None
 
             try:
-                parsed = parser.parse_args(args).__dict__
+                parsed = grammar.parse(args)
 
             except ValueError:
-                out_envelope.payload = parser.format_help()
+                out_envelope.payload = grammar.format_help()
 
             except SystemExit:
                 # Parser exited without error (e.g. to return help)
                 pass
 
-            if parsed:
+            if parsed and item == 'coffee':
                 location = parsed.pop('location')
                 price = prices['coffee'] * int(parsed['quantity'])
 
@@ -203,7 +297,11 @@ class OrderPlacement(Factory):
                 # Execute order
 
                 try:
-                    order = chat.service.order_coffee(order)
+                    if receiver.dispatcher is not None:
+                        order = receiver.place(order)
+                    else:
+                        order = chat.service.order_coffee(order)
+
                     result = order.to_dict()
 
                 except Exception as e:
@@ -214,38 +312,7 @@ class OrderPlacement(Factory):
                     out_envelope.payload = result
                     out_envelope.type = 'orderReceipt'
 
-        elif item == 'chocolate':
-            parser = chat.lib.ArgumentParser(prog='order chocolate')
-            parser.add_argument("name")
-            parser.add_argument("--quantity", default=1)
-            parser.add_argument("--dark",
-                                dest="shade",
-                                action="store_const",
-                                const='dark',
-                                default='dark')
-            parser.add_argument("--white",
-                                dest="shade",
-                                action="store_const",
-                                const='white',
-                                default='dark')
-            parser.add_argument("--takeaway",
-                                dest="location",
-                                action="store_false",
-                                default=True)
-
-            parsed = None
-
-            try:
-                parsed = parser.parse_args(args).__dict__
-
-            except ValueError:
-                out_envelope.payload = parser.format_help()
-
-            except SystemExit:
-                # Parser exited without error (e.g. to return help)
-                pass
-
-            if parsed:
+            elif parsed:
                 location = parsed.pop('location')
                 price = prices['chocolate'] * int(parsed['quantity'])
 
@@ -274,6 +341,67 @@ class OrderPlacement(Factory):
         self.publish(receiver, out_envelope)
 
 
+class WorkerReady(Factory):
+    key = '__workerready__'
+
+    def execute(self, receiver, envelope):
+        """Worker announces itself along with its stats
+
+        WORKER
+         _             SWARM
+        | |   stats     _
+        | |----------->|\|
+        | |            |\|
+        | |   brew     |\|
+        | |<-----------|\|    (orders held until now, if any)
+        |_|            |_|
+
+        """
+
+        if receiver.dispatcher is None:
+            return
+
+        for order_id, worker in receiver.dispatcher.join(envelope.author,
+                                                         envelope.payload):
+            receiver.brew(order_id, worker)
+
+
+class OrderUpdate(Factory):
+    key = '__orderupdate__'
+
+    def execute(self, receiver, envelope):
+        """Worker reports progress of an order handed to it
+
+        WORKER
+         _             SWARM
+        | |   brew      _
+        | |<-----------|\|
+        | |            |\|
+        | |   status   |\|
+        | |----------->|\|
+        | |            |\|
+        | |   served   |\|
+        | |----------->|\|
+        |_|            |_|
+
+        """
+
+        order_id = envelope.payload['id']
+        status = envelope.payload['status']
+
+        if receiver.dispatcher is None:
+            return
+
+        # Since handed to another, having been considered gone
+        if receiver.dispatcher.owner(order_id) != envelope.author:
+            return
+
+        order = chat.service.orders.update(order_id, status)
+
+        if order is not None and status == 'served':
+            receiver.dispatcher.done(order_id)
+
+
 class PeerQuery(Factory):
     def execute(self, receiver, envelope):
         """Swarm queries peer
@@ -298,12 +426,31 @@ class PeerQuery(Factory):
 
         """
 
-        envelope.trace += ['mediate.peer_query']
+        # Optionally followed by seconds to wait for answers
+        peers, query = envelope.payload[:2]
+        timeout = envelope.payload[2] if len(envelope.payload) > 2 else None
+
+        # Answered from memory where possible, see `chat.cache`
+        query = chat.protocol.Query.from_dict(query)
+        hits, ask = receiver.cache.split(query.name, peers)
+
+        # Answers are gathered into one, see `chat.gather`
+        pending, evicted = receiver.queries.open(query, peers, timeout,
+                                                 results=hits)
+
+        if evicted is not None:
+            receiver.gathered(evicted)
+
+        if pending.complete:
+            receiver.gathered(pending)
+
+        # Peers not answered from memory, or answered with stale results
+        if not ask:
+            return
 
-        peers, query = envelope.payload
         envelope = chat.protocol.Envelope(author=envelope.author,
-                                          payload=query,
-                                          recipients=peers,
+                                          payload=query.to_dict(),
+                                          recipients=ask,
                                           type='__swarmQuery__',
                                           trace=envelope.trace)
 
@@ -336,10 +483,25 @@ class PeerResults(Factory):
 
         """
 
-        envelope.trace += ['mediate.peer_results']
-
-        print "peer_results: %s" % envelope.to_dict()
         results = chat.protocol.QueryResults.from_dict(envelope.payload)
+        receiver.cache.put(results)
+
+        # Pushed by peer on a schedule, to be cached alone
+        if results.questioner is None:
+            return
+
+        if results.id is not None:
+            # Gathered by the swarm owning the questioner
+            if not receiver.owns(results.questioner):
+                return receiver.forward(results.questioner, envelope)
+
+            pending = receiver.queries.answer(results)
+
+            if pending is not None:
+                receiver.gathered(pending)
+
+            return
+
         envelope = chat.protocol.Envelope(author=results.peer,
                                           payload=results,
                                           recipients=[results.questioner],
@@ -348,7 +510,33 @@ class PeerResults(Factory):
         self.publish(receiver, envelope)
 
 
+class Flow(Factory):
+    key = '__flow__'
+
+    def execute(self, receiver, envelope):
+        """Peer reports messages missed, and the last one received
+
+        PEER A
+         _             SWARM
+        | |   letter    _
+        | |<-----------|/|
+        | |     x------|/|    (dropped, past high-water mark)
+        | |   letter   |/|
+        | |<-----------|/|
+        | |            |/|
+        | |   flow     |/|
+        | |----------->|/|
+        | |            |/|
+        | |   state    |/|    (or throttled, or disconnected)
+        | |<===========|_|
+        |_|
+
+        """
+
+        receiver.lagging(envelope.author, envelope.payload)
+
+
 class Heartbeat(Factory):
     def execute(self, receiver, envelope):
         """Update peer status"""
-        receiver.heartbeats[envelope.author] = time.time()
+        receiver.heartbeats.refresh(envelope.author)
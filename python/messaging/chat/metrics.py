@@ -0,0 +1,327 @@
+"""Counters, gauges and histograms of a running swarm or peer
+
+Metrics are kept in a registry, created once by name and updated
+in place. Snapshots of every metric are taken periodically and
+published by the swarm on the 'metrics' topic, to subscribers only,
+and optionally served as text over HTTP for tools that poll.
+     _________       ___________________
+    |         |     |                   |---> 'metrics' (PUB)
+    |  swarm  |---->|     Registry      |
+    |_________|     | counters, gauges, |---> http://localhost:PORT
+                    |    histograms     |
+                    |___________________|
+
+A disabled registry hands out metrics that do nothing, such that
+instrumented code costs a method call and no more; code measuring
+time, such as around mediators, checks `enabled` first.
+
+Gauges are sampled when snapshot, either from a function of their
+own or in bulk from functions returning many values at once, such
+as the stats of a `chat.orders.OrderEngine`, see `Registry.source`.
+
+Usage:
+    >>> metrics = Registry()
+    >>> metrics.counter('envelopes.received').inc()
+    >>> metrics.gauge('peers', func=lambda: 3)
+    >>> metrics.histogram('route.us').add(153)
+    >>> metrics.snapshot()['counters']
+    {'envelopes.received': 1}
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import time
+import threading
+import collections
+import BaseHTTPServer
+
+# local library
+import chat.lib
+
+__all__ = [
+    'Registry',
+    'Counter',
+    'Gauge',
+    'Histogram',
+    'TOPIC',
+]
+
+TOPIC = 'metrics'
+
+
+class Counter(object):
+    """Monotonically increasing count
+
+    Increments are not locked, such that an increment racing
+    another from a different thread may rarely be lost.
+
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge(object):
+    """Value at a point in time, set or sampled from `func`"""
+
+    def __init__(self, name, func=None):
+        self.name = name
+        self.func = func
+        self._value = 0
+
+    @property
+    def value(self):
+        if self.func is not None:
+            return self.func()
+        return self._value
+
+    def set(self, value):
+        self._value = value
+
+
+class Histogram(object):
+    """Counts of values, in buckets of logarithmic width
+
+    Each power of two is divided into `precision` buckets, such
+    that percentiles are accurate to within 1/precision of their
+    value regardless of magnitude, at constant memory, much like
+    HdrHistogram.
+
+    Arguments:
+        name (str): Name of histogram
+        precision (int): Buckets per power of two
+
+    """
+
+    def __init__(self, name=None, precision=16):
+        self.name = name
+        self.precision = precision
+        self.counts = collections.Counter()  # Count, by bucket
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        value = max(0, int(value))
+        self.counts[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        """Return upper bound of values below `fraction` of all"""
+        if not self.count:
+            return None
+
+        rank = fraction * self.count
+        seen = 0
+
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self._upper(bucket), self.max)
+
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / float(self.count) if self.count else None
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.mean,
+                'p50': self.percentile(0.5),
+                'p99': self.percentile(0.99),
+                'p999': self.percentile(0.999),
+                'max': self.max}
+
+    def _bucket(self, value):
+        if value < self.precision:
+            return value
+
+        exponent = value.bit_length() - 1
+        shift = exponent - self.precision.bit_length() + 1
+        return (shift << 16) | (value >> shift)
+
+    def _upper(self, bucket):
+        shift, mantissa = bucket >> 16, bucket & 0xffff
+        return ((mantissa + 1) << shift) - 1
+
+
+class _Null(object):
+    """Metric of a disabled registry, doing nothing"""
+
+    name = None
+    value = 0
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def add(self, value):
+        pass
+
+
+_null = _Null()
+
+
+class Registry(object):
+    """Metrics, by name
+
+    Arguments:
+        enabled (bool): Whether to keep metrics at all
+        interval (float): Seconds between snapshots, see `due`
+        port (int): Serve snapshots as text on this port of
+            localhost, if given, see `serve`
+
+    """
+
+    def __init__(self, enabled=True, interval=5, port=None):
+        self.enabled = enabled
+        self.interval = interval
+        self.port = port
+
+        self._counters = dict()
+        self._gauges = dict()
+        self._histograms = dict()
+        self._sources = dict()  # Function returning many, by prefix
+        self._lock = threading.Lock()
+        self._last = time.time()
+
+        self.subscriptions = set()
+        self.subscribed = False
+
+        if enabled and port is not None:
+            self.serve(port)
+
+    def counter(self, name):
+        if not self.enabled:
+            return _null
+        return self._get(self._counters, name, Counter)
+
+    def gauge(self, name, func=None):
+        if not self.enabled:
+            return _null
+
+        gauge = self._get(self._gauges, name, Gauge)
+        if func is not None:
+            gauge.func = func
+        return gauge
+
+    def histogram(self, name, precision=16):
+        if not self.enabled:
+            return _null
+        return self._get(self._histograms, name,
+                         lambda name: Histogram(name, precision))
+
+    def source(self, prefix, func):
+        """Sample gauges named `prefix`.KEY from dict of `func`"""
+        if self.enabled:
+            self._sources[prefix] = func
+
+    def snapshot(self):
+        """Return current value of every metric"""
+        with self._lock:
+            counters = self._counters.values()
+            gauges = self._gauges.values()
+            histograms = self._histograms.values()
+            sources = self._sources.items()
+
+        snapshot = {
+            'timestamp': time.time(),
+            'counters': dict((c.name, c.value) for c in counters),
+            'gauges': dict((g.name, g.value) for g in gauges),
+            'histograms': dict((h.name, h.summary()) for h in histograms),
+        }
+
+        for prefix, func in sources:
+            for key, value in func().iteritems():
+                snapshot['gauges']['%s.%s' % (prefix, key)] = value
+
+        return snapshot
+
+    def exposition(self):
+        """Return snapshot as text, one metric per line"""
+        snapshot = self.snapshot()
+        lines = list()
+
+        def line(name, value, suffix=''):
+            name = 'chat_' + name.replace('.', '_').replace(' ', '_')
+            lines.append("%s%s %s" % (name, suffix, value))
+
+        for name, value in sorted(snapshot['counters'].items()):
+            line(name, value)
+
+        for name, value in sorted(snapshot['gauges'].items()):
+            line(name, value)
+
+        for name, summary in sorted(snapshot['histograms'].items()):
+            for key, quantile in (('p50', '0.5'),
+                                  ('p99', '0.99'),
+                                  ('p999', '0.999')):
+                line(name, summary[key], '{quantile="%s"}' % quantile)
+            line(name, summary['count'], '_count')
+            line(name, summary['max'], '_max')
+
+        return '\n'.join(lines) + '\n'
+
+    def subscription(self, message):
+        """Update subscribers from XPUB subscription `message`"""
+        topic = message[1:]
+
+        if message[:1] == '\x01':
+            self.subscriptions.add(topic)
+        else:
+            self.subscriptions.discard(topic)
+
+        self.subscribed = any(TOPIC.startswith(topic)
+                              for topic in self.subscriptions)
+
+    def due(self, now=None):
+        """Return whether a snapshot is due for subscribers"""
+        if not (self.enabled and self.subscribed):
+            return False
+
+        now = now or time.time()
+        if now - self._last < self.interval:
+            return False
+
+        self._last = now
+        return True
+
+    def serve(self, port):
+        """Serve snapshots as text on `port` of localhost"""
+        registry = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.exposition()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = BaseHTTPServer.HTTPServer(('localhost', port), Handler)
+        chat.lib.spawn(server.serve_forever, name='metrics')
+        return server
+
+    def _get(self, metrics, name, cls):
+        try:
+            return metrics[name]
+        except KeyError:
+            with self._lock:
+                if name not in metrics:
+                    metrics[name] = cls(name)
+                return metrics[name]
@@ -0,0 +1,350 @@
+"""Orders in flight, advanced through their steps by a single timer
+
+Each order follows a recipe of steps, each a status along with the
+seconds until the next. Rather than a thread per order, due steps
+are kept in one heap and applied by one thread, such that orders
+in flight cost memory alone.
+     ________      ________________      _____________      ________
+    |        |    |                |    |             |    |        |
+    | placed |--->| being prepared |--->| in progress |--->| served |
+    |________|    |________________|    |_____________|    |________|
+                         10s                  30s              |
+                                                                v
+                                                            archive
+
+Orders are indexed by id and by status. Orders completing their
+recipe are moved to an archive, keeping only the most recent.
+
+Orders may also be held, their status updated from elsewhere, such
+as when made by a worker, see `chat.dispatch`.
+
+Usage:
+    >>> orders = OrderEngine()
+    >>> order = orders.place(order, recipe=COFFEE)
+    >>> orders.by_status('being prepared')
+    [0]
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import time
+import heapq
+import threading
+import collections
+
+# local library
+import chat.lib
+
+__all__ = [
+    'OrderEngine',
+    'COFFEE',
+    'CHOCOLATE',
+    'RECIPES',
+]
+
+# Recipes, each step a status and seconds until the next
+COFFEE = (('being prepared', 10),
+          ('in progress', 30),
+          ('served', None))
+
+CHOCOLATE = (('served', None),)  # Chocolate is self-serve
+
+RECIPES = {
+    'coffee': COFFEE,
+    'chocolate': CHOCOLATE,
+}
+
+
+class OrderEngine(object):
+    """Orders in flight and completed, by id
+
+    Arguments:
+        archive (int): Completed orders kept
+
+    Behaves like a dictionary of orders by id, in flight
+    and archived alike. Thread-safe.
+
+    Signals:
+        changed (order): Emitted with each order changing status,
+            from the thread changing it, once the engine is no
+            longer locked.
+
+    """
+
+    def __init__(self, archive=10000):
+        self.archive_size = archive
+
+        self._orders = dict()  # Orders in flight, by id
+        self._archive = collections.OrderedDict()  # Completed, by id
+        self._statuses = collections.defaultdict(set)  # Ids, by status
+        self._recipes = dict()  # Remaining steps, by id
+        self._timers = list()  # (due, id), soonest first
+
+        self._next = 0  # Next id
+        self._running = False
+        self._condition = threading.Condition()
+
+        self.changed = chat.lib.Signal()
+
+        self.stats = collections.Counter()
+
+    def __getitem__(self, order_id):
+        with self._condition:
+            try:
+                return self._orders[order_id]
+            except KeyError:
+                return self._archive[order_id]
+
+    def __setitem__(self, order_id, order):
+        """Add existing `order`, such as when restored from a journal
+
+        Orders are added as they are; those not yet completed
+        are held in their current status.
+
+        """
+
+        with self._condition:
+            self._discard(order_id)
+            self._next = max(self._next, order_id + 1)
+
+            if order.status == 'served':
+                self._store(order_id, order)
+            else:
+                self._orders[order_id] = order
+                self._statuses[order.status].add(order_id)
+
+    def __contains__(self, order_id):
+        return order_id in self._orders or order_id in self._archive
+
+    def __len__(self):
+        return len(self._orders) + len(self._archive)
+
+    def get(self, order_id, default=None):
+        try:
+            return self[order_id]
+        except KeyError:
+            return default
+
+    def keys(self):
+        with self._condition:
+            return self._orders.keys() + self._archive.keys()
+
+    def values(self):
+        with self._condition:
+            return self._orders.values() + self._archive.values()
+
+    def by_status(self, status):
+        """Return ids of orders in flight of `status`"""
+        with self._condition:
+            return sorted(self._statuses.get(status, ()))
+
+    def counts(self):
+        """Return number of orders in flight, per status"""
+        with self._condition:
+            return dict((status, len(ids))
+                        for status, ids in self._statuses.iteritems()
+                        if ids)
+
+    def place(self, order, recipe):
+        """Assign `order` an id and start following `recipe`
+
+        Arguments:
+            order (chat.protocol.Order): Order to place
+            recipe (tuple): Steps of (status, seconds until next)
+
+        """
+
+        with self._condition:
+            order.id = self._next
+            self._next += 1
+
+            self._orders[order.id] = order
+            self._recipes[order.id] = list(reversed(recipe))
+            self._advance(order.id, time.time())
+
+            self.stats['placed'] += 1
+
+        self.changed.emit(order)
+
+        if not self._running:
+            self.start()
+
+        return order
+
+    def resume(self, order_id, recipe):
+        """Follow `recipe` from the status `order_id` is held in
+
+        Such as when restored from a journal, see `__setitem__`; the
+        current step starts over, and orders in a status not of
+        `recipe` start from its first.
+
+        """
+
+        with self._condition:
+            statuses = [status for status, delay in recipe]
+            order = self._orders[order_id]
+
+            if order.status in statuses:
+                recipe = recipe[statuses.index(order.status):]
+
+            self._recipes[order_id] = list(reversed(recipe))
+            self._advance(order_id, time.time())
+
+            self.stats['resumed'] += 1
+
+        self.changed.emit(order)
+
+        if not self._running:
+            self.start()
+
+        return order
+
+    def hold(self, order, status='queued'):
+        """Assign `order` an id, holding it until updated
+
+        Arguments:
+            order (chat.protocol.Order): Order to hold
+            status (str): Status held in
+
+        """
+
+        with self._condition:
+            order.id = self._next
+            self._next += 1
+
+            order.status = status
+            self._orders[order.id] = order
+            self._statuses[status].add(order.id)
+
+            self.stats['held'] += 1
+
+        self.changed.emit(order)
+        return order
+
+    def update(self, order_id, status):
+        """Set status of held order, completing it once served
+
+        Returns the order, or None if no longer in flight.
+
+        """
+
+        with self._condition:
+            order = self._orders.get(order_id)
+
+            if order is None or order_id in self._recipes:
+                return None
+
+            self._statuses[order.status].discard(order_id)
+            order.status = status
+            self.stats[status] += 1
+
+            if status == 'served':
+                self._orders.pop(order_id)
+                self._store(order_id, order)
+            else:
+                self._statuses[status].add(order_id)
+
+        self.changed.emit(order)
+        return order
+
+    def start(self):
+        """Start advancing orders, in a thread of its own"""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+
+        chat.lib.spawn(self.run, name='orders')
+
+    def run(self):
+        """Apply due steps, sleeping until the next"""
+        while True:
+            with self._condition:
+                now = self._wait()
+
+            self.tick(now)
+
+    def _wait(self):
+        """Return time once the next step is due, while locked"""
+        while True:
+            if not self._timers:
+                self._condition.wait()
+                continue
+
+            now = time.time()
+            due = self._timers[0][0]
+
+            if due <= now:
+                return now
+
+            self._condition.wait(due - now)
+
+    def tick(self, now=None):
+        """Apply every step due by `now`, return how many"""
+        now = now or time.time()
+        changed = list()
+
+        with self._condition:
+            while self._timers and self._timers[0][0] <= now:
+                due, order_id = heapq.heappop(self._timers)
+
+                # Replaced since, see `__setitem__`
+                if order_id not in self._recipes:
+                    continue
+
+                changed.append(self._advance(order_id, due))
+
+        for order in changed:
+            self.changed.emit(order)
+
+        return len(changed)
+
+    def _advance(self, order_id, now):
+        """Apply next step of `order_id`, scheduling the one after
+
+        Returns the order, for `changed` to be emitted by the caller
+        once no longer locked.
+
+        """
+
+        order = self._orders[order_id]
+        recipe = self._recipes[order_id]
+        status, delay = recipe.pop()
+
+        self._statuses[order.status].discard(order_id)
+        order.status = status
+        self.stats[status] += 1
+
+        if delay is None or not recipe:
+            self._recipes.pop(order_id)
+            self._orders.pop(order_id)
+            self._store(order_id, order)
+            return order
+
+        self._statuses[status].add(order_id)
+
+        sooner = not self._timers or now + delay < self._timers[0][0]
+        heapq.heappush(self._timers, (now + delay, order_id))
+
+        # Wake up the timer, its next step being sooner
+        if sooner:
+            self._condition.notify()
+
+        return order
+
+    def _store(self, order_id, order):
+        self._archive[order_id] = order
+
+        while len(self._archive) > self.archive_size:
+            self._archive.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    def _discard(self, order_id):
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            self._statuses[order.status].discard(order_id)
+            self._recipes.pop(order_id, None)
+
+        self._archive.pop(order_id, None)
@@ -2,20 +2,29 @@ from __future__ import absolute_import
 
 # standard library
 import sys
-import json
-import time
+import random
+import threading
 
 # dependencies
 import zmq
 
 # local library
 import chat.lib
+import chat.batch
+import chat.codec
+import chat.compression
+import chat.metrics
 import chat.service
+import chat.reactor
+import chat.tracing
+import chat.flow
+import chat.reliable
 import chat.protocol
+import chat.federation
 import chat.mediator.peer
 import chat.router.peer
 
-context = zmq.Context()
+context = zmq.Context.instance()  # Shared, such that inproc reaches across
 
 
 class Peer(object):
@@ -26,29 +35,124 @@ class Peer(object):
     def __init__(self,
                  name='unknown',
                  peers=None,
-                 services=None):
+                 services=None,
+                 codec='binary',
+                 heartbeat_interval=2,
+                 heartbeat_jitter=0.2,
+                 engine='threads',
+                 swarms=None,
+                 batch=None,
+                 stats_interval=None,
+                 trace_sample=0.0,
+                 metrics=None,
+                 hwms=None,
+                 flow_interval=None,
+                 reliable=None,
+                 compress=None):
         """
         Arguments:
             name(str): Name of author
             peers(list): Authors to chat with
             services(list): Exposed services
+            codec(str): Name of codec used for outgoing messages
+            heartbeat_interval(float): Seconds between heartbeats
+            heartbeat_jitter(float): Maximum seconds by which to
+                randomly offset each heartbeat, such that peers
+                started together do not beat in unison.
+            engine (str): 'threads' listens and beats in a thread
+                each, 'reactor' does both from a single thread,
+                see `chat.reactor`.
+            swarms (list): Addresses of federated swarms, of which
+                the one owning `name` is connected to, see
+                `chat.federation`.
+            batch (dict): Arguments to chat.batch.Batch, such as
+                `size` and `interval`, coalescing envelopes sent in
+                bursts; None sends each on its own.
+            stats_interval (float): Seconds between stats pushed to
+                the swarm, cached for queries, see `chat.cache`;
+                None only answers when asked.
+            trace_sample (float): Fraction of envelopes sent whose
+                hops are traced, see `chat.tracing`.
+            metrics (dict): Arguments to chat.metrics.Registry, such
+                as `port`; None keeps no metrics.
+            hwms (dict): Messages queued per socket before ZeroMQ
+                blocks or drops, by 'push' and 'sub', see
+                `chat.flow.HWMS`.
+            flow_interval (float): Seconds between reports of
+                messages missed to the swarm, when there is news,
+                see `chat.flow`; None, the default, never reports.
+            reliable (dict): Arguments to chat.reliable.Window, such
+                as `size` and `timeout`, sending letters again until
+                acknowledged; None sends them fire-and-forget.
+            compress (dict): Arguments to chat.compression.Compressed,
+                such as `threshold` and `dictionary`, compressing
+                large frames; None sends each as encoded.
 
         """
+
+        if engine not in ('threads', 'reactor'):
+            raise ValueError("Unknown engine: %s" % engine)
+
         self.name = name
         self.peers = set()  # Filled up below
 
+        # Last letter seen, see `chat.store.LetterStore`
+        self.epoch = None
+        self.sequence = None
+        self.codec = chat.codec.by_name(codec)
+        if compress is not None:
+            self.codec = chat.compression.Compressed(self.codec, **compress)
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_jitter = heartbeat_jitter
+        self.stats_interval = stats_interval
+        self.sampler = chat.tracing.Sampler(rate=trace_sample)
+        self.metrics = chat.metrics.Registry(enabled=metrics is not None,
+                                             **(metrics or {}))
+        self.sent = self.metrics.counter('envelopes.sent')
+        self.received = self.metrics.counter('envelopes.received')
+        self.missed = self.metrics.counter('messages.missed')
+        self.flow_interval = flow_interval
+        self.tracker = chat.flow.Tracker()
+        self.behind = False  # Having missed letters, until caught up
+        hwms = dict(chat.flow.HWMS, **(hwms or {}))
+
+        # Letters in flight, until acknowledged
+        self.window = None
+        if reliable is not None:
+            self.window = chat.reliable.Window(**reliable)
+            self.metrics.source('reliable', lambda: dict(self.window.stats))
+        self.engine = engine
+        self.reactor = None
+
+        ring = chat.federation.Ring(swarms or ['localhost:5555'])
+        self.swarm = ring.owner(name)
+        endpoints = chat.federation.endpoints(self.swarm)
+
         push = context.socket(zmq.PUSH)
-        push.connect("tcp://localhost:5555")
+        push.setsockopt(zmq.SNDHWM, hwms['push'])
+        push.connect(endpoints['pull'])
 
+        # Only receive what is addressed to `name`, filtered
+        # by ZeroMQ prior to being received.
         sub = context.socket(zmq.SUB)
+        sub.setsockopt(zmq.RCVHWM, hwms['sub'])
+        sub.setsockopt(zmq.SUBSCRIBE, chat.protocol.topic(name))
         sub.setsockopt(zmq.SUBSCRIBE, 'default')
-        sub.connect("tcp://localhost:5556")
+        sub.connect(endpoints['pub'])
 
         self.push = push
         self.sub = sub
 
-        chat.lib.spawn(self.listen, name='listen')
-        chat.lib.spawn(self.heartbeat, name='heartbeat')
+        # Sends are made from the shell, listener and coroutines
+        # alike, whereas ZeroMQ sockets are not thread-safe
+        self._push_lock = threading.Lock()
+
+        self.batch = None
+        if batch is not None:
+            self.batch = chat.batch.Batch(send=self.send_multipart,
+                                          **batch)
+
+        self.start()
 
         # Catchup
         self.route_command('state')
@@ -56,9 +160,135 @@ class Peer(object):
         for peer in peers or []:
             self.route_command('invite %s' % peer)
 
+    def start(self):
+        """Start listening and beating, in threads of their own"""
+
+        # Sends are made from the shell and listener alike, and
+        # batches flushed from a thread of their own either way.
+        if self.batch is not None:
+            chat.lib.spawn(self.batch.run, name='batch')
+
+        if self.engine == 'reactor':
+            return chat.lib.spawn(self.react, name='reactor')
+
+        chat.lib.spawn(self.listen, name='listen')
+        chat.lib.spawn(self.heartbeat, name='heartbeat')
+
+        for coroutine in self.coroutines():
+            chat.lib.schedule(coroutine)
+
+    def react(self):
+        """Listen and beat from one thread, see `chat.reactor`"""
+        reactor = chat.reactor.Reactor()
+        reactor.register(self.sub, self.on_message)
+        reactor.spawn(self.pulse())
+
+        for coroutine in self.coroutines():
+            reactor.spawn(coroutine)
+
+        self.reactor = reactor
+        reactor.run()
+
+    def coroutines(self):
+        """Return coroutines run for as long as the peer, if any"""
+        coroutines = list()
+
+        if self.stats_interval:
+            coroutines.append(self.push_stats())
+
+        if self.flow_interval:
+            coroutines.append(self.report_flow())
+
+        if self.window is not None:
+            coroutines.append(self.retransmit())
+
+        return coroutines
+
+    def rebalance(self, swarms):
+        """Move to whichever of `swarms` now owns this peer
+
+        Called from the listening thread, which owns `sub`.
+
+        """
+
+        swarm = chat.federation.Ring(swarms).owner(self.name)
+
+        if swarm == self.swarm:
+            return
+
+        previous = chat.federation.endpoints(self.swarm)
+        endpoints = chat.federation.endpoints(swarm)
+
+        with self._push_lock:
+            self.push.disconnect(previous['pull'])
+            self.push.connect(endpoints['pull'])
+        self.sub.disconnect(previous['pub'])
+        self.sub.connect(endpoints['pub'])
+
+        # Heartbeats follow, see `pulse`, serials start over
+        self.swarm = swarm
+        self.tracker = chat.flow.Tracker()
+
+        self.display_remote_message("Moved to %s" % swarm)
+
+        # Catch up from the new owner
+        self.route_command('state %s' % ' '.join(self.peers))
+
+    def seen(self, sequence, epoch=None):
+        """Remember the latest letter seen, for catching up later
+
+        Arguments:
+            sequence (int): Sequence of letter, as stored by swarm
+            epoch (str): Epoch of `sequence`, if known; a change
+                in epoch resets what has been seen
+
+        Letters received having missed messages are not remembered,
+        such that catching up starts from before what was missed.
+
+        """
+
+        if epoch is None and self.behind:
+            return
+
+        if epoch is not None and epoch != self.epoch:
+            self.epoch = epoch
+            self.sequence = None
+
+        if sequence is not None and sequence > self.sequence:
+            self.sequence = sequence
+
     def send(self, envelope):
         envelope.author = self.name
-        self.push.send_json(envelope.to_dict())
+        self.sampler.start(envelope, 'peer.send')
+
+        # Numbered, or queued while too many are in flight
+        if self.window is not None and envelope.type == 'letter':
+            for envelope in self.window.send(envelope):
+                self.transmit(envelope)
+            return
+
+        self.transmit(envelope)
+
+    def transmit(self, envelope):
+        """Send `envelope` as-is, batched if so configured
+
+        Every envelope leaves through here, from whichever thread;
+        `push` is only ever used by one at a time.
+
+        """
+
+        self.sent.inc()
+        frame = self.codec.dumps(envelope)
+
+        if self.batch is not None:
+            return self.batch.append(None, frame)
+
+        self.send_multipart([frame])
+
+    def send_multipart(self, frames):
+        """Send `frames` on `push`, from any thread"""
+        with self._push_lock:
+            self.push.send_multipart(frames)
 
     def formatter(self, envelope):
         return "\r{0}: {1}".format(envelope.author,
@@ -85,9 +315,20 @@ class Peer(object):
         """
 
         while True:
-            header, body = self.sub.recv_multipart()
-            message = json.loads(body)
-            envelope = chat.protocol.Envelope.from_dict(message)
+            self.on_message()
+
+    def on_message(self):
+        frames = self.sub.recv_multipart()
+
+        missed = self.tracker.observe(frames[0])
+        if missed:
+            self.missed.inc(missed)
+            self.behind = True
+
+        # Envelopes following the topic, many when batched
+        for body in frames[1:]:
+            envelope = chat.codec.loads(body)
+            self.received.inc()
             self.processor(envelope)
 
     def processor(self, envelope):
@@ -99,15 +340,15 @@ class Peer(object):
 
         """
 
-        if not self.name in envelope.recipients:
+        # Changes in federation are broadcast to everyone
+        if (not self.name in envelope.recipients and
+                envelope.type != 'nodes'):
             return
 
         type = envelope.type
 
-        factory = chat.mediator.peer.Factory()
-
         try:
-            factory.mediate(type, self, envelope)
+            chat.mediator.peer.Factory.mediate(type, self, envelope)
         except ValueError as e:
             self.display_remote_message(str(e))
 
@@ -135,20 +376,89 @@ class Peer(object):
 
         """
 
-        parts = command.split()
-        command, args = parts[0], parts[1:]
+        parts = command.split(None, 1)
+        if not parts:
+            return
 
-        factory = chat.router.peer.Factory()
+        command, text = parts[0], parts[1] if len(parts) > 1 else ''
 
         try:
-            factory.route(command, self, args)
+            chat.router.peer.Factory.route(command, self, text)
         except ValueError as e:
             self.display_local_message(str(e))
 
     def heartbeat(self):
-        envelope = chat.protocol.Envelope(type='heartbeat',
-                                          trace=['Peer.heartbeat'])
+        """Signal liveliness to swarm, on a channel of its own"""
+        chat.lib.run(self.pulse())
+
+    def pulse(self):
+        """Coroutine sending heartbeats, see `chat.lib.run`"""
+        pulse = context.socket(zmq.PUSH)
+        pulse.setsockopt(zmq.LINGER, 0)
+
+        record = chat.protocol.heartbeat(self.name)
+        swarm = None
 
         while True:
-            self.send(envelope)
-            time.sleep(2)
+            if swarm != self.swarm:
+                if swarm is not None:
+                    pulse.disconnect(
+                        chat.federation.endpoints(swarm)['pulse'])
+
+                swarm = self.swarm
+                pulse.connect(chat.federation.endpoints(swarm)['pulse'])
+
+            pulse.send(record)
+            yield (self.heartbeat_interval +
+                   random.uniform(-self.heartbeat_jitter,
+                                  self.heartbeat_jitter))
+
+    def acknowledged(self, number, gap=False):
+        """Release letters up to `number`, see `chat.reliable`
+
+        Called from the listener, sending alongside the shell and
+        `retransmit`, each through `transmit`.
+
+        """
+
+        for envelope in self.window.ack(number, gap):
+            self.transmit(envelope)
+
+    def retransmit(self):
+        """Coroutine sending letters not acknowledged in time"""
+        while True:
+            for envelope in self.window.due():
+                self.transmit(envelope)
+
+            yield self.window.rto / 2
+
+    def report_flow(self):
+        """Coroutine reporting messages missed, see `chat.flow`"""
+        last = None
+
+        while True:
+            report = self.tracker.report()
+
+            if report != last:
+                last = report
+
+                report = dict(report, epoch=self.epoch,
+                              sequence=self.sequence)
+                self.send(chat.protocol.Envelope(payload=report,
+                                                 type='__flow__'))
+
+            yield self.flow_interval
+
+    def push_stats(self):
+        """Coroutine sending stats unasked, see `chat.cache`"""
+        while True:
+            results = chat.protocol.QueryResults(
+                name='stats',
+                peer=self.name,
+                questioner=None,
+                payload=chat.lib.local_stats())
+
+            self.send(chat.protocol.Envelope(payload=results,
+                                             type='__peerResults__'))
+
+            yield self.stats_interval
@@ -1,8 +1,21 @@
+import copy
 import time
+import hashlib
+
+# Version of heartbeat records, see `heartbeat`
+HEARTBEAT = '\x02'
+HEARTBEAT_NAMED = '\x01'  # Of older peers, carrying the name as-is
 
 
 class Envelope(object):
-    """Over-the-wire protocol"""
+    """Over-the-wire protocol
+
+    The payload of an envelope decoded by `lazy` remains encoded
+    until first accessed, such that envelopes may be routed on
+    their header alone.
+
+    """
+
     def __str__(self):
         return "(%s: %s)" % (self.author, self.payload)
 
@@ -12,7 +25,12 @@ class Envelope(object):
                  timestamp=None,
                  recipients=None,
                  type=None,
-                 trace=None):
+                 trace=None,
+                 sequence=None,
+                 window=None):
+
+        self._blob = None  # Encoded payload, see `lazy`
+        self._codec = None
 
         self.payload = payload
         self.author = author
@@ -21,15 +39,53 @@ class Envelope(object):
         self.type = type
         self.return_address = None
         self.trace = trace or list()
+        self.sequence = sequence  # Order in which it was stored
+        self.window = window  # Order in which it was sent, if reliably
+        self.size = None  # Bytes on the wire, once received
 
+    @property
+    def payload(self):
+        if self._blob is not None:
+            self._payload = self._codec.decode(self._blob)
+            self._blob = None
+
+        return self._payload
+
+    @payload.setter
+    def payload(self, payload):
         if hasattr(payload, 'to_dict'):
-            self.payload = payload.to_dict()
+            payload = payload.to_dict()
+
+        self._payload = payload
+        self._blob = None
 
     @classmethod
     def from_dict(cls, dic):
         envelope = cls(**dic)
         return envelope
 
+    @classmethod
+    def lazy(cls, blob, codec, **header):
+        """Return envelope with payload `blob`, decoded on first access
+
+        Arguments:
+            blob (str): Encoded payload
+            codec (object): Object with a `decode` method,
+                used to decode `blob`
+            header (dict): Remaining arguments to `__init__`
+
+        """
+
+        envelope = cls(**header)
+        envelope._blob = blob
+        envelope._codec = codec
+        return envelope
+
+    def raw_payload(self, codec):
+        """Return payload as encoded by `codec`, if not yet decoded"""
+        if self._blob is not None and self._codec is codec:
+            return self._blob
+
     def to_dict(self):
         payload = self.payload
         if hasattr(payload, 'to_dict'):
@@ -41,7 +97,9 @@ class Envelope(object):
             'payload': payload,
             'timestamp': self.timestamp,
             'trace': self.trace,
-            'type': self.type
+            'type': self.type,
+            'sequence': self.sequence,
+            'window': self.window
         }
 
 
@@ -62,6 +120,13 @@ class AbstractItem(object):
 
 
 class Log(AbstractItem):
+    """Record of an event, optionally about an envelope
+
+    Logs may be sent well after they are made, see `chat.logs`, and
+    so hold a snapshot of `trace` and `envelope` as they were.
+
+    """
+
     def __init__(self,
                  name=None,
                  author=None,
@@ -76,11 +141,13 @@ class Log(AbstractItem):
         self.timestamp = timestamp or time.time()
         self.level = level
         self.string = string
-        self.trace = trace or list()
-        self.envelope = envelope
+        self.trace = list(trace or ())
 
-        if hasattr(envelope, 'to_dict'):
-            self.envelope = envelope.to_dict()
+        if isinstance(envelope, Envelope):
+            envelope = copy.copy(envelope)
+            envelope.trace = list(envelope.trace)
+
+        self.envelope = envelope  # Converted to dict in `to_dict`
 
     @classmethod
     def from_dict(cls, dic):
@@ -88,6 +155,10 @@ class Log(AbstractItem):
         return cls(**dic)
 
     def to_dict(self):
+        envelope = self.envelope
+        if hasattr(envelope, 'to_dict'):
+            envelope = envelope.to_dict()
+
         return {
             'name': self.name,
             'author': self.author,
@@ -95,16 +166,17 @@ class Log(AbstractItem):
             'level': self.level,
             'string': self.string,
             'trace': self.trace,
-            'envelope': self.envelope,
+            'envelope': envelope,
             'type': self.type
         }
 
 
 class Query(AbstractItem):
-    def __init__(self, name, questioner, payload=None):
+    def __init__(self, name, questioner, payload=None, id=None):
         self.name = name
         self.questioner = questioner
         self.payload = payload
+        self.id = id  # Correlates results, see `chat.gather`
 
         if hasattr(payload, 'to_dict'):
             self.payload = payload.to_dict()
@@ -119,6 +191,7 @@ class Query(AbstractItem):
         dic['name'] = self.name
         dic['questioner'] = self.questioner
         dic['payload'] = self.payload
+        dic['id'] = self.id
         return dic
 
     def reply(self, peer, payload):
@@ -126,22 +199,38 @@ class Query(AbstractItem):
             name=self.name,
             peer=peer,
             questioner=self.questioner,
-            payload=payload)
+            payload=payload,
+            id=self.id)
 
 
 class QueryResults(AbstractItem):
-    def __init__(self, name, peer, questioner, payload=None):
+    def __init__(self,
+                 name,
+                 peer,
+                 questioner,
+                 payload=None,
+                 id=None,
+                 missing=None):
         self.name = name  # Name or results (typically name of query)
         self.peer = peer  # Results from who?
         self.questioner = questioner  # Who's askin'?
         self.payload = payload  # The results themselves
+        self.id = id  # Id of query answered
+        self.missing = missing  # Peers not answering, when gathered
+
+    @property
+    def gathered(self):
+        """Whether results are those of many peers, see `chat.gather`"""
+        return self.missing is not None
 
     @classmethod
     def from_dict(cls, dic):
         return cls(name=dic['name'],
                    peer=dic['peer'],
                    questioner=dic['questioner'],
-                   payload=dic['payload'])
+                   payload=dic['payload'],
+                   id=dic.get('id'),
+                   missing=dic.get('missing'))
 
     def to_dict(self):
         dic = super(QueryResults, self).to_dict()
@@ -149,6 +238,8 @@ class QueryResults(AbstractItem):
         dic['peer'] = self.peer
         dic['questioner'] = self.questioner
         dic['payload'] = self.payload
+        dic['id'] = self.id
+        dic['missing'] = self.missing
         return dic
 
 
@@ -265,6 +356,59 @@ protocols = {
 }
 
 
+def digest(name):
+    """Return 8-byte digest of peer `name`, see `heartbeat`"""
+    return hashlib.sha1(name.encode('utf-8')).digest()[:8]
+
+
+def heartbeat(name):
+    """Return heartbeat record of peer `name`
+     _________ _______________
+    |         |               |
+    | version | digest (8 B)  |
+    |_________|_______________|
+
+    Heartbeats carry nothing but the digest of the name of their
+    sender, 9 bytes whatever the name, and are sent on a channel of
+    their own, bypassing envelopes. Receivers learn digests of the
+    peers they route for, see `from_heartbeat`.
+
+    """
+
+    return HEARTBEAT + digest(name)
+
+
+def from_heartbeat(record, names):
+    """Return name of peer from heartbeat `record`, None if unknown
+
+    Arguments:
+        record (str): Heartbeat record, see `heartbeat`
+        names (dict): Names of known peers, by digest
+
+    """
+
+    version = record[:1]
+
+    if version == HEARTBEAT:
+        return names.get(record[1:])
+
+    if version == HEARTBEAT_NAMED:
+        return record[1:].decode('utf-8')
+
+    raise ValueError("Unknown heartbeat version: %r" % version)
+
+
+def topic(recipient):
+    """Return PUB/SUB topic of envelopes addressed to `recipient`
+
+    Topics are terminated, such that the subscription of
+    e.g. "mark" does not match "markus" by prefix.
+
+    """
+
+    return (u'peer:%s\x00' % recipient).encode('utf-8')
+
+
 def by_name(name):
     try:
         return protocols[name.lower()]
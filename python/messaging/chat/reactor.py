@@ -0,0 +1,133 @@
+"""Single-threaded event loop over sockets, timers and coroutines
+
+Sockets are polled alongside a queue of timers, such that one
+thread may serve what would otherwise take one thread each.
+Coroutines are generators yielding the seconds to wait until
+they are resumed, see `chat.lib.run`.
+     _________
+    |         |---> socket ready ---> callback
+    |  poll   |
+    |_________|---> timer due -----> callback
+         ^                             |
+         '-----------------------------'
+
+Usage:
+    >>> reactor = Reactor()
+    >>> reactor.register(socket, on_message)
+    >>> reactor.call_later(1, on_timeout)
+    >>> reactor.run()
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import sys
+import time
+import heapq
+import itertools
+import traceback
+
+# dependencies
+import zmq
+
+__all__ = [
+    'Reactor',
+]
+
+
+class Reactor(object):
+    """Dispatch ready sockets and due timers from a single thread
+
+    Not thread-safe; sockets, timers and coroutines are added
+    from within callbacks or prior to `run`.
+
+    """
+
+    def __init__(self):
+        self.poller = zmq.Poller()
+        self.callbacks = dict()  # (callback, args), per socket
+
+        self._timers = list()  # (deadline, sequence, callback, args)
+        self._sequence = itertools.count()
+        self._running = False
+
+    def register(self, socket, callback, *args):
+        """Call `callback` with `args` whenever `socket` is readable"""
+        self.callbacks[socket] = (callback, args)
+        self.poller.register(socket, zmq.POLLIN)
+
+    def unregister(self, socket):
+        self.callbacks.pop(socket, None)
+        self.poller.unregister(socket)
+
+    def call_later(self, delay, callback, *args):
+        """Call `callback` with `args` in `delay` seconds"""
+        heapq.heappush(self._timers, (time.time() + delay,
+                                      next(self._sequence),
+                                      callback,
+                                      args))
+
+    def call_soon(self, callback, *args):
+        self.call_later(0, callback, *args)
+
+    def call_every(self, interval, callback, *args):
+        """Call `callback` every `interval` seconds"""
+        def repeat():
+            callback(*args)
+            self.call_later(interval, repeat)
+
+        self.call_later(interval, repeat)
+
+    def spawn(self, coroutine):
+        """Run generator `coroutine`, resuming it as it asks"""
+        self.call_soon(self._step, coroutine)
+
+    def stop(self):
+        self._running = False
+
+    def run(self):
+        """Poll and dispatch until stopped"""
+        self._running = True
+
+        while self._running:
+            for socket in self.poll(self.timeout()):
+                callback, args = self.callbacks[socket]
+                self._call(callback, *args)
+
+            now = time.time()
+            while self._timers and self._timers[0][0] <= now:
+                deadline, sequence, callback, args = \
+                    heapq.heappop(self._timers)
+                self._call(callback, *args)
+
+    def poll(self, timeout=None):
+        """Return sockets ready within `timeout` milliseconds"""
+        return [socket for socket, event in self.poller.poll(timeout)
+                if socket in self.callbacks]
+
+    def timeout(self):
+        """Return milliseconds until the next timer is due, or None"""
+        if not self._timers:
+            return None
+
+        return max(0, int((self._timers[0][0] - time.time()) * 1000))
+
+    def _step(self, coroutine):
+        try:
+            delay = next(coroutine)
+        except StopIteration:
+            return
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+            return
+
+        self.call_later(delay or 0, self._step, coroutine)
+
+    def _call(self, callback, *args):
+        # A failing callback must not take down the loop,
+        # and everything else served by it.
+        try:
+            callback(*args)
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
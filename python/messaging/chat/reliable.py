@@ -0,0 +1,304 @@
+"""Letters delivered to the swarm once and in order, if asked for
+
+Letters are otherwise sent fire-and-forget, such that one lost on
+its way, e.g. while the swarm restarts, is gone. In reliable mode,
+each letter is numbered by its author and kept until acknowledged.
+     ___________ ________ ______
+    |           |        |      |
+    |  session  | number | base |   <-- `Envelope.window`
+    |___________|________|______|
+
+`number` increases with each letter of a session, i.e. lifetime of
+a peer, and `base` is the oldest number not yet acknowledged. Up to
+`size` letters are in flight at once, such that throughput does not
+wait on a round trip per letter. Letters not acknowledged within a
+timeout, estimated from round trips as TCP does, are sent again.
+
+The swarm acknowledges the last number received in order, for all
+those before it at once, once half of those in flight have arrived
+or on its next tick, whichever is first. Those in flight are known
+from `number` and `base`, such that letters trickling in are each
+acknowledged at once. Letters arriving ahead of one missing are
+held, and the gap acknowledged at once, such that the missing
+letter is sent again without waiting for its timeout.
+                                  ________
+     ________   0 1 2 . 4 5      |        |
+    |        |------------------>| swarm  |  holds 4, 5
+    |  peer  |   ack 2, gap      |        |
+    |        |<------------------|        |
+    |        |   3               |        |
+    |        |------------------>|        |  delivers 3, 4, 5
+    |________|   ack 5           |________|
+              <------------------
+
+Letters in flight when the swarm restarts are sent again, and may
+arrive twice if stored but not yet acknowledged. Otherwise, each is
+delivered exactly once.
+
+Usage:
+    >>> window = Window(size=64, timeout=1.0)
+    >>> inbox = Inbox(size=64)
+    >>> for envelope in window.send(letter):
+    ...     letters, ack = inbox.receive(envelope)
+    >>> window.ack(*ack)
+    []
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import copy
+import time
+import random
+import threading
+import collections
+
+__all__ = [
+    'Window',
+    'Inbox',
+]
+
+
+class Window(object):
+    """Letters sent and not yet acknowledged, by number
+
+    Arguments:
+        size (int): Letters in flight at once, those sent beyond
+            are queued until acknowledgements make room
+        timeout (float): Most seconds until a letter not
+            acknowledged is sent again, and the first estimate;
+            estimates follow from round trips, see `rto`
+        minimum (float): Least seconds until a letter is sent again
+        session (int): Id of this sender, random by default
+
+    Each method returns envelopes to send, numbered; copies of
+    those kept, such that a letter sent again by one thread is
+    never renumbered while encoded by another. Thread-safe.
+
+    """
+
+    def __init__(self, size=64, timeout=1.0, minimum=0.01, session=None):
+        self.size = size
+        self.timeout = timeout
+        self.minimum = minimum
+        self.session = session or random.getrandbits(31)
+
+        # Seconds until sent again, from smoothed round trips
+        self.rto = timeout
+        self.srtt = None
+        self.rttvar = None
+
+        self.next = 0  # Number of the next letter
+        self.base = 0  # Oldest number not acknowledged
+
+        self._pending = collections.OrderedDict()  # [letter, sent, resent]
+        self._queued = collections.deque()
+        self._lock = threading.Lock()
+
+        self.stats = collections.Counter()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def send(self, envelope, now=None):
+        """Number `envelope`, or queue it if the window is full"""
+        now = time.time() if now is None else now
+
+        with self._lock:
+            if len(self._pending) >= self.size:
+                self._queued.append(envelope)
+                self.stats['queued'] += 1
+                return []
+
+            return [self._open(envelope, now)]
+
+    def ack(self, number, gap=False, now=None):
+        """Release letters up to `number`, sending those now due
+
+        Arguments:
+            number (int): Last number received in order
+            gap (bool): Whether letters after `number` arrived
+                first, such that the next is sent again at once
+
+        """
+
+        now = time.time() if now is None else now
+        due = list()
+
+        with self._lock:
+            while self._pending and next(iter(self._pending)) <= number:
+                first, (letter, sent, resent) = self._pending.popitem(
+                    last=False)
+                self.stats['acked'] += 1
+
+                # Only those sent once tell the round trip, as Karn's
+                if first == number and not resent:
+                    self._sample(now - sent)
+
+            self.base = next(iter(self._pending), self.next)
+
+            if gap and number + 1 in self._pending:
+                due.append(self._resend(number + 1, now))
+                self.stats['fast'] += 1
+
+            while self._queued and len(self._pending) < self.size:
+                due.append(self._open(self._queued.popleft(), now))
+
+        return due
+
+    def due(self, now=None):
+        """Return the oldest letter, if not acknowledged in time
+
+        Only the oldest is sent again, those after it likely held
+        by the swarm; once acknowledged, any other missing is sent
+        again on the gap that follows, see `ack`. Timers of the
+        others start over, as with the one timer of TCP.
+
+        """
+
+        now = time.time() if now is None else now
+
+        with self._lock:
+            if not self._pending:
+                return []
+
+            oldest = next(iter(self._pending))
+            if now - self._pending[oldest][1] < self.rto:
+                return []
+
+            for entry in self._pending.itervalues():
+                entry[1] = now
+
+            # Backing off, lest a slow swarm be flooded
+            self.rto = min(self.timeout, self.rto * 2)
+
+            return [self._resend(oldest, now)]
+
+    def _open(self, envelope, now):
+        number = self.next
+        self.next += 1
+
+        self._pending[number] = [envelope, now, False]
+        self.stats['sent'] += 1
+
+        return self._stamped(number)
+
+    def _resend(self, number, now):
+        entry = self._pending[number]
+        entry[1] = now
+        entry[2] = True
+
+        self.stats['retransmitted'] += 1
+
+        return self._stamped(number)
+
+    def _stamped(self, number):
+        envelope = copy.copy(self._pending[number][0])
+        envelope.window = [self.session, number, self.base]
+        return envelope
+
+    def _sample(self, rtt):
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+        self.rto = min(self.timeout,
+                       max(self.minimum, self.srtt + 4 * self.rttvar))
+
+
+class _Author(object):
+    """Letters received of one session of an author"""
+
+    def __init__(self, session, expected):
+        self.session = session
+        self.expected = expected  # Next number delivered
+        self.held = dict()  # Letters ahead of `expected`, by number
+        self.unacked = 0  # Letters delivered since acknowledged
+        self.gap = None  # Number last acknowledged as a gap
+
+
+class Inbox(object):
+    """Letters received in reliable mode, in order, per author
+
+    Arguments:
+        size (int): Letters held ahead of one missing, per author
+
+    Returns of `receive` are letters now delivered, in order, and
+    an acknowledgement to send at once, if any. Thread-safe.
+
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+
+        self._authors = dict()  # _Author, by name
+        self._lock = threading.Lock()
+
+        self.stats = collections.Counter()
+
+    def receive(self, envelope):
+        """Return letters delivered by `envelope`, and (number, gap)"""
+        session, number, base = envelope.window
+        envelope.window = None  # Of no concern to recipients
+
+        with self._lock:
+            author = self._authors.get(envelope.author)
+
+            # Restarted, or never seen; those before `base` are
+            # acknowledged, if not by this swarm
+            if author is None or author.session != session:
+                author = _Author(session, expected=base)
+                self._authors[envelope.author] = author
+                self.stats['sessions'] += 1
+
+            if number < author.expected:
+                self.stats['duplicates'] += 1
+                return [], (author.expected - 1, False)
+
+            if number > author.expected:
+                if len(author.held) < self.size:
+                    author.held[number] = envelope
+                self.stats['held'] += 1
+
+                # Once per gap, retransmits may arrive out of order
+                if author.gap == author.expected:
+                    return [], None
+
+                author.gap = author.expected
+                return [], (author.expected - 1, True)
+
+            letters = [envelope]
+            author.expected += 1
+
+            while author.expected in author.held:
+                letters.append(author.held.pop(author.expected))
+                author.expected += 1
+
+            author.unacked += len(letters)
+            self.stats['delivered'] += len(letters)
+
+            if author.unacked * 2 < number - base + 1:
+                return letters, None
+
+            author.unacked = 0
+            return letters, (author.expected - 1, False)
+
+    def flush(self):
+        """Return (author, number) of acknowledgements due"""
+        acks = list()
+
+        with self._lock:
+            for name, author in self._authors.iteritems():
+                if author.unacked:
+                    author.unacked = 0
+                    acks.append((name, author.expected - 1))
+
+        return acks
+
+    def forget(self, name):
+        """Stop tracking author `name`, e.g. once gone"""
+        with self._lock:
+            self._authors.pop(name, None)
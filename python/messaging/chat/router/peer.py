@@ -5,6 +5,7 @@ import time
 
 # local library
 import chat.lib
+import chat.grammar
 import chat.protocol
 
 __all__ = [
@@ -20,29 +21,56 @@ __all__ = [
 
 class Factory(object):
     __metaclass__ = chat.lib.DynamicRegistry
+    abstract = True
 
-    def route(self, command, receiver, args):
+    # Routes declaring a grammar are passed their arguments
+    # parsed, by destination, see `chat.grammar`. Those taking
+    # free text are passed it as typed, others its tokens.
+    grammar = None
+    free_text = False
+
+    @classmethod
+    def route(cls, command, receiver, text):
         try:
-            processor = self.registry[command]()
-            processor.route(receiver, args)
+            processor = cls.lookup(command)
         except KeyError:
             raise ValueError("Unhandled route: %s" % command)
 
+        grammar = processor.grammar
+        if processor.free_text:
+            args = text
+        elif grammar is None:
+            args = chat.grammar.tokenize(text)
+        else:
+            try:
+                args = grammar.parse(chat.grammar.tokenize(text))
+            except SystemExit as e:
+                raise ValueError(e.message)
+            except ValueError as e:
+                raise ValueError("%s%s" % (grammar.format_usage(), e))
+
+        processor.route(receiver, args)
+
 
 class Say(Factory):
+    free_text = True
+
     def route(self, receiver, args):
-        instant_message = " ".join(args)
+        instant_message = args
         peers = list(receiver.peers)
         letter = chat.protocol.Envelope(payload=instant_message,
                                         type='letter',
-                                        recipients=peers,
-                                        trace=['Peer.route_command<say>'])
+                                        recipients=peers)
         receiver.send(letter)
 
 
 class Wait(Factory):
+    grammar = chat.grammar.compile('wait', [
+        chat.grammar.Argument('seconds', type=float),
+    ])
+
     def route(self, receiver, args):
-        time.sleep(args[0])
+        time.sleep(args['seconds'])
 
 
 class Invite(Factory):
@@ -53,8 +81,7 @@ class Invite(Factory):
         # Inform swarm that peer is listening
         invite = chat.protocol.Envelope(
             payload=peers,
-            type='invitation',
-            trace=['Peer.route_comamnd<invite>'])
+            type='invitation')
         receiver.send(invite)
 
 
@@ -84,14 +111,13 @@ class Order(Factory):
 
         envelope = chat.protocol.Envelope(
             payload=order,
-            type='orderPlacement',
-            trace=['Peer.route_command<order>'])
+            type='orderPlacement')
         receiver.send(envelope)
 
 
 class Peer(Factory):
     def route(self, receiver, args):
-        """Ask PEER for something
+        """Ask PEER, or comma-separated PEERS, for something
 
         PEER A
          _             SWARM
@@ -108,7 +134,7 @@ class Peer(Factory):
         """
 
         try:
-            peers = [args[0]]
+            peers = args[0].split(',')
             name = args[1]
             questioneer = receiver.name
             query = chat.protocol.Query(name=name,
@@ -117,8 +143,7 @@ class Peer(Factory):
 
             envelope = chat.protocol.Envelope(
                 payload=(peers, query.to_dict()),
-                type='peerQuery',
-                trace=['Peer.route_command<peer>'])
+                type='peerQuery')
             receiver.send(envelope)
 
         except IndexError:
@@ -145,11 +170,33 @@ class Peers(Factory):
 
 
 class State(Factory):
+    grammar = chat.grammar.compile('state', [
+        chat.grammar.Argument('peers', nargs='*'),
+        chat.grammar.Argument('--since', type=float),
+        chat.grammar.Argument('--all', const=True, default=False),
+    ])
+
     def route(self, receiver, args):
-        peers = args
+        """Request letters sent by `peers` since the last one seen
+
+        Usage:
+            > state
+            > state markus nikki
+            > state markus --since 60  # Last 60 seconds only
+            > state --all  # Including those already seen
+
+        """
+
+        query = {'authors': args['peers']}
+        if args['since'] is not None:
+            query['since'] = time.time() - args['since']
+
+        if not args['all']:
+            query['epoch'] = receiver.epoch
+            query['sequence'] = receiver.sequence
+
         state_request = chat.protocol.Envelope(
-            payload=peers,
-            type='stateQuery',
-            trace=['Peer.route_command<state>'])
+            payload=query,
+            type='stateQuery')
 
         receiver.send(state_request)
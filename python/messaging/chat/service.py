@@ -1,12 +1,9 @@
 from __future__ import absolute_import
 
-# standard library
-import time
-
 # local library
-import chat.lib
+import chat.orders
 
-orders = {}
+orders = chat.orders.OrderEngine()
 
 
 def add(x, y):
@@ -26,8 +23,16 @@ def order_coffee(order):
 
     """
 
-    time.sleep(0.2)  # Ordering coffee takes time.
+    validate_coffee(order)
+    orders.place(order, recipe=chat.orders.COFFEE)
+
+    print "Id: %s" % order.id
+
+    return order
+
 
+def validate_coffee(order):
+    """Raise ValueError on coffee we cannot make"""
     item = order.item
 
     types = ('cappucino', 'latte', 'frappe')
@@ -39,21 +44,6 @@ def order_coffee(order):
     if not item.size in sizes:
         raise ValueError("Sorry, we can't make the size '%s'" % item.size)
 
-    order_id = 0
-    while order_id in orders:
-        order_id += 1
-
-    orders[order_id] = order
-
-    order.status = 'ordered'
-    order.id = order_id
-
-    chat.lib.spawn(make_coffee, args=[order], name='order: %s' % order_id)
-
-    print "Id: %s" % order_id
-
-    return order
-
 
 def order_chocolate(order):
     """Order a chocolate
@@ -68,24 +58,7 @@ def order_chocolate(order):
 
     """
 
-    order_id = 0
-    while order_id in orders:
-        order_id += 1
-
-    orders[order_id] = order
-
-    order.status = 'served'  # Chocolate is self-serve
-    order.id = order_id
-
-    return order
-
-
-def make_coffee(order):
-    order.status = 'being prepared'
-    time.sleep(10)
-    order.status = 'in progress'
-    time.sleep(30)
-    order.status = 'served'
+    return orders.place(order, recipe=chat.orders.CHOCOLATE)
 
 
 services = {
@@ -0,0 +1,244 @@
+"""Bounded storage of letters, for peers joining late
+
+Letters are kept per author, in order of arrival, and evicted
+oldest-first once any of the configured limits are exceeded.
+     ________________________________________
+    |  markus  | 0 | 3 | 4 |   |   |   |   |
+    |  nikki   | 1 | 2 | 5 | 6 |   |   |   |
+    |__________|___|___|___|___|___|___|___|
+    |  arrival | 0 | 1 | 2 | 3 | 4 | 5 | 6 |  <-- evicted from the left
+    |__________|___|___|___|___|___|___|___|
+
+Usage:
+    >>> store = LetterStore(max_count=2)
+    >>> for i in range(1, 4):
+    ...     store.add(Envelope(author='markus', timestamp=i), size=10)
+    >>> [letter.timestamp for letter in store.range(['markus'])]
+    [2, 3]
+    >>> store.stats()['evicted_count']
+    1
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import time
+import random
+import threading
+import collections
+
+__all__ = [
+    'LetterStore',
+]
+
+# Position of each attribute in a stored record
+SEQUENCE, STORED, TIMESTAMP, SIZE, LETTER = range(5)
+
+
+class LetterStore(object):
+    """Letters per author, bounded by count, age and bytes
+
+    Arguments:
+        max_count (int): Letters kept per author
+        max_age (float): Seconds letters are kept
+        max_bytes (int): Total bytes kept across all authors
+
+    Each limit is optional; without limits, letters are
+    kept forever.
+
+    Letters are stamped with a `sequence`, increasing with each
+    letter stored, such that one may ask for those stored `after`
+    the last one seen. Sequences are only comparable within the
+    same `epoch`, which changes each time a store is created.
+
+    """
+
+    def __init__(self, max_count=None, max_age=None, max_bytes=None):
+        self.max_count = max_count
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+
+        self._authors = dict()  # Records, per author
+        self._arrival = collections.deque()  # (sequence, author)
+        self._sequence = 0
+        self._count = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._evicted = {'count': 0, 'age': 0, 'bytes': 0}
+
+        self.epoch = '%016x' % random.getrandbits(64)
+
+    def __contains__(self, author):
+        return author in self._authors
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Yield every letter, in order of arrival"""
+        with self._lock:
+            records = list()
+            for author_records in self._authors.itervalues():
+                records.extend(author_records)
+
+        records.sort(key=lambda record: record[SEQUENCE])
+        for record in records:
+            yield record[LETTER]
+
+    def add(self, letter, size=0):
+        """Store `letter`, evicting older letters where necessary
+
+        Arguments:
+            letter (chat.protocol.Envelope): Letter to store,
+                stamped with its `sequence`
+            size (int): Bytes occupied by `letter`
+
+        """
+
+        now = time.time()
+
+        with self._lock:
+            letter.sequence = self._sequence
+            author = letter.author
+            records = self._authors.setdefault(author,
+                                               collections.deque())
+
+            record = (self._sequence, now, letter.timestamp, size, letter)
+            records.append(record)
+            self._arrival.append((self._sequence, author))
+            self._sequence += 1
+            self._count += 1
+            self._bytes += size
+
+            if self.max_count is not None:
+                while len(records) > self.max_count:
+                    self._pop(author, 'count')
+
+            if self.max_bytes is not None:
+                while self._bytes > self.max_bytes and self._arrival:
+                    self._pop_oldest('bytes')
+
+            self._expire(now)
+
+            # Letters evicted per author linger in the arrival
+            # order until reaching its head; drop them in bulk.
+            if len(self._arrival) > 2 * self._count + 1024:
+                self._compact()
+
+    def expire(self):
+        """Evict letters older than `max_age`"""
+        with self._lock:
+            self._expire(time.time())
+
+    def range(self, authors=None, since=None, until=None, after=None):
+        """Return letters from `authors`, sorted by timestamp
+
+        Arguments:
+            authors (list): Authors of letters, None for all
+            since (float): Only include letters sent on or
+                after this timestamp
+            until (float): Only include letters sent before
+                this timestamp
+            after (int): Only include letters stored after
+                the one of this sequence
+
+        """
+
+        letters = list()
+
+        with self._lock:
+            if authors is None:
+                authors = self._authors.keys()
+
+            for author in set(authors):
+                records = self._authors.get(author)
+                if not records:
+                    continue
+
+                # Walk from the most recent, as windows are
+                # typically small compared to what is kept.
+                for record in reversed(records):
+                    timestamp = record[TIMESTAMP]
+
+                    if after is not None and record[SEQUENCE] <= after:
+                        break
+
+                    if since is not None and timestamp < since:
+                        break
+
+                    if until is not None and timestamp >= until:
+                        continue
+
+                    letters.append(record)
+
+        letters.sort(key=lambda record: record[TIMESTAMP])
+        return [record[LETTER] for record in letters]
+
+    def discard(self, author):
+        """Forget all letters from `author`"""
+        with self._lock:
+            records = self._authors.pop(author, None) or []
+            for record in records:
+                self._bytes -= record[SIZE]
+            self._count -= len(records)
+
+    def stats(self):
+        """Return current size and number of evictions, per limit"""
+        with self._lock:
+            return {
+                'authors': len(self._authors),
+                'letters': self._count,
+                'bytes': self._bytes,
+                'evicted_count': self._evicted['count'],
+                'evicted_age': self._evicted['age'],
+                'evicted_bytes': self._evicted['bytes'],
+            }
+
+    def _expire(self, now):
+        if self.max_age is None:
+            return
+
+        deadline = now - self.max_age
+        while self._arrival:
+            sequence, author = self._arrival[0]
+            records = self._authors.get(author)
+
+            # Already evicted by another limit
+            if not records or records[0][SEQUENCE] != sequence:
+                self._arrival.popleft()
+                continue
+
+            if records[0][STORED] >= deadline:
+                break
+
+            self._pop_oldest('age')
+
+    def _pop_oldest(self, reason):
+        """Evict the oldest letter across all authors"""
+        while self._arrival:
+            sequence, author = self._arrival.popleft()
+            records = self._authors.get(author)
+
+            if records and records[0][SEQUENCE] == sequence:
+                self._pop(author, reason)
+                return
+
+    def _compact(self):
+        arrival = list()
+        for author, records in self._authors.iteritems():
+            arrival.extend((record[SEQUENCE], author) for record in records)
+
+        arrival.sort()
+        self._arrival = collections.deque(arrival)
+
+    def _pop(self, author, reason):
+        records = self._authors[author]
+        record = records.popleft()
+        self._bytes -= record[SIZE]
+        self._count -= 1
+        self._evicted[reason] += 1
+
+        if not records:
+            self._authors.pop(author)
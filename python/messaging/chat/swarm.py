@@ -1,108 +1,985 @@
 from __future__ import absolute_import
 
 # standard library
+import sys
 import time
-import json
+import Queue
+import threading
+import traceback
 
 # local library
 import chat.lib
+import chat.logs
+import chat.metrics
+import chat.batch
+import chat.cache
+import chat.codec
+import chat.compression
+import chat.dispatch
+import chat.gather
+import chat.reliable
+import chat.store
+import chat.expiry
+import chat.journal
+import chat.orders
+import chat.reactor
+import chat.tracing
+import chat.flow
+import chat.federation
+import chat.service
 import chat.protocol
 import chat.mediator.swarm
 
 # vendor dependency
 import zmq
 
-context = zmq.Context()
+context = zmq.Context.instance()  # Shared, such that inproc reaches across
 
 
 class Swarm(object):
-    letters = dict()  # Keep track of all letters sent, per peer
     peers = set()  # Keep track of all peers
     orders = dict()  # Keep track of all orders
-    heartbeats = dict()  # Keep your ear close to the peer's chests
 
     KEEP_ALIVE = 4  # seconds before peers are considered dead
+    SNAPSHOT_INTERVAL = 60  # seconds between compactions of journal
+    STRIPES = 64  # locks guarding registration of peers, see `lock`
+
+    FANIN_LOG = '\x00log'  # Marks encoded logs sent through fan-in
+    FANIN_SUSPEND = '\x00suspend'  # Marks peers suspended, see `flow`
+
+    def __init__(self,
+                 codec='binary',
+                 retention=None,
+                 journal=None,
+                 logging=None,
+                 workers=0,
+                 engine='threads',
+                 address='localhost:5555',
+                 nodes=None,
+                 batch=None,
+                 ttls=None,
+                 dispatch=None,
+                 trace_sample=0.0,
+                 metrics=None,
+                 hwms=None,
+                 flow=None,
+                 compress=None):
+        """
+        Arguments:
+            codec (str): Name of codec used to encode outgoing
+                messages; incoming messages are decoded using
+                whichever codec they were encoded with.
+            retention (dict): Limits of letters kept for peers
+                joining late; `max_count` per author, `max_age`
+                in seconds and `max_bytes` in total.
+            journal (str): Absolute path to directory in which to
+                persist letters, peers and orders across restarts.
+            logging (dict): Arguments to chat.logs.LogPipeline,
+                such as `level` and `sampling`
+            workers (int): Threads routing messages in parallel,
+                sharded by author such that messages from any
+                one author are routed in order. 0 routes each
+                message in the listening thread.
+            engine (str): 'threads' listens for messages, heartbeats
+                and expiry in a thread each, 'reactor' serves them
+                all from a single thread, see `chat.reactor`.
+            address (str): Host and first of four consecutive ports
+                at which peers and other nodes reach this swarm,
+                see `chat.federation`.
+            nodes (list): Addresses of other swarms with which to
+                share peers; None runs this swarm on its own.
+            batch (dict): Arguments to chat.batch.Batch, such as
+                `size` and `interval`, coalescing envelopes published
+                on the same topic; None publishes each on its own.
+            ttls (dict): Seconds results of queries are answered from
+                memory, per query name, see `chat.cache`.
+            dispatch (str): Strategy by which to hand coffee orders
+                to workers, see `chat.dispatch`; None makes each
+                order here.
+            trace_sample (float): Fraction of envelopes received
+                untraced whose hops are traced, see `chat.tracing`.
+            metrics (dict): Arguments to chat.metrics.Registry, such
+                as `interval` and `port`; None keeps no metrics.
+            hwms (dict): Messages queued per socket before ZeroMQ
+                blocks or drops, by 'pub', 'pull' and 'push', see
+                `chat.flow.HWMS`.
+            flow (dict): Arguments to chat.flow.FlowControl, such
+                as `policy` and `lag`, dealing with peers too slow
+                to keep up.
+            compress (dict): Arguments to chat.compression.Compressed,
+                such as `threshold` and `dictionary`, compressing
+                large frames; None sends each as encoded.
+
+        """
+
+        if engine not in ('threads', 'reactor'):
+            raise ValueError("Unknown engine: %s" % engine)
+
+        # Keep track of all letters sent, per peer
+        self.letters = chat.store.LetterStore(**(retention or {}))
+
+        # Keep your ear close to the peer's chests
+        self.heartbeats = chat.expiry.Expiry(timeout=self.KEEP_ALIVE)
+
+        # Peers by digest of their name and back, see `learn`
+        self.names = dict()
+        self.digests = dict()
+
+        # Queries scattered to peers, awaiting their answers
+        self.queries = chat.gather.Gatherer()
+
+        # Recent answers, such that queries polled are answered locally
+        self.cache = chat.cache.ResultCache(ttls=ttls)
+
+        # Serials of messages published, and peers missing some
+        self.sequencer = chat.flow.Sequencer()
+        self.flow = chat.flow.FlowControl(**(flow or {}))
+        self.hwms = dict(chat.flow.HWMS, **(hwms or {}))
+
+        # Letters sent reliably, delivered in order of their author
+        self.inbox = chat.reliable.Inbox()
+
+        # Traces of envelopes, published as logs once routed
+        self.sampler = chat.tracing.Sampler(rate=trace_sample)
+
+        # Workers making orders, by their load
+        self.dispatcher = None
+        if dispatch is not None:
+            self.dispatcher = chat.dispatch.Dispatcher(strategy=dispatch)
+
+        # Emitted with the name of each peer considered dead
+        self.peer_left = chat.lib.Signal()
+        self.peer_left.connect(self.on_peer_left)
+
+        self.address = address
+        self.endpoints = chat.federation.endpoints(address, bind=True)
 
-    def __init__(self):
         pull = context.socket(zmq.PULL)  # Incoming messages
-        pull.bind("tcp://*:5555")
+        pull.setsockopt(zmq.RCVHWM, self.hwms['pull'])
+        pull.bind(self.endpoints['pull'])
+
+        # Distributing messages, and tracking who listens
+        pub = context.socket(zmq.XPUB)
+        pub.setsockopt(zmq.SNDHWM, self.hwms['pub'])
+        pub.bind(self.endpoints['pub'])
+
+        pulse = context.socket(zmq.PULL)  # Incoming heartbeats
+        pulse.bind(self.endpoints['pulse'])
 
-        pub = context.socket(zmq.PUB)  # Distributing messages
-        pub.bind("tcp://*:5556")
+        # Letters, peers and nodes from other swarms
+        self.federation = None
+        self.relay = None
+
+        if nodes is not None:
+            self.federation = chat.federation.Federation(context,
+                                                         address,
+                                                         nodes)
+            self.relay = context.socket(zmq.PULL)
+            self.relay.bind(self.endpoints['relay'])
+
+        # Outgoing messages from threads other than the listener,
+        # forwarded to `pub` as it may only be used by one thread.
+        fanin = context.socket(zmq.PULL)
+        fanin.bind("inproc://swarm-fanin-%i" % id(self))
 
         self.pull = pull
         self.pub = pub
+        self.pulse = pulse
+        self.fanin = fanin
+        self.locks = [threading.Lock() for i in range(self.STRIPES)]
+        self.queues = [Queue.Queue() for i in range(workers)]
+
+        self._listener = None  # Thread owning `pub`
+        self.engine = engine
+        self.reactor = None
+        self._local = threading.local()  # Fan-in socket, per thread
+        self.codec = chat.codec.by_name(codec)
+        if compress is not None:
+            self.codec = chat.compression.Compressed(self.codec, **compress)
+        self.journal = None
+
+        self.logs = chat.logs.LogPipeline(send=self.emit,
+                                          codec=self.codec,
+                                          **(logging or {}))
+
+        # Only ever flushed by the listener, which owns `pub`
+        self.batch = None
+        if batch is not None:
+            self.batch = chat.batch.Batch(send=self.emit,
+                                          **batch)
+
+        if journal:
+            self.journal = chat.journal.Journal(journal)
+
+            chat.journal.restore(self.journal.replay(),
+                                 letters=self.letters,
+                                 peers=self.peers,
+                                 orders=chat.service.orders)
+
+            for peer in self.peers:
+                self.learn(peer)
+
+            # Each change in status is journaled, such that orders
+            # are restored as they were last, and carry on from there
+            chat.service.orders.changed.connect(self.persist)
+            self.resume()
+
+            print "Restored %i letters from %s" % (len(self.letters),
+                                                   journal)
+
+        self.metrics = chat.metrics.Registry(enabled=metrics is not None,
+                                             **(metrics or {}))
+        self.instrument()
+
+        self.start()
+
+    def instrument(self):
+        """Register metrics of the swarm, see `chat.metrics`"""
+        metrics = self.metrics
+
+        self.received = metrics.counter('envelopes.received')
+        self.published = metrics.counter('envelopes.published')
+        self.relayed = metrics.counter('envelopes.relayed')
+        self.beats = metrics.counter('heartbeats')
+        self.errors = metrics.counter('mediator.errors')
+
+        metrics.gauge('peers', func=lambda: len(self.peers))
+        metrics.gauge('peers.alive', func=lambda: len(self.heartbeats))
+        metrics.gauge('queue.depth',
+                      func=lambda: sum(queue.qsize()
+                                       for queue in self.queues))
+        metrics.gauge('queries.pending', func=lambda: len(self.queries))
+        metrics.gauge('cache.entries', func=lambda: len(self.cache))
+
+        metrics.source('letters', self.letters.stats)
+        metrics.source('orders', lambda: dict(chat.service.orders.stats))
+        metrics.source('orders.in_flight', chat.service.orders.counts)
+        metrics.source('queries', lambda: dict(self.queries.stats))
+        metrics.source('cache', lambda: dict(self.cache.stats))
+        metrics.source('logs', lambda: dict(self.logs.stats))
+        metrics.source('flow', lambda: dict(self.flow.stats))
+        metrics.source('reliable', lambda: dict(self.inbox.stats))
+        if isinstance(self.codec, chat.compression.Compressed):
+            metrics.source('compression', lambda: dict(self.codec.stats))
+
+        metrics.gauge('flow.lag.max',
+                      func=lambda: max(self.flow.lags().values() or [0]))
+
+        if self.dispatcher is not None:
+            metrics.gauge('dispatch.backlog',
+                          func=lambda: self.dispatcher.backlog)
+            metrics.source('dispatch', lambda: dict(self.dispatcher.stats))
+
+    def start(self):
+        """Start listening, in threads of their own"""
+
+        # Disk and workers block, and are kept off the reactor
+        if self.journal is not None:
+            chat.lib.spawn(self.compact, name='compact')
+
+        for index, queue in enumerate(self.queues):
+            chat.lib.spawn(self.work,
+                           args=[queue],
+                           name='worker: %i' % index)
+
+        if self.engine == 'reactor':
+            chat.lib.spawn(self.react, name='reactor')
+
+            if self.federation is not None:
+                self.federation.announce()
+
+            return
 
         chat.lib.spawn(self.listen, name='listen')
+        chat.lib.spawn(self.auscultate, name='auscultate')
         chat.lib.spawn(self.keepalive, name='keepalive')
 
+        if self.federation is not None:
+            self.federation.announce()
+
     def listen(self):
         """
              ________    ___________
             |        |  |           |   /
         --->|  Pull  |--|  Publish  |---|-o
             |________|  |___________|   \
+                 |            ^
+                 |   _____    |
+                 '->|_____|---'  workers (optional)
+                    |_____|
+                    |_____|
 
         """
 
-        print "Listening for messages @ %s" % "tcp://*:5555"
-        print "Broadcasting messages @ %s" % "tcp://*:5556"
+        print "Listening for messages @ %s" % self.endpoints['pull']
+        print "Broadcasting messages @ %s" % self.endpoints['pub']
+
+        self._listener = threading.current_thread()
+
+        poller = zmq.Poller()
+        poller.register(self.pull, zmq.POLLIN)
+        poller.register(self.pub, zmq.POLLIN)  # Subscriptions
+        poller.register(self.fanin, zmq.POLLIN)
+
+        if self.relay is not None:
+            print "Relaying messages @ %s" % self.endpoints['relay']
+            poller.register(self.relay, zmq.POLLIN)
+
+        handlers = [(self.pub, self.on_subscription),
+                    (self.fanin, self.on_fanin),
+                    (self.pull, self.on_message),
+                    (self.relay, self.on_relay)]
 
         while True:
-            message = self.pull.recv_json()
-            envelope = chat.protocol.Envelope.from_dict(message)
-            self.router(envelope)
+            events = dict(poller.poll(self.timeout()))
+
+            for socket, handler in handlers:
+                if socket in events:
+                    self._call(handler)
+
+            self.logs.flush(force=False)
+
+            if self.batch is not None:
+                self.batch.flush(force=False)
+
+    def _call(self, handler, *args):
+        # A frame failing to be handled must not take down the
+        # listener, and all routing along with it.
+        try:
+            handler(*args)
+        except Exception:
+            self.errors.inc()
+            sys.stderr.write(traceback.format_exc())
+
+    def timeout(self):
+        """Return milliseconds until pending logs or envelopes are due"""
+        timeouts = [self.logs.timeout()]
+
+        if self.batch is not None:
+            timeouts.append(self.batch.timeout())
+
+        timeouts = [timeout for timeout in timeouts if timeout is not None]
+        return min(timeouts) if timeouts else None
+
+    def react(self):
+        """Listen for messages, heartbeats and expiry in one thread
+
+        Equivalent to `listen`, `auscultate` and `keepalive`,
+        with each handler called as its socket becomes ready or
+        its time is up, rather than from a thread of its own.
+
+        """
+
+        print "Listening for messages @ %s" % self.endpoints['pull']
+        print "Broadcasting messages @ %s" % self.endpoints['pub']
+        print "Listening for heartbeats @ %s" % self.endpoints['pulse']
+
+        self._listener = threading.current_thread()
+
+        reactor = chat.reactor.Reactor()
+        reactor.register(self.pull, self.on_message)
+        reactor.register(self.pub, self.on_subscription)
+        reactor.register(self.fanin, self.on_fanin)
+        reactor.register(self.pulse, self.on_heartbeat, zmq.NOBLOCK)
+
+        if self.relay is not None:
+            print "Relaying messages @ %s" % self.endpoints['relay']
+            reactor.register(self.relay, self.on_relay)
+
+        reactor.call_every(self.heartbeats.resolution, self.reap)
+        reactor.call_every(self.logs.interval, self.logs.flush, False)
+
+        if self.batch is not None:
+            reactor.call_every(self.batch.interval, self.batch.flush, False)
+
+        self.reactor = reactor
+        reactor.run()
+
+    def on_subscription(self):
+        message = self.pub.recv()
+        self.logs.subscription(message)
+        self.metrics.subscription(message)
+
+    def on_fanin(self):
+        frames = self.fanin.recv_multipart()
+
+        if frames[0] == self.FANIN_LOG:
+            self.logs.append(frames[1])
+        elif frames[0] == self.FANIN_SUSPEND:
+            self.suspend(frames[1].decode('utf-8'))
+        else:
+            self.send(frames)
+
+    def on_message(self):
+        """Dispatch each envelope of an incoming message
+
+        Peers may send many envelopes at once, see `chat.batch`.
+
+        """
+
+        for message in self.pull.recv_multipart():
+            self._call(self.receive, message)
+
+    def receive(self, message):
+        """Dispatch envelope of `message`, a frame from a peer"""
+        envelope = chat.codec.loads(message)
+        envelope.size = len(message)
+        self.dispatch(envelope)
+
+    def on_relay(self):
+        """Handle record relayed from another swarm
+
+        Envelopes are published to recipients owned here and never
+        relayed onwards, such that each hop is taken at most once.
+
+        """
+
+        kind, data = self.relay.recv_multipart()
+
+        if kind == chat.journal.PEER:
+            self.register(data.decode('utf-8'), relay=False)
+
+        elif kind == chat.federation.NODE:
+            self.rebalance(data.decode('utf-8'))
+
+        elif kind in (chat.journal.LETTER, chat.federation.HANDOFF):
+            envelope = chat.codec.loads(data)
+            envelope.size = len(data)
+
+            if envelope.type == 'letter':
+                self.letters.add(envelope, size=len(data))
+                self.persist(envelope)
+
+                # Stamped with the sequence of this swarm
+                data = self.codec.dumps(envelope)
+
+            if kind == chat.journal.LETTER:
+                local, remote = self.federation.partition(
+                    envelope.recipients)
+
+                for recipient in local:
+                    self.send([chat.protocol.topic(recipient), data])
+
+        elif kind == chat.federation.ROUTE:
+            envelope = chat.codec.loads(data)
+            envelope.size = len(data)
+            self.dispatch(envelope)
+
+    def register(self, peer, relay=True):
+        """Add `peer` to those known, return whether it was new
+
+        Arguments:
+            peer (str): Name of peer
+            relay (bool): Let other swarms know of `peer`, if new
+
+        """
+
+        self.learn(peer)
+
+        with self.lock(peer):
+            if peer in self.peers:
+                return False
+
+            self.peers.add(peer)
+            self.persist(peer)
+
+        if relay and self.federation is not None:
+            self.federation.broadcast(chat.journal.PEER,
+                                      peer.encode('utf-8'))
+
+        return True
+
+    def rebalance(self, node):
+        """Take `node` into the federation
+
+        Peers now owned by `node` are let known through an envelope
+        of type 'nodes' and the letters addressed to them handed
+        off, such that they may catch up from their new owner.
+
+        """
+
+        if not self.federation.join(node):
+            return
+
+        print "%s joined, sharing peers among %s" % (
+            node, self.federation.nodes)
+
+        # Introduce ourselves in return, along with who we know
+        self.federation.relay(node,
+                              chat.federation.NODE,
+                              self.address.encode('utf-8'))
+
+        for peer in list(self.peers):
+            self.federation.relay(node,
+                                  chat.journal.PEER,
+                                  peer.encode('utf-8'))
+
+        for letter in self.letters:
+            local, remote = self.federation.partition(letter.recipients)
+
+            if node in remote:
+                self.federation.relay(node,
+                                      chat.federation.HANDOFF,
+                                      self.codec.dumps(letter))
+
+        envelope = chat.protocol.Envelope(author=self.address,
+                                          payload=self.federation.nodes,
+                                          recipients=[],
+                                          type='nodes')
+        self.publish(envelope)
+
+    def dispatch(self, envelope):
+        """Route `envelope` here, or in the worker of its author"""
+        self.sampler.start(envelope, 'swarm.receive')
+        self.received.inc()
+
+        if envelope.author not in self.digests:
+            self.learn(envelope.author)
+
+        if not self.queues:
+            return self.router(envelope)
+
+        shard = hash(envelope.author) % len(self.queues)
+        self.queues[shard].put(envelope)
+
+    def work(self, queue):
+        """Route envelopes of the authors assigned to `queue`"""
+        while True:
+            self._call(self.router, queue.get())
+
+    def lock(self, key):
+        """Return lock guarding registration of peer `key`, see `register`
+
+        Workers route each author from a single thread, such that
+        state of an author is never touched concurrently; peers are
+        however registered by whichever worker first routes them.
+
+        Locks are striped; unrelated keys may share a lock, but
+        a key is always guarded by the same one.
+
+        """
+
+        return self.locks[hash(key) % len(self.locks)]
+
+    def learn(self, peer):
+        """Remember the digest of `peer`, by which it beats
+
+        Heartbeats only carry the digest of their sender, see
+        `chat.protocol.heartbeat`; those of peers yet to be
+        routed for or registered are ignored.
+
+        """
+
+        if peer is None:
+            return
+
+        digest = chat.protocol.digest(peer)
+        self.names[digest] = peer
+        self.digests[peer] = digest
+
+    def auscultate(self):
+        """Listen for heartbeats
+
+        Heartbeats arrive on a channel of their own and are
+        never routed, mediated nor logged.
+
+        """
+
+        print "Listening for heartbeats @ %s" % self.endpoints['pulse']
+
+        while True:
+            self.on_heartbeat()
+
+    def on_heartbeat(self, flags=0):
+        """Refresh peers of incoming heartbeats
+
+        Arguments:
+            flags (int): Passed to `recv`; with zmq.NOBLOCK, every
+                heartbeat queued is handled, or none if empty.
+
+        """
+
+        recv = self.pulse.recv
+        refresh = self.heartbeats.refresh
+        from_heartbeat = chat.protocol.from_heartbeat
+        names = self.names
+
+        while True:
+            try:
+                record = recv(flags)
+            except zmq.Again:
+                return
+
+            try:
+                peer = from_heartbeat(record, names)
+            except ValueError as e:
+                print e
+            else:
+                if peer is not None:
+                    refresh(peer)
+                    self.beats.inc()
+
+            if not flags & zmq.NOBLOCK:
+                return
 
     def keepalive(self):
-        """Scan `self.heartbeats` for dead connections"""
+        """Reap peers whose heartbeat has expired
+
+        If peer is unresponsive for over self.KEEP_ALIVE
+        seconds, consider him disconnected and let
+        subscribers of `peer_left` know.
+
+        """
+
         while True:
-            time.sleep(self.KEEP_ALIVE)
+            time.sleep(self.heartbeats.resolution)
+            self.reap()
+
+    def reap(self):
+        for peer in self.heartbeats.expire():
+            self.peer_left.emit(peer)
+
+        self.letters.expire()
+
+        # Answer on behalf of peers yet to answer
+        for pending in self.queries.expire():
+            self.gathered(pending)
+
+        # Acknowledge letters received since the last tick
+        for peer, number in self.inbox.flush():
+            self.acknowledge(peer, number)
+
+        # Catch up peers throttled for long enough
+        for peer, report in self.flow.expire():
+            self.catchup(peer, report)
+
+        if self.metrics.due():
+            self.send([chat.metrics.TOPIC,
+                       self.codec.dumps(chat.protocol.Envelope(
+                           author=self.address,
+                           payload=self.metrics.snapshot(),
+                           type='metrics'))])
+
+    def owns(self, peer):
+        """Return whether `peer` is served by this swarm"""
+        return self.federation is None or self.federation.owns(peer)
+
+    def forward(self, peer, envelope):
+        """Route `envelope` by the swarm serving `peer`"""
+        node = self.federation.owner(peer)
+        self.federation.relay(node,
+                              chat.federation.ROUTE,
+                              self.codec.dumps(envelope))
+
+    def gathered(self, pending):
+        """Answer the questioner of `pending` with results gathered"""
+        questioner = pending.query.questioner
+        envelope = chat.protocol.Envelope(
+            author=questioner,
+            payload=pending.results_for(self.address).to_dict(),
+            recipients=[questioner],
+            type='__queryResults__')
+
+        self.publish(envelope)
+
+    def place(self, order):
+        """Hold coffee `order`, handing it to the least loaded worker
+
+        Orders are held until a worker joins, if there are none.
+
+        """
+
+        chat.service.validate_coffee(order)
+        chat.service.orders.hold(order)
+
+        worker = self.dispatcher.assign(order.id)
+        if worker is not None:
+            self.brew(order.id, worker)
+
+        return order
+
+    def brew(self, order_id, worker):
+        """Hand order `order_id` to `worker` to be made"""
+        order = chat.service.orders[order_id]
+        envelope = chat.protocol.Envelope(
+            payload={'order': order.to_dict(),
+                     'recipe': 'coffee'},
+            recipients=[worker],
+            type='__brew__')
+
+        self.publish(envelope)
+
+    def on_peer_left(self, peer):
+        """Clear out the locker of `peer`"""
+        print "%s was disconnected" % peer
+        self.letters.discard(peer)
+        self.cache.discard(peer)
+        self.flow.forget(peer)
+        self.inbox.forget(peer)
+
+        # Orders in progress by `peer` are made by others
+        if self.dispatcher is not None:
+            for order_id, worker in self.dispatcher.leave(peer):
+                chat.service.orders.update(order_id, 'queued')
+                self.brew(order_id, worker)
+
+    def resume(self):
+        """Carry on making orders restored in flight, by their recipe
+
+        Orders handed to workers are made here instead, their
+        workers no longer known.
+
+        """
+
+        for order in chat.service.orders.values():
+            recipe = chat.orders.RECIPES.get(order.item.type)
+
+            if order.status != 'served' and recipe is not None:
+                chat.service.orders.resume(order.id, recipe)
+
+    def compact(self):
+        """Periodically replace journal with a snapshot of state"""
+        while True:
+            time.sleep(self.SNAPSHOT_INTERVAL)
+            self.snapshot()
+
+    def snapshot(self):
+        if self.journal.size():
+            self.journal.snapshot(self.state())
+
+    def state(self):
+        """Yield journal records representing current state"""
+        for letter in self.letters:
+            yield chat.journal.LETTER, self.codec.dumps(letter)
 
-            dead = []
-            for client, last_seen in self.heartbeats.iteritems():
+        for peer in list(self.peers):
+            yield chat.journal.PEER, peer.encode('utf-8')
 
-                # If peer is unresponsive for over self.KEEP_ALIVE
-                # seconds, consider him disconnected and clear
-                # out his locker.
-                if last_seen < (time.time() - self.KEEP_ALIVE):
-                    dead.append(client)
+        for order in chat.service.orders.values():
+            yield chat.journal.ORDER, self.codec.dumps(order)
 
-            for d in dead:
-                print "%s was disconnected" % d
-                self.heartbeats.pop(d, None)
-                self.letters.pop(d, None)
+    def persist(self, obj):
+        """Journal `obj`, if journaling is enabled
+
+        Arguments:
+            obj (object): Name of peer, letter or order
+
+        """
+
+        if self.journal is None:
+            return
+
+        if isinstance(obj, basestring):
+            self.journal.append(chat.journal.PEER, obj.encode('utf-8'))
+
+        elif isinstance(obj, chat.protocol.Order):
+            self.journal.append(chat.journal.ORDER, self.codec.dumps(obj))
+
+        else:
+            self.journal.append(chat.journal.LETTER, self.codec.dumps(obj))
 
     def publish(self, envelope):
-        """Physically publish `envelope`"""
-        dic = envelope.to_dict()
-        marshal = json.dumps(dic)
-        self.pub.send_multipart(['default', marshal])
+        """Physically publish `envelope`
+
+        Envelopes are encoded once and published once per recipient,
+        on the topic of each recipient, such that subscribers only
+        ever receive what is addressed to them. Envelopes without
+        recipients are broadcast on 'default'.
+
+        When federated, recipients owned by other swarms are relayed
+        to their owner, once per swarm.
+
+        """
+
+        if envelope.trace:
+            chat.tracing.mark(envelope, 'swarm.publish')
+
+        marshal = self.codec.dumps(envelope)
+
+        if not envelope.recipients:
+            return self.send(['default', marshal])
+
+        recipients = set(envelope.recipients)
+
+        if self.federation is not None:
+            recipients, remote = self.federation.partition(recipients)
+
+            for node in remote:
+                self.federation.relay(node, chat.journal.LETTER, marshal)
+                self.relayed.inc()
+
+        for recipient in recipients:
+            topic = chat.protocol.topic(recipient)
+            self.send([topic, marshal])
+            self.published.inc()
+
+    def send(self, frames):
+        """Send `frames` on the publishing socket, from any thread"""
+        if threading.current_thread() is not self._listener:
+            return self.fanin_socket().send_multipart(frames)
+
+        if self.batch is None:
+            return self.emit(frames)
+
+        topic, frames = frames[0], frames[1:]
+        for frame in frames:
+            self.batch.append(topic, frame)
+
+    def emit(self, frames):
+        """Publish `frames`, stamped with their serial, see `chat.flow`
+
+        Messages to peers suspended are held back, unstamped, such
+        that the peer sees no gap; letters held back are caught up
+        from the store once the peer is resumed.
+
+        """
+
+        if self.flow.suspended(frames[0]):
+            return
+
+        self.pub.send_multipart(self.sequencer.stamp(frames))
+
+    def lagging(self, peer, report):
+        """Act on `report` of messages missed by `peer`
+
+        Arguments:
+            peer (str): Name of peer
+            report (dict): As of `chat.flow.Tracker.report`, along
+                with the `epoch` and `sequence` of the last letter
+                seen before messages were missed
+
+        """
+
+        topic = chat.protocol.topic(peer)
+        action = self.flow.report(peer, self.sequencer.serial(topic), report)
+
+        if action == 'catchup':
+            self.catchup(peer, report)
+
+        elif action == 'throttle':
+            self.flow.suspend(peer, self.flow.pause)
+
+        elif action == 'disconnect':
+            envelope = chat.protocol.Envelope(
+                author=peer,
+                payload="Too slow to keep up, no longer sent messages; "
+                        "ask for state to resume",
+                recipients=[peer],
+                type='error')
+
+            # Suspended only once the notice has gone out
+            self.publish(envelope)
+            self.suspend(peer)
+
+    def accept(self, envelope):
+        """Return letters delivered by `envelope`, see `chat.reliable`
+
+        Letters sent reliably are delivered once and in order of
+        their author, possibly along with others held until now;
+        others are delivered as-is.
+
+        """
+
+        if not envelope.window:
+            return [envelope]
+
+        author = envelope.author
+        letters, ack = self.inbox.receive(envelope)
+
+        if ack is not None:
+            self.acknowledge(author, *ack)
+
+        return letters
+
+    def acknowledge(self, peer, number, gap=False):
+        """Acknowledge letters of `peer` up to `number`"""
+        envelope = chat.protocol.Envelope(author=peer,
+                                          payload={'number': number,
+                                                   'gap': gap},
+                                          recipients=[peer],
+                                          type='__ack__')
+        self.publish(envelope)
+
+    def suspend(self, peer):
+        """Stop publishing to `peer`, after what was sent so far"""
+        if threading.current_thread() is not self._listener:
+            return self.fanin_socket().send_multipart(
+                [self.FANIN_SUSPEND, peer.encode('utf-8')])
+
+        self.flow.suspend(peer)
+
+    def catchup(self, peer, report):
+        """Send `peer` letters stored since it last kept up"""
+        query = {'authors': None,
+                 'epoch': report.get('epoch'),
+                 'sequence': report.get('sequence')}
+
+        envelope = chat.protocol.Envelope(author=peer,
+                                          payload=query,
+                                          type='stateQuery')
+
+        chat.mediator.swarm.Factory.mediate(envelope.type, self, envelope)
+
+    def fanin_socket(self):
+        """Return the fan-in socket of the current thread"""
+        push = getattr(self._local, 'push', None)
+
+        if push is None:
+            push = context.socket(zmq.PUSH)
+            push.setsockopt(zmq.SNDHWM, self.hwms['push'])
+            push.connect("inproc://swarm-fanin-%i" % id(self))
+            self._local.push = push
+
+        return push
 
     def log(self, log):
-        dic = log.to_dict()
-        marshal = json.dumps(dic)
-        self.pub.send_multipart(['log', marshal])
+        """Queue `log` for publishing, see `chat.logs`"""
+        if threading.current_thread() is self._listener:
+            return self.logs.submit(log)
+
+        # Encoded here, batched by the listener
+        self.fanin_socket().send_multipart([self.FANIN_LOG,
+                                            self.codec.dumps(log)])
 
     def router(self, in_envelope):
         """Take incoming envelope, chat.process it, and send one back out"""
 
-        in_envelope.trace += ['Swarm.router']
+        if in_envelope.trace:
+            chat.tracing.mark(in_envelope, 'swarm.router')
 
-        log = chat.protocol.Log(
-            name='Swarm.router',
-            author=in_envelope.author,
-            level='info',
-            string='{} was received'.format(in_envelope.type),
-            trace=in_envelope.trace,
-            envelope=in_envelope)
+        if self.logs.wants('info', in_envelope.type):
+            log = chat.protocol.Log(
+                name='Swarm.router',
+                author=in_envelope.author,
+                level='info',
+                string='{} was received'.format(in_envelope.type),
+                envelope=in_envelope)
 
-        self.log(log)
+            self.log(log)
 
         type = in_envelope.type
-
-        factory = chat.mediator.swarm.Factory()
+        start = time.time() if self.metrics.enabled else None
 
         try:
-            factory.mediate(type, self, in_envelope)
+            chat.mediator.swarm.Factory.mediate(type, self, in_envelope)
         except ValueError as e:
+            self.errors.inc()
             print e
+
+        if start is not None:
+            self.metrics.histogram('route.%s.us' % type).add(
+                (time.time() - start) * 1e6)
+
+        if in_envelope.trace:
+            self.traced(in_envelope)
+
+    def traced(self, envelope):
+        """Publish hops of `envelope`, see `chat.tracing`"""
+        chat.tracing.mark(envelope, 'swarm.done')
+
+        if self.logs.wants('info', 'trace'):
+            self.log(chat.protocol.Log(name='trace',
+                                       author=envelope.author,
+                                       level='info',
+                                       string=envelope.type,
+                                       trace=envelope.trace))
@@ -0,0 +1,235 @@
+"""Latency of each hop taken by an envelope, sampled
+
+A traced envelope carries a list of integers, rather than names,
+starting with the microseconds at which it was sampled followed by
+a span id and an offset in microseconds per hop.
+     __________ ______ ________ ______ ________
+    |          |      |        |      |        |
+    |  origin  | span | offset | span | offset |  ...
+    |__________|______|________|______|________|
+
+Span ids are derived from the name of each hop, such that no table
+need be shared; names are known to whoever registered them, see
+`span`. Timestamps are monotonic, comparable across processes of
+the same host but not across hosts.
+
+Envelopes not sampled carry an empty list, and marking them costs
+next to nothing. Those of older peers carry names of hops instead,
+and are taken to be untraced.
+
+Usage:
+    >>> sampler = Sampler(rate=0.01)
+    >>> sampler.start(envelope, 'peer.send')
+    >>> mark(envelope, 'swarm.router')
+    >>> durations(envelope.trace)
+    [('peer.send', 153)]
+
+"""
+
+from __future__ import absolute_import
+
+# standard library
+import time
+import zlib
+import random
+import threading
+
+# local library
+import chat.metrics
+
+__all__ = [
+    'Sampler',
+    'Collector',
+    'span',
+    'name',
+    'mark',
+    'started',
+    'hops',
+    'durations',
+    'now',
+    'HOPS',
+]
+
+_spans = dict()  # Span id, by name
+_names = dict()  # Name, by span id
+
+# Hops of swarm and peer, in addition to each mediator
+HOPS = (
+    'peer.send',
+    'swarm.receive',
+    'swarm.router',
+    'swarm.publish',
+    'swarm.done',
+)
+
+
+def _clock():
+    """Return monotonic clock, in seconds"""
+    try:
+        return time.monotonic
+    except AttributeError:
+        pass
+
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long),
+                        ('tv_nsec', ctypes.c_long)]
+
+        library = (ctypes.util.find_library('rt') or
+                   ctypes.util.find_library('c'))
+        clock_gettime = ctypes.CDLL(library, use_errno=True).clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        CLOCK_MONOTONIC = 1
+        spec = timespec()
+
+        def monotonic():
+            clock_gettime(CLOCK_MONOTONIC, ctypes.byref(spec))
+            return spec.tv_sec + spec.tv_nsec * 1e-9
+
+        monotonic()
+        return monotonic
+
+    except (ImportError, OSError, AttributeError, TypeError):
+        return time.time  # Not monotonic, better than nothing
+
+
+_monotonic = _clock()
+
+
+def now():
+    """Return monotonic microseconds"""
+    return int(_monotonic() * 1e6)
+
+
+def span(name):
+    """Return span id of hop `name`, registering its name"""
+    try:
+        return _spans[name]
+    except KeyError:
+        span_id = zlib.crc32(name) & 0x7fffffff
+        _spans[name] = span_id
+        _names[span_id] = name
+        return span_id
+
+
+for _hop in HOPS:
+    span(_hop)
+
+
+def name(span_id):
+    """Return name of `span_id`, if registered here"""
+    return _names.get(span_id, '#%08x' % span_id)
+
+
+def started(trace):
+    """Return whether `trace` was started by `Sampler`
+
+    Traces of older peers are lists of names of hops, rather than
+    starting with the microseconds at which they were sampled.
+
+    """
+
+    return bool(trace) and type(trace[0]) in (int, long)
+
+
+def mark(envelope, hop):
+    """Record `hop` of `envelope`, if sampled"""
+    trace = envelope.trace
+    if started(trace):
+        trace.append(span(hop))
+        trace.append(now() - trace[0])
+
+
+def hops(trace):
+    """Return (name, offset in microseconds) of each hop of `trace`"""
+    return [(name(trace[index]), trace[index + 1])
+            for index in xrange(1, len(trace) - 1, 2)]
+
+
+def durations(trace):
+    """Return (name, microseconds until the next hop) of `trace`"""
+    hops_ = hops(trace)
+    return [(hop, next_offset - offset)
+            for (hop, offset), (_, next_offset)
+            in zip(hops_, hops_[1:])]
+
+
+class Sampler(object):
+    """Start traces of a fraction of envelopes
+
+    Arguments:
+        rate (float): Fraction of envelopes traced, 0 to 1
+
+    """
+
+    def __init__(self, rate=0.0):
+        self.rate = rate
+
+    def start(self, envelope, hop):
+        """Start tracing `envelope` at `hop`, if sampled
+
+        Envelopes already traced, e.g. sampled by their sender,
+        are marked instead. Traces of older peers are dropped,
+        such that hops that follow see the envelope as untraced.
+
+        """
+
+        if started(envelope.trace):
+            return mark(envelope, hop)
+
+        envelope.trace = list()
+
+        if self.rate and random.random() < self.rate:
+            envelope.trace = [now(), span(hop), 0]
+
+
+class Collector(object):
+    """Histograms of microseconds spent per hop, from traces
+
+    Thread-safe.
+
+    """
+
+    def __init__(self, precision=16):
+        self.precision = precision
+        self.histograms = dict()  # Histogram, by name of hop
+        self.traces = 0
+        self._lock = threading.Lock()
+
+    def add(self, trace):
+        with self._lock:
+            self.traces += 1
+
+            for hop, duration in durations(trace):
+                try:
+                    histogram = self.histograms[hop]
+                except KeyError:
+                    histogram = chat.metrics.Histogram(hop, self.precision)
+                    self.histograms[hop] = histogram
+
+                histogram.add(duration)
+
+    def report(self):
+        """Return table of hops, slowest at p99 first"""
+        with self._lock:
+            rows = [(hop,
+                     histogram.count,
+                     histogram.percentile(0.5),
+                     histogram.percentile(0.99),
+                     histogram.max)
+                    for hop, histogram in self.histograms.items()]
+
+        rows.sort(key=lambda row: row[3], reverse=True)
+
+        template = "{:<32} {:>8} {:>10} {:>10} {:>10}"
+        lines = [template.format('hop', 'count',
+                                 'p50 (us)', 'p99 (us)', 'max (us)')]
+
+        for row in rows:
+            lines.append(template.format(*row))
+
+        return '\n'.join(lines)